@@ -9,8 +9,11 @@ https://docs.djangoproject.com/en/3.1/howto/deployment/asgi/
 
 import os
 
+from django.contrib.staticfiles.handlers import ASGIStaticFilesHandler
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+os.environ.setdefault('SHORTNER_ASYNC_REDIRECT', 'True')
 
-application = get_asgi_application()
+# WhiteNoise is sync-only, so static files are served here instead
+application = ASGIStaticFilesHandler(get_asgi_application())
@@ -46,7 +46,9 @@ INSTALLED_APPS = [
 
 
 MIDDLEWARE = [
+    "shortner.middleware.InstrumentationMiddleware",  # No-op unless SHORTNER_METRICS
     "django.middleware.security.SecurityMiddleware",
+    "shortner.middleware.RedirectFastPathMiddleware",  # Short links skip the rest
     "whitenoise.middleware.WhiteNoiseMiddleware",  # For Heroku static files
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -56,6 +58,18 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
+# Set by config.asgi: serve redirects from the async view. WhiteNoise's
+# middleware is sync-only, so under ASGI static files are served by
+# config.asgi instead and the middleware is left out.
+SHORTNER_ASYNC_REDIRECT = os.environ.get("SHORTNER_ASYNC_REDIRECT", "False") == "True"
+
+# Resolve short links in RedirectFastPathMiddleware, ahead of the
+# session/CSRF/auth/messages/static middleware
+SHORTNER_REDIRECT_FAST_PATH = os.environ.get("SHORTNER_REDIRECT_FAST_PATH", "True") == "True"
+
+if SHORTNER_ASYNC_REDIRECT:
+    MIDDLEWARE.remove("whitenoise.middleware.WhiteNoiseMiddleware")
+
 ROOT_URLCONF = "config.urls"
 
 
@@ -63,7 +77,6 @@ TEMPLATES = [
     {
         "BACKEND": "django.template.backends.django.DjangoTemplates",
         "DIRS": [BASE_DIR / "templates"],
-        "APP_DIRS": True,
         "OPTIONS": {
             "context_processors": [
                 "django.template.context_processors.debug",
@@ -71,23 +84,261 @@ TEMPLATES = [
                 "django.contrib.auth.context_processors.auth",
                 "django.contrib.messages.context_processors.messages",
             ],
+            # Templates are compiled once per process; the dev server's
+            # autoreloader clears the cache when a template changes
+            "loaders": [
+                ("django.template.loaders.cached.Loader", [
+                    "django.template.loaders.filesystem.Loader",
+                    "django.template.loaders.app_directories.Loader",
+                ]),
+            ],
         },
     },
 ]
 
 WSGI_APPLICATION = "config.wsgi.application"
+ASGI_APPLICATION = "config.asgi.application"
 
 # -------------------------------------------------
 # Database
 # -------------------------------------------------
 
+# Seconds a connection is reused (0 = reconnect per request); see
+# "Database Connections" below for pooling
+DATABASE_CONN_MAX_AGE = int(os.environ.get("DATABASE_CONN_MAX_AGE", "600"))
+
 DATABASES = {
     "default": dj_database_url.config(
         default=f"sqlite:///{BASE_DIR / 'db.sqlite3'}",
-        conn_max_age=600
+        conn_max_age=DATABASE_CONN_MAX_AGE
     )
 }
 
+# Read replicas: DATABASE_REPLICA_URLS="postgres://...,postgres://..." become
+# the aliases replica1, replica2, ... used for dashboard/analytics/admin reads
+# (see shortner/replicas.py). config/settings_test.py adds one for tests.
+replica_urls = [url.strip() for url in os.environ.get("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+for index, url in enumerate(replica_urls, 1):
+    DATABASES[f"replica{index}"] = dj_database_url.parse(url, conn_max_age=DATABASE_CONN_MAX_AGE)
+    DATABASES[f"replica{index}"]["TEST"] = {"MIRROR": "default"}
+
+SHORTNER_READ_REPLICAS = [f"replica{index}" for index in range(1, len(replica_urls) + 1)]
+
+# Link shards: DATABASE_SHARD_URLS="postgres://...,postgres://..." become the
+# aliases shard0, shard1, ... holding links and their clicks, placed by a
+# hash of the short code (see shortner/sharding.py). Users and sessions stay
+# on default. Run "migrate --database=shardN" for each shard; the order and
+# number of shards must not change once links are stored.
+# config/settings_test.py adds two for tests.
+shard_urls = [url.strip() for url in os.environ.get("DATABASE_SHARD_URLS", "").split(",") if url.strip()]
+for index, url in enumerate(shard_urls):
+    DATABASES[f"shard{index}"] = dj_database_url.parse(url, conn_max_age=DATABASE_CONN_MAX_AGE)
+
+SHORTNER_DATABASE_SHARDS = [f"shard{index}" for index in range(len(shard_urls))]
+# Link ids each worker reserves at a time while sharding
+SHORTNER_LINK_ID_BLOCK_SIZE = int(os.environ.get("SHORTNER_LINK_ID_BLOCK_SIZE", "100"))
+
+DATABASE_ROUTERS = ["shortner.sharding.ShardRouter", "shortner.replicas.ReplicaRouter"]
+
+# Seconds a user reads from the primary after a write, the replication lag
+# beyond which a replica is skipped, and how often lag is checked
+SHORTNER_REPLICA_PIN_SECONDS = float(os.environ.get("SHORTNER_REPLICA_PIN_SECONDS", "10"))
+SHORTNER_REPLICA_MAX_LAG = float(os.environ.get("SHORTNER_REPLICA_MAX_LAG", "5"))
+SHORTNER_REPLICA_CHECK_INTERVAL = float(os.environ.get("SHORTNER_REPLICA_CHECK_INTERVAL", "5"))
+
+# -------------------------------------------------
+# Cache
+# -------------------------------------------------
+# Local memory by default; point CACHE_BACKEND / CACHE_LOCATION at a
+# shared backend (e.g. Redis) so all workers share resolved short codes.
+# Rendered dashboard cards and click rows ({% cache %} in
+# templates/shortner) stay in per-worker memory: a page reads dozens of
+# fragments, which would be as many round trips to a shared cache.
+
+SHORTNER_FRAGMENT_CACHE_TTL = int(os.environ.get("SHORTNER_FRAGMENT_CACHE_TTL", "3600"))
+SHORTNER_FRAGMENT_CACHE_SIZE = int(os.environ.get("SHORTNER_FRAGMENT_CACHE_SIZE", "20000"))
+
+CACHES = {
+    "default": {
+        "BACKEND": os.environ.get(
+            "CACHE_BACKEND",
+            "django.core.cache.backends.locmem.LocMemCache"
+        ),
+        "LOCATION": os.environ.get("CACHE_LOCATION", ""),
+    },
+    "template_fragments": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "shortner-template-fragments",
+        "OPTIONS": {"MAX_ENTRIES": SHORTNER_FRAGMENT_CACHE_SIZE},
+    },
+}
+
+# -------------------------------------------------
+# Short URL Redirect Cache
+# -------------------------------------------------
+
+SHORTNER_CACHE_ALIAS = os.environ.get("SHORTNER_CACHE_ALIAS", "default")
+SHORTNER_LOCAL_CACHE_SIZE = int(os.environ.get("SHORTNER_LOCAL_CACHE_SIZE", "10000"))
+SHORTNER_LOCAL_CACHE_TTL = int(os.environ.get("SHORTNER_LOCAL_CACHE_TTL", "5"))
+SHORTNER_SHARED_CACHE_TTL = int(os.environ.get("SHORTNER_SHARED_CACHE_TTL", "300"))
+SHORTNER_NEGATIVE_CACHE_TTL = int(os.environ.get("SHORTNER_NEGATIVE_CACHE_TTL", "30"))
+
+# Per-worker Bloom filter of existing codes: unknown codes 404 without a
+# query. Capacity grows with the table on each rebuild; see shortner/bloom.py.
+SHORTNER_BLOOM_FILTER = os.environ.get("SHORTNER_BLOOM_FILTER", "True") == "True"
+SHORTNER_BLOOM_CAPACITY = int(os.environ.get("SHORTNER_BLOOM_CAPACITY", "1000000"))
+SHORTNER_BLOOM_ERROR_RATE = float(os.environ.get("SHORTNER_BLOOM_ERROR_RATE", "0.001"))
+SHORTNER_BLOOM_REFRESH_INTERVAL = float(os.environ.get("SHORTNER_BLOOM_REFRESH_INTERVAL", "5"))
+SHORTNER_BLOOM_REBUILD_INTERVAL = float(os.environ.get("SHORTNER_BLOOM_REBUILD_INTERVAL", "3600"))
+SHORTNER_BLOOM_RECHECK_INTERVAL = float(os.environ.get("SHORTNER_BLOOM_RECHECK_INTERVAL", "1"))
+
+# -------------------------------------------------
+# Edge Caching
+# -------------------------------------------------
+# Seconds browsers and the CDN may cache a redirect when the link sets no
+# max-age of its own (301 links use the permanent default). The CDN may
+# keep cacheable redirects for SURROGATE_MAX_AGE, since edits purge them;
+# see shortner/edge.py.
+
+SHORTNER_REDIRECT_MAX_AGE = int(os.environ.get("SHORTNER_REDIRECT_MAX_AGE", "0"))
+SHORTNER_PERMANENT_REDIRECT_MAX_AGE = int(os.environ.get("SHORTNER_PERMANENT_REDIRECT_MAX_AGE", "86400"))
+SHORTNER_SURROGATE_MAX_AGE = int(os.environ.get("SHORTNER_SURROGATE_MAX_AGE", "86400"))
+
+# Surrogate-key purges on edit/delete: shortner.edge.NullPurgeBackend,
+# LocalPurgeBackend (in memory) or HTTPPurgeBackend (POST to PURGE_URL)
+SHORTNER_PURGE_BACKEND = os.environ.get("SHORTNER_PURGE_BACKEND", "shortner.edge.NullPurgeBackend")
+SHORTNER_PURGE_URL = os.environ.get("SHORTNER_PURGE_URL", "")
+SHORTNER_PURGE_TOKEN = os.environ.get("SHORTNER_PURGE_TOKEN", "")
+SHORTNER_PURGE_TIMEOUT = float(os.environ.get("SHORTNER_PURGE_TIMEOUT", "5"))
+
+# Count clicks on cacheable redirects from edge reports (beacon endpoint
+# or `manage.py ingest_edge_logs`) instead of at the origin. The beacon
+# needs "Authorization: Bearer <SHORTNER_EDGE_TOKEN>".
+SHORTNER_EDGE_CLICKS = os.environ.get("SHORTNER_EDGE_CLICKS", "False") == "True"
+SHORTNER_EDGE_TOKEN = os.environ.get("SHORTNER_EDGE_TOKEN", "")
+
+# -------------------------------------------------
+# Redirect Snapshots
+# -------------------------------------------------
+# `manage.py export_redirect_snapshot` writes active links to a mmap-able
+# file; REDIRECT_ONLY nodes serve redirects from it with no database
+# access (and record no clicks). CHANGELOG records changed codes on the
+# origin for `export_redirect_snapshot --delta`; see shortner/snapshot.py.
+
+SHORTNER_REDIRECT_ONLY = os.environ.get("SHORTNER_REDIRECT_ONLY", "False") == "True"
+SHORTNER_SNAPSHOT_PATH = os.environ.get("SHORTNER_SNAPSHOT_PATH", str(BASE_DIR / "redirects.snapshot"))
+SHORTNER_SNAPSHOT_LOOKUP = os.environ.get("SHORTNER_SNAPSHOT_LOOKUP", "hash")  # or "binary"
+SHORTNER_SNAPSHOT_CHECK_INTERVAL = float(os.environ.get("SHORTNER_SNAPSHOT_CHECK_INTERVAL", "1"))
+SHORTNER_SNAPSHOT_CHANGELOG = os.environ.get("SHORTNER_SNAPSHOT_CHANGELOG", "False") == "True"
+
+# -------------------------------------------------
+# Short Code Generation
+# -------------------------------------------------
+# shortner.codes.HashidsCodeGenerator / SequenceCodeGenerator / RandomCodeGenerator
+
+SHORTNER_CODE_GENERATOR = os.environ.get(
+    "SHORTNER_CODE_GENERATOR",
+    "shortner.codes.HashidsCodeGenerator"
+)
+SHORTNER_CODE_LENGTH = int(os.environ.get("SHORTNER_CODE_LENGTH", "6"))
+SHORTNER_CODE_SALT = os.environ.get("SHORTNER_CODE_SALT", SECRET_KEY)
+SHORTNER_CODE_BLOCK_SIZE = int(os.environ.get("SHORTNER_CODE_BLOCK_SIZE", "1000"))
+SHORTNER_CODE_MAX_ATTEMPTS = int(os.environ.get("SHORTNER_CODE_MAX_ATTEMPTS", "5"))
+
+# Links per dashboard page (keyset paginated)
+SHORTNER_DASHBOARD_PAGE_SIZE = int(os.environ.get("SHORTNER_DASHBOARD_PAGE_SIZE", "50"))
+
+# Scheme and host short links are built on, e.g. "https://sho.rt"
+# (empty = the host of the current request)
+SHORTNER_SHORT_DOMAIN = os.environ.get("SHORTNER_SHORT_DOMAIN", "")
+
+# Seconds a dashboard page is kept in the shared cache; dropped on
+# create/edit/delete and when click counts change (0 = no caching)
+SHORTNER_DASHBOARD_CACHE_TTL = int(os.environ.get("SHORTNER_DASHBOARD_CACHE_TTL", "300"))
+
+# Serve the dashboard as a shell and load its cards from /dashboard/json/
+SHORTNER_DASHBOARD_SHELL = os.environ.get("SHORTNER_DASHBOARD_SHELL", "False") == "True"
+
+# Clicks per page on the click log, and rows fetched per round trip when exporting
+SHORTNER_CLICKS_PAGE_SIZE = int(os.environ.get("SHORTNER_CLICKS_PAGE_SIZE", "100"))
+SHORTNER_EXPORT_CHUNK_SIZE = int(os.environ.get("SHORTNER_EXPORT_CHUNK_SIZE", "2000"))
+
+# Rows per bulk_create / transaction for the bulk creation endpoint
+SHORTNER_BULK_CHUNK_SIZE = int(os.environ.get("SHORTNER_BULK_CHUNK_SIZE", "1000"))
+
+# -------------------------------------------------
+# Click Logging
+# -------------------------------------------------
+# Clicks are queued in-process and written in batches by a background thread.
+
+SHORTNER_CLICK_ASYNC = os.environ.get("SHORTNER_CLICK_ASYNC", "True") == "True"
+SHORTNER_CLICK_BATCH_SIZE = int(os.environ.get("SHORTNER_CLICK_BATCH_SIZE", "500"))
+SHORTNER_CLICK_FLUSH_INTERVAL = float(os.environ.get("SHORTNER_CLICK_FLUSH_INTERVAL", "1.0"))
+SHORTNER_CLICK_QUEUE_SIZE = int(os.environ.get("SHORTNER_CLICK_QUEUE_SIZE", "10000"))
+SHORTNER_CLICK_DROP_POLICY = os.environ.get("SHORTNER_CLICK_DROP_POLICY", "drop_newest")
+
+# Click counts are spread over N rows per link and folded into
+# Url.click_count every FOLD_INTERVAL seconds (1 = update Url directly)
+SHORTNER_CLICK_COUNTER_SHARDS = int(os.environ.get("SHORTNER_CLICK_COUNTER_SHARDS", "8"))
+SHORTNER_CLICK_COUNTER_FOLD_INTERVAL = float(os.environ.get("SHORTNER_CLICK_COUNTER_FOLD_INTERVAL", "5"))
+
+# Estimate unique visitors (ip + user agent) per link with HyperLogLog
+# sketches updated as clicks are written; see shortner/visitors.py
+SHORTNER_UNIQUE_VISITORS = os.environ.get("SHORTNER_UNIQUE_VISITORS", "True") == "True"
+
+# -------------------------------------------------
+# Click Storage
+# -------------------------------------------------
+# Deleted links have their clicks purged in the background in chunks.
+# On PostgreSQL clicks are partitioned by month; see `manage.py click_partitions`.
+
+SHORTNER_PURGE_ASYNC = os.environ.get("SHORTNER_PURGE_ASYNC", "True") == "True"
+SHORTNER_PURGE_CHUNK_SIZE = int(os.environ.get("SHORTNER_PURGE_CHUNK_SIZE", "5000"))
+SHORTNER_CLICK_PARTITIONS_AHEAD = int(os.environ.get("SHORTNER_CLICK_PARTITIONS_AHEAD", "3"))
+SHORTNER_CLICK_RETENTION_MONTHS = int(os.environ.get("SHORTNER_CLICK_RETENTION_MONTHS", "0"))
+SHORTNER_CLICK_ARCHIVE_DIR = os.environ.get("SHORTNER_CLICK_ARCHIVE_DIR", "")
+
+# -------------------------------------------------
+# Admin
+# -------------------------------------------------
+# Changelists count rows exactly up to this many and show the planner's
+# estimate beyond it (PostgreSQL), instead of a COUNT(*) over every row
+
+SHORTNER_ADMIN_EXACT_COUNT_LIMIT = int(os.environ.get("SHORTNER_ADMIN_EXACT_COUNT_LIMIT", "10000"))
+
+# -------------------------------------------------
+# User Agent Parsing
+# -------------------------------------------------
+# "request" parses while redirecting (memoized), "writer" defers it to the
+# click batch writer, "offline" leaves it to `manage.py parse_user_agents`.
+
+SHORTNER_UA_PARSING = os.environ.get("SHORTNER_UA_PARSING", "request")
+SHORTNER_UA_CACHE_SIZE = int(os.environ.get("SHORTNER_UA_CACHE_SIZE", "4096"))
+
+# Hits from bots and link-preview crawlers are counted per link per day
+# instead of stored as clicks. A UA is a bot if user_agents flags it or it
+# matches one of these comma-separated regular expressions (case-insensitive).
+SHORTNER_BOT_FILTERING = os.environ.get("SHORTNER_BOT_FILTERING", "True") == "True"
+SHORTNER_BOT_PATTERNS = [
+    pattern for pattern in os.environ.get(
+        "SHORTNER_BOT_PATTERNS",
+        r"bot\b,crawl,spider,slurp,facebookexternalhit,embedly,preview,vkshare,pinterest,"
+        r"uptime,pingdom,statuscake,site24x7,monitor,headless,python-requests,python-urllib,"
+        r"curl/,wget/,go-http-client,okhttp,axios/,node-fetch,java/",
+    ).split(",") if pattern
+]
+
+# -------------------------------------------------
+# Instrumentation
+# -------------------------------------------------
+# Per-request DB/cache/UA timings for a sample of requests, exposed as
+# Server-Timing headers and Prometheus metrics at /internal/metrics/.
+
+SHORTNER_METRICS = os.environ.get("SHORTNER_METRICS", "False") == "True"
+SHORTNER_METRICS_SAMPLE_RATE = float(os.environ.get("SHORTNER_METRICS_SAMPLE_RATE", "1.0"))
+SHORTNER_SERVER_TIMING = os.environ.get("SHORTNER_SERVER_TIMING", "False") == "True"
+SHORTNER_METRICS_TOKEN = os.environ.get("SHORTNER_METRICS_TOKEN", "")
+
 # -------------------------------------------------
 # Password Validation
 # -------------------------------------------------
@@ -138,4 +389,42 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 # Heroku Settings
 # -------------------------------------------------
 
-django_heroku.settings(locals())
+base_middleware = list(MIDDLEWARE)
+django_heroku.settings(locals(), staticfiles=not SHORTNER_ASYNC_REDIRECT)
+# django_heroku prepends a second WhiteNoiseMiddleware ahead of everything
+# (including the redirect fast path); keep the stack defined above
+MIDDLEWARE = base_middleware
+
+# -------------------------------------------------
+# Database Connections
+# -------------------------------------------------
+# Applied to PostgreSQL databases after django_heroku, which resets the
+# default database. DATABASE_POOL=True gives each worker process a
+# connection pool per database (psycopg 3); connections are checked on
+# checkout and returned at the end of each request. Otherwise each thread
+# keeps its connection for DATABASE_CONN_MAX_AGE seconds, health-checked
+# before reuse. Use the pool under ASGI: persistent connections are
+# per-thread and async views run in a thread pool.
+
+DATABASE_POOL = os.environ.get("DATABASE_POOL", "False") == "True"
+DATABASE_POOL_MIN_SIZE = int(os.environ.get("DATABASE_POOL_MIN_SIZE", "2"))
+DATABASE_POOL_MAX_SIZE = int(os.environ.get("DATABASE_POOL_MAX_SIZE", "10"))
+# Seconds a request waits for a free connection before failing
+DATABASE_POOL_TIMEOUT = float(os.environ.get("DATABASE_POOL_TIMEOUT", "10"))
+# Seconds an idle connection above min size is kept
+DATABASE_POOL_MAX_IDLE = float(os.environ.get("DATABASE_POOL_MAX_IDLE", "300"))
+
+for database in DATABASES.values():
+    if database["ENGINE"] != "django.db.backends.postgresql":
+        continue
+    database["CONN_HEALTH_CHECKS"] = True
+    if DATABASE_POOL:
+        database["CONN_MAX_AGE"] = 0
+        database.setdefault("OPTIONS", {})["pool"] = {
+            "min_size": DATABASE_POOL_MIN_SIZE,
+            "max_size": DATABASE_POOL_MAX_SIZE,
+            "timeout": DATABASE_POOL_TIMEOUT,
+            "max_idle": DATABASE_POOL_MAX_IDLE,
+        }
+    else:
+        database["CONN_MAX_AGE"] = DATABASE_CONN_MAX_AGE
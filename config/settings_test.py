@@ -0,0 +1,32 @@
+"""
+Settings for the test suite:
+
+    python manage.py test --settings=config.settings_test
+
+Adds database aliases that only tests use. Under the regular settings the
+tests needing them are skipped.
+"""
+
+from .settings import *  # noqa: F401,F403
+from .settings import DATABASES, replica_urls, shard_urls
+
+# -------------------------------------------------
+# Test Databases
+# -------------------------------------------------
+
+# A copy: test discovery may import this module under the regular settings
+DATABASES = {**DATABASES}
+
+# A replica alias mirroring default, so replica routing can be tested by
+# overriding SHORTNER_READ_REPLICAS
+if not replica_urls:
+    DATABASES["replica1"] = {**DATABASES["default"], "TEST": {"MIRROR": "default"}}
+
+# Two shard aliases with their own test databases, so sharding can be
+# tested by overriding SHORTNER_DATABASE_SHARDS
+if not shard_urls:
+    for index in range(2):
+        DATABASES[f"shard{index}"] = {
+            **DATABASES["default"],
+            "NAME": f"{DATABASES['default']['NAME']}_shard{index}",
+        }
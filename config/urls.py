@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path, include
 
@@ -5,4 +6,8 @@ urlpatterns = [
     path('admin/', admin.site.urls),          # ✅ correct
     path('', include('shortner.urls')),  # ✅ correct
     path('accounts/', include('users.urls')),
-]
\ No newline at end of file
+]
+
+# Redirect-only nodes have no database: no admin or accounts
+if settings.SHORTNER_REDIRECT_ONLY:
+    urlpatterns = [path('', include('shortner.urls'))]
@@ -1,15 +1,207 @@
+from django import forms
+from django.conf import settings
 from django.contrib import admin
-from .models import Url, UrlClick
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.db.models import Q
+from django.http import QueryDict
+from .models import Url, UrlClick, ClickRollup
 from django.utils.html import format_html
+from . import sharding
+from .pagination import EstimatedCountPaginator
+from .replicas import ReplicaReadsAdmin
+
+SHARD_PARAM = 'shard'
+
+
+def search_code(search_term):
+    """The short code in a search term (a bare code or a short URL)"""
+    return search_term.strip().rstrip('/').rsplit('/', 1)[-1]
+
+
+# ================================
+# Changelist filters
+# ================================
+class AutocompleteFilter(admin.RelatedFieldListFilter):
+    """
+    Foreign key filter rendered as an autocomplete select: only the chosen
+    object is loaded, the rest are searched through the related model's
+    admin (which needs ``search_fields``)
+    """
+    template = 'admin/shortner/autocomplete_filter.html'
+
+    def field_choices(self, field, request, model_admin):
+        return []
+
+    def has_output(self):
+        return True
+
+    def choices(self, changelist):
+        value = self.lookup_val[-1] if self.lookup_val else None
+        model = self.field.remote_field.model
+        using = None
+        if sharding.enabled() and sharding.is_sharded(model):
+            # A link is loaded from the shard its id points to
+            using = (sharding.for_id(value) if value else None) or changelist.queryset.db
+        field = forms.ModelChoiceField(
+            queryset=model._default_manager.using(using),
+            widget=AutocompleteSelect(self.field, changelist.model_admin.admin_site, using=using),
+            required=False,
+        )
+        yield {
+            'selected': value is not None,
+            'widget': field.widget.render(self.lookup_kwarg, value, attrs={
+                'id': f'filter-{self.field_path}',
+                'style': 'width: 100%',
+                'data-filter-url': changelist.get_query_string(
+                    {self.lookup_kwarg: '__value__'}, [self.lookup_kwarg_isnull]
+                ),
+                'data-clear-url': changelist.get_query_string(
+                    remove=[self.lookup_kwarg, self.lookup_kwarg_isnull]
+                ),
+            }),
+        }
+
+
+class RollupValuesFilter(admin.AllValuesFieldListFilter):
+    """Click dimension filter offering the values seen in daily rollups, not a DISTINCT over every click"""
+
+    def __init__(self, field, request, params, model, model_admin, field_path):
+        super().__init__(field, request, params, model, model_admin, field_path)
+        self.lookup_choices = (
+            ClickRollup.objects.using(model_admin.shard(request)).filter(period=ClickRollup.DAY)
+            .exclude(**{field.name: ClickRollup.ALL})
+            .exclude(**{field.name: ''})
+            .order_by(field.name)
+            .values_list(field.name, flat=True)
+            .distinct()
+        )
+
+
+class ShardFilter(admin.SimpleListFilter):
+    """The database shard a sharded changelist shows (one at a time; the first by default)"""
+    title = 'shard'
+    parameter_name = SHARD_PARAM
+
+    def lookups(self, request, model_admin):
+        return [(alias, alias) for alias in settings.SHORTNER_DATABASE_SHARDS]
+
+    def queryset(self, request, queryset):
+        # ShardedAdmin.get_queryset already reads from the shard
+        return queryset
+
+    def choices(self, changelist):
+        current = self.value() or settings.SHORTNER_DATABASE_SHARDS[0]
+        for alias, title in self.lookup_choices:
+            yield {
+                'selected': alias == current,
+                'query_string': changelist.get_query_string({self.parameter_name: alias}),
+                'display': title,
+            }
+
+
+class ShardedAdmin:
+    """
+    ModelAdmin mixin for models stored on the database shards: querysets,
+    related lookups and saves use one shard, picked by ``?shard=`` (kept
+    through the changelist filters), a link's id, or else the first shard.
+    Nothing changes when sharding is off.
+    """
+
+    def selected_shard(self, request):
+        """The shard chosen in the request, or None"""
+        alias = request.GET.get(SHARD_PARAM)
+        if alias is None:
+            alias = QueryDict(request.GET.get('_changelist_filters', '')).get(SHARD_PARAM)
+        return alias if alias in settings.SHORTNER_DATABASE_SHARDS else None
+
+    def shard(self, request):
+        if not sharding.enabled():
+            return None
+        match = request.resolver_match
+        object_id = match.kwargs.get('object_id') if match else None
+        if object_id and self.model is Url and sharding.for_id(object_id):
+            return sharding.for_id(object_id)
+        return self.selected_shard(request) or settings.SHORTNER_DATABASE_SHARDS[0]
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).using(self.shard(request))
+
+    def get_list_filter(self, request):
+        list_filter = super().get_list_filter(request)
+        return (ShardFilter, *list_filter) if sharding.enabled() else list_filter
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if sharding.enabled() and sharding.is_sharded(db_field.related_model):
+            kwargs['using'] = self.shard(request)
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+    def save_model(self, request, obj, form, change):
+        # A new click is stored on the shard of its link
+        url_id = getattr(obj, 'url_id', None)
+        alias = (sharding.for_id(url_id) if url_id else None) or self.shard(request)
+        with sharding.use(alias):
+            super().save_model(request, obj, form, change)
+
+    def get_deleted_objects(self, objs, request):
+        # The delete confirmation collects related rows without an instance to route by
+        with sharding.use(self.shard(request)):
+            return super().get_deleted_objects(objs, request)
+
+    def search_shard(self, request, queryset, code):
+        """Search on the code's shard unless one was chosen"""
+        if sharding.enabled() and self.selected_shard(request) is None:
+            return queryset.using(sharding.for_code(code))
+        return queryset
+
+
+class LargeTableAdmin(ReplicaReadsAdmin, admin.ModelAdmin):
+    """
+    Changelist settings for tables with millions of rows: estimated page
+    counts, no second COUNT(*) for the unfiltered total and no facet counts
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    show_facets = admin.ShowFacets.NEVER
+
+    @property
+    def media(self):
+        # select2 and the admin autocomplete script (the same for any field)
+        autocomplete = AutocompleteSelect(Url._meta.get_field('user'), self.admin_site).media
+        return super().media + autocomplete + forms.Media(js=['js/admin_autocomplete_filter.js'])
+
 
 # Url admin
 @admin.register(Url)
-class UrlAdmin(admin.ModelAdmin):
-    list_display = ('id', 'short_url_admin', 'link_preview', 'user', 'click_count', 'is_active', 'created_at')
+class UrlAdmin(ShardedAdmin, LargeTableAdmin):
+    list_display = ('id', 'short_url_admin', 'link_preview', 'user', 'click_count', 'redirect_type', 'is_active', 'created_at')
     list_display_links = ('short_url_admin', 'link_preview')
-    search_fields = ('uuid', 'link', 'user__username')
-    list_filter = ('is_active', 'created_at', 'user')
-    ordering = ('-created_at',)
+    list_select_related = ('user',)
+    search_fields = ('uuid', 'link')
+    search_help_text = "A short code or short URL, or part of the original link (3+ characters)"
+    list_filter = ('is_active', 'redirect_type', 'created_at', ('user', AutocompleteFilter))
+    autocomplete_fields = ('user',)
+    # Newest first by primary key (no created_at index outside a user's links)
+    ordering = ('-id',)
+
+    def get_search_results(self, request, queryset, search_term):
+        # Codes are case-sensitive: match them exactly (unique index) and
+        # links by substring (trigram index on PostgreSQL, migration 0012)
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        code = search_code(term)
+        condition = Q(uuid=code)
+        if len(term) >= 3:
+            condition |= Q(link__icontains=term)
+        return self.search_shard(request, queryset, code).filter(condition), False
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        # Users are on the default database: no join, one extra query per page
+        return queryset.prefetch_related('user') if sharding.enabled() else queryset
+
+    def get_list_select_related(self, request):
+        return () if sharding.enabled() else super().get_list_select_related(request)
 
     def link_preview(self, obj):
         return format_html('<a href="{}" target="_blank">{}</a>', obj.link, obj.link)
@@ -22,8 +214,24 @@ class UrlAdmin(admin.ModelAdmin):
 
 # UrlClick admin
 @admin.register(UrlClick)
-class UrlClickAdmin(admin.ModelAdmin):
+class UrlClickAdmin(ShardedAdmin, LargeTableAdmin):
     list_display = ('id', 'url', 'ip_address', 'browser', 'platform', 'device', 'created_at')
-    search_fields = ('url__uuid', 'ip_address', 'browser', 'platform', 'device')
-    list_filter = ('created_at', 'platform', 'browser')
-    ordering = ('-created_at',)
\ No newline at end of file
+    list_select_related = ('url',)
+    search_fields = ('url__uuid',)
+    search_help_text = "A short code or short URL"
+    list_filter = (
+        'created_at',
+        ('platform', RollupValuesFilter),
+        ('browser', RollupValuesFilter),
+        ('url', AutocompleteFilter),
+    )
+    autocomplete_fields = ('url',)
+    # Newest first by primary key: an index scan per partition, where
+    # ORDER BY created_at would sort every click
+    ordering = ('-id',)
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        code = search_code(search_term)
+        return self.search_shard(request, queryset, code).filter(url__uuid=code), False
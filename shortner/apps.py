@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class ShortnerConfig(AppConfig):
     name = 'shortner'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,145 @@
+"""
+Small load-generation helpers used by the benchmark management commands.
+
+``http_load`` drives a running server with plain asyncio sockets (no extra
+dependencies) so thousands of concurrent connections can be held from one
+process. Connections are kept alive when the server allows it and reopened
+when it answers ``Connection: close`` (e.g. gunicorn's sync worker).
+"""
+import asyncio
+import math
+import time
+from urllib.parse import urlsplit
+
+
+# ================================
+# Statistics
+# ================================
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies, elapsed, errors=0):
+    """Throughput and latency percentiles (milliseconds) for a run"""
+    values = sorted(latencies)
+    count = len(values)
+    return {
+        'requests': count,
+        'errors': errors,
+        'seconds': round(elapsed, 3),
+        'rps': round(count / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(values, 50) * 1000, 2),
+        'p95_ms': round(percentile(values, 95) * 1000, 2),
+        'p99_ms': round(percentile(values, 99) * 1000, 2),
+        'max_ms': round(values[-1] * 1000, 2) if values else 0.0,
+    }
+
+
+def format_summary(label, stats):
+    return (
+        f"{label}: {stats['requests']} req in {stats['seconds']}s, "
+        f"{stats['rps']} req/s, p50 {stats['p50_ms']}ms, "
+        f"p95 {stats['p95_ms']}ms, p99 {stats['p99_ms']}ms, "
+        f"errors {stats['errors']}"
+    )
+
+
+# ================================
+# HTTP load generator
+# ================================
+async def _read_response(reader):
+    """Read one response; returns (status, keep_alive)"""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("connection closed")
+    status = int(status_line.split()[1])
+
+    length = None
+    keep_alive = True
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        name = name.strip().lower()
+        value = value.strip().lower()
+        if name == 'content-length':
+            length = int(value)
+        elif name == 'connection' and value == 'close':
+            keep_alive = False
+
+    if length is None:
+        await reader.read()
+        keep_alive = False
+    elif length:
+        await reader.readexactly(length)
+    return status, keep_alive
+
+
+async def _client(host, port, paths, headers, latencies, counters, deadline):
+    reader = writer = None
+    while True:
+        try:
+            path = next(paths)
+        except StopIteration:
+            break
+        if deadline and time.perf_counter() > deadline:
+            break
+
+        request = (
+            f"GET {path} HTTP/1.1\r\nHost: {host}:{port}\r\n{headers}\r\n"
+        ).encode('latin-1')
+        start = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+            writer.write(request)
+            status, keep_alive = await _read_response(reader)
+        except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError, IndexError):
+            counters['errors'] += 1
+            if writer is not None:
+                writer.close()
+            reader = writer = None
+            continue
+
+        latencies.append(time.perf_counter() - start)
+        if status >= 500:
+            counters['errors'] += 1
+        if not keep_alive:
+            writer.close()
+            reader = writer = None
+
+    if writer is not None:
+        writer.close()
+
+
+async def _run_load(base_url, paths, concurrency, headers, duration):
+    parts = urlsplit(base_url)
+    host = parts.hostname or '127.0.0.1'
+    port = parts.port or 80
+    header_lines = ''.join(f"{name}: {value}\r\n" for name, value in headers.items())
+
+    latencies = []
+    counters = {'errors': 0}
+    iterator = iter(paths)
+    start = time.perf_counter()
+    deadline = start + duration if duration else None
+    await asyncio.gather(*[
+        _client(host, port, iterator, header_lines, latencies, counters, deadline)
+        for _ in range(concurrency)
+    ])
+    return summarize(latencies, time.perf_counter() - start, counters['errors'])
+
+
+def http_load(base_url, paths, concurrency=50, headers=None, duration=None):
+    """
+    Issue GET requests for ``paths`` (any iterable of request paths)
+    against ``base_url`` from ``concurrency`` connections and return
+    ``summarize`` stats
+    """
+    headers = {'User-Agent': 'shortner-bench/1.0', **(headers or {})}
+    return asyncio.run(_run_load(base_url, paths, concurrency, headers, duration))
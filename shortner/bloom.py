@@ -0,0 +1,354 @@
+"""
+Bloom filter of existing short codes.
+
+Each worker keeps a ``BloomFilter`` of every ``Url.uuid`` so that codes
+that definitely do not exist (bot probes for ``wp-login.php``, favicon
+variants, typos) are rejected by ``cache.resolve`` without a database
+query. A Bloom filter has no false negatives, so a code it rejects is
+certainly missing - as long as the filter has seen every code:
+
+* the filter is built in a background thread on first use; until it is
+  ready every code is treated as possibly existing,
+* codes created in this worker are added immediately (``post_save`` and
+  bulk creation), and new links are also published to the shared cache,
+  which ``resolve`` checks before the filter,
+* every ``SHORTNER_BLOOM_REFRESH_INTERVAL`` seconds the thread adds rows
+  created elsewhere (an indexed ``id >`` range scan); a rejected code
+  also triggers that refresh inline when the last one is more than
+  ``SHORTNER_BLOOM_RECHECK_INTERVAL`` seconds old, so a link created by
+  another worker a moment ago still resolves, while a flood of probes
+  costs at most one small query per interval,
+* ids skipped by the range scan are remembered as ranges of missing
+  ids and looked up again on every refresh. Transactions commit out of
+  id order, and with sharding each worker hands out link ids from its
+  own block, so a range can fill in slowly. It is given up
+  ``GAP_TIMEOUT`` seconds after an id in it last showed up (ids of
+  rolled-back inserts never do, nor the rest of a stopped worker's
+  block); workers abandon a block left idle for half that time, and
+* every ``SHORTNER_BLOOM_REBUILD_INTERVAL`` seconds it is rebuilt from
+  scratch, sized for the current row count, which also forgets deleted
+  codes (Bloom filters cannot remove entries).
+
+Memory is ``-n ln(p) / ln(2)^2`` bits for ``n`` codes at false-positive
+rate ``p``: about 57 MiB for 50M codes at 1%, 86 MiB at 0.1%.
+"""
+import bisect
+import hashlib
+import logging
+import math
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Q
+
+from . import sharding
+
+logger = logging.getLogger(__name__)
+
+# Seconds a range of missing ids below the watermark is looked for again
+# after an id in it last showed up
+GAP_TIMEOUT = 600
+# The first build cannot know which older ids are still uncommitted; it
+# reads the ids this far below the highest one again
+BUILD_SLACK = 5000
+# Gap ranges looked up per query
+GAP_CHUNK = 200
+
+
+# ================================
+# Bloom filter
+# ================================
+def optimal_size(capacity, error_rate):
+    """(bits, hash count) for ``capacity`` items at ``error_rate``"""
+    capacity = max(1, capacity)
+    bits = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+    hashes = max(1, round(bits / capacity * math.log(2)))
+    return bits, hashes
+
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter over strings using double hashing of one
+    128-bit blake2b digest. Lookups are lock-free; adds are serialized.
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size, self.hashes = optimal_size(capacity, error_rate)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        size = self.size
+        return [(first + i * second) % size for i in range(self.hashes)]
+
+    def add(self, item):
+        positions = self._positions(item)
+        bits = self.bits
+        with self._lock:
+            added = False
+            for position in positions:
+                mask = 1 << (position & 7)
+                if not bits[position >> 3] & mask:
+                    bits[position >> 3] |= mask
+                    added = True
+            # Re-adding an item (or a false positive) does not count
+            if added:
+                self.count += 1
+
+    def __contains__(self, item):
+        bits = self.bits
+        for position in self._positions(item):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    @property
+    def memory_bytes(self):
+        return len(self.bits)
+
+    def false_positive_rate(self, count=None):
+        """Expected false-positive rate after ``count`` adds (default: so far)"""
+        count = self.count if count is None else count
+        return (1 - math.exp(-self.hashes * count / self.size)) ** self.hashes
+
+    def stats(self):
+        return {
+            'capacity': self.capacity,
+            'items': self.count,
+            'bits': self.size,
+            'hashes': self.hashes,
+            'memory_bytes': self.memory_bytes,
+            'target_error_rate': self.error_rate,
+            'expected_error_rate': self.false_positive_rate(),
+        }
+
+
+# ================================
+# Filter of existing short codes
+# ================================
+def _number(url_id):
+    """Position of a link id in its sequence (sharded ids carry the shard in their low bits)"""
+    return url_id >> sharding.SHARD_BITS if sharding.enabled() else url_id
+
+
+def _read_links(after, gaps):
+    """``(number, code)`` of every link numbered above ``after`` or in a ``(start, end)`` gap"""
+    from .models import Url
+
+    shift = sharding.SHARD_BITS if sharding.enabled() else 0
+    for alias in sharding.all_shards():
+        rows = Url.objects.using(alias).order_by()
+        above = rows.filter(id__gte=(after + 1) << shift).values_list('id', 'uuid')
+        for url_id, code in above.iterator(chunk_size=10000):
+            yield url_id >> shift, code
+        for start in range(0, len(gaps), GAP_CHUNK):
+            # Every id of a shard in the range is numbered inside it
+            ranges = Q()
+            for low, high in gaps[start:start + GAP_CHUNK]:
+                ranges |= Q(id__gte=low << shift, id__lt=high << shift)
+            for url_id, code in rows.filter(ranges).values_list('id', 'uuid'):
+                yield url_id >> shift, code
+
+
+def _missing(start, end, seen):
+    """Ranges of ``start..end - 1`` not in the sorted list ``seen``"""
+    ranges = []
+    for number in seen[bisect.bisect_left(seen, start):bisect.bisect_left(seen, end)]:
+        if number > start:
+            ranges.append((start, number))
+        start = number + 1
+    if start < end:
+        ranges.append((start, end))
+    return ranges
+
+
+class CodeFilter:
+    """A worker's Bloom filter of ``Url.uuid`` values, kept current by a daemon thread"""
+
+    def __init__(self, capacity, error_rate, refresh_interval, rebuild_interval, recheck_interval):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.refresh_interval = refresh_interval
+        self.rebuild_interval = rebuild_interval
+        self.recheck_interval = recheck_interval
+        self.filter = None
+        self.watermark = 0
+        self.gaps = []  # (start, end, when an id in it last showed up) of missing numbers
+        self.built_at = None
+        self.refreshed_at = 0.0
+        self.rejected = 0
+        self._thread = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+
+    @property
+    def ready(self):
+        return self.filter is not None
+
+    def might_exist(self, code, recheck=True):
+        """
+        False if ``code`` is certainly not in the table. With ``recheck``
+        a rejected code may first trigger an inline ``refresh``.
+        """
+        bloom = self.filter
+        if bloom is None:
+            self.start()
+            return True
+        if code in bloom:
+            return True
+        if recheck and self.needs_recheck() and self.refresh(blocking=False) and code in self.filter:
+            return True
+        self.rejected += 1
+        return False
+
+    def needs_recheck(self):
+        return time.monotonic() - self.refreshed_at >= self.recheck_interval
+
+    def add(self, codes):
+        bloom = self.filter
+        if bloom is not None:
+            for code in codes:
+                bloom.add(code)
+
+    def rebuild(self):
+        """Build a new filter from the table, sized for the current row count"""
+        from .models import Url
+
+        shards = sharding.per_shard(Url.objects.order_by())
+        count = sum(rows.count() for rows in shards)
+        top = max(_number(rows.order_by('-id').values_list('id', flat=True).first() or 0) for rows in shards)
+        # Headroom for links created before the next rebuild
+        bloom = BloomFilter(max(self.capacity, count * 5 // 4), self.error_rate)
+        for rows in shards:
+            for code in rows.values_list('uuid', flat=True).iterator(chunk_size=10000):
+                bloom.add(code)
+        with self._refresh_lock:
+            if self.filter is None:
+                self.watermark, self.gaps = max(0, top - BUILD_SLACK), []
+            # Otherwise the scan saw everything up to the old watermark
+            # except its gaps, which the refresh reads again
+            self.filter = bloom
+            self._refresh()
+        self.built_at = time.monotonic()
+        return bloom
+
+    def refresh(self, blocking=True):
+        """
+        Add rows created since the last build or refresh. Returns False
+        if ``blocking`` is off and another thread is already refreshing.
+        """
+        if not self._refresh_lock.acquire(blocking=blocking):
+            return False
+        try:
+            if self.filter is not None:
+                self._refresh()
+            return True
+        finally:
+            self._refresh_lock.release()
+
+    def _refresh(self):
+        """Add links above the watermark or in a gap; needs the refresh lock"""
+        bloom, low, now = self.filter, self.watermark, time.monotonic()
+        seen = set()
+        for number, code in _read_links(low, [(start, end) for start, end, _ in self.gaps]):
+            bloom.add(code)
+            seen.add(number)
+        high = max(seen | {low})
+        seen = sorted(seen)
+        gaps = []
+        for start, end, active in self.gaps + [(low + 1, high, now)]:
+            missing = _missing(start, end, seen)
+            if missing != [(start, end)]:
+                # An id in it showed up: its block is still in use
+                active = now
+            if now - active < GAP_TIMEOUT:
+                gaps.extend((first, last, active) for first, last in missing)
+        self.gaps, self.watermark = gaps, high
+        self.refreshed_at = now
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(
+                    target=self._run, name='shortner-bloom-filter', daemon=True
+                )
+                self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            close_old_connections()
+            try:
+                if self.filter is None or time.monotonic() - self.built_at >= self.rebuild_interval:
+                    self.rebuild()
+                else:
+                    self.refresh()
+            except Exception:
+                logger.exception("Failed to update the short code Bloom filter")
+            close_old_connections()
+            self._stop.wait(self.refresh_interval)
+
+    def stats(self):
+        bloom = self.filter
+        stats = bloom.stats() if bloom is not None else {}
+        stats.update(
+            ready=bloom is not None, rejected=self.rejected, watermark=self.watermark,
+            gaps=sum(end - start for start, end, _ in self.gaps), gap_ranges=len(self.gaps),
+        )
+        return stats
+
+
+_filter = None
+_filter_lock = threading.Lock()
+
+
+def get_code_filter():
+    global _filter
+    if _filter is None:
+        with _filter_lock:
+            if _filter is None:
+                _filter = CodeFilter(
+                    capacity=settings.SHORTNER_BLOOM_CAPACITY,
+                    error_rate=settings.SHORTNER_BLOOM_ERROR_RATE,
+                    refresh_interval=settings.SHORTNER_BLOOM_REFRESH_INTERVAL,
+                    rebuild_interval=settings.SHORTNER_BLOOM_REBUILD_INTERVAL,
+                    recheck_interval=settings.SHORTNER_BLOOM_RECHECK_INTERVAL,
+                )
+    return _filter
+
+
+def might_exist(code):
+    """False only if ``code`` is certainly not a ``Url.uuid``"""
+    if not settings.SHORTNER_BLOOM_FILTER:
+        return True
+    return get_code_filter().might_exist(code)
+
+
+async def amight_exist(code):
+    """Async ``might_exist``: the inline refresh runs in a worker thread"""
+    if not settings.SHORTNER_BLOOM_FILTER:
+        return True
+    code_filter = get_code_filter()
+    bloom = code_filter.filter
+    if bloom is not None and code not in bloom and code_filter.needs_recheck():
+        return await sync_to_async(code_filter.might_exist)(code)
+    return code_filter.might_exist(code, recheck=False)
+
+
+def add(codes):
+    """Record newly created codes in this worker's filter"""
+    if settings.SHORTNER_BLOOM_FILTER and _filter is not None:
+        _filter.add(codes)
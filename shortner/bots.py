@@ -0,0 +1,144 @@
+"""
+Bot and link-preview crawler filtering.
+
+Chat and social unfurlers (Slackbot, facebookexternalhit, Twitterbot),
+uptime monitors and HTTP libraries fetch short links with no person
+behind them. With ``SHORTNER_BOT_FILTERING`` on, ``record_click`` hands
+their hits to ``record_hit`` instead of writing a ``UrlClick`` row.
+
+A hit is from a bot if ``useragents.is_bot`` says so: the UA matches
+``SHORTNER_BOT_PATTERNS`` (one compiled regex) or ``user_agents`` flags
+it, memoized per UA string. Hits are summed in memory per (url, day) and
+added to ``BotHit`` rows by the click writer thread, one UPDATE per pair
+per flush (inline when ``SHORTNER_CLICK_ASYNC = False``).
+
+With ``SHORTNER_UA_PARSING`` set to ``writer`` or ``offline`` the request
+path only matches the patterns, so it never parses a UA. ``write_clicks``
+then passes each batch through ``divert``, which moves the clicks whose
+parsed UA is a bot to ``BotHit`` before anything is stored.
+
+Bot hits are kept out of ``click_count``, rollups and unique visitors;
+``bot_hits_by_url`` and ``bot_hits`` report them separately.
+"""
+import threading
+from collections import Counter
+from datetime import timezone as dt_timezone
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from . import sharding, useragents
+from .clicks import get_writer
+from .models import BotHit, Url
+
+_pending = Counter()
+_pending_lock = threading.Lock()
+
+
+def is_bot_click(click):
+    """Request-time check; only the patterns unless UAs are parsed on the request"""
+    if not settings.SHORTNER_BOT_FILTERING:
+        return False
+    if settings.SHORTNER_UA_PARSING == useragents.REQUEST:
+        return useragents.is_bot(click.get('user_agent'))
+    return useragents.matches_bot_patterns(click.get('user_agent'))
+
+
+def divert(batch):
+    """
+    Write the clicks of a batch whose parsed UA is a bot as bot hits;
+    returns the other clicks
+    """
+    if not settings.SHORTNER_BOT_FILTERING:
+        return batch
+    kept = []
+    hits = Counter()
+    for click in batch:
+        if useragents.is_bot(click.get('user_agent')):
+            day = (click.get('created_at') or timezone.now()).astimezone(dt_timezone.utc).date()
+            hits[(click['url_id'], day)] += 1
+        else:
+            kept.append(click)
+    if hits:
+        write_hits(hits)
+    return kept
+
+
+# ================================
+# Counting
+# ================================
+def record_hit(url_id, created_at=None):
+    """Count one bot hit on a url"""
+    day = (created_at or timezone.now()).astimezone(dt_timezone.utc).date()
+    if not settings.SHORTNER_CLICK_ASYNC:
+        write_hits({(url_id, day): 1})
+        return
+    with _pending_lock:
+        _pending[(url_id, day)] += 1
+    # The writer thread flushes the pending hits
+    get_writer().start()
+
+
+def flush():
+    """Write the hits counted in memory so far; returns how many"""
+    global _pending
+    with _pending_lock:
+        pending, _pending = _pending, Counter()
+    if pending:
+        write_hits(pending)
+    return sum(pending.values())
+
+
+def write_hits(hits):
+    """Add ``{(url_id, day): count}`` to the ``BotHit`` rows"""
+    for alias, keys in sharding.group_by_url(hits, key=lambda key: key[0]).items():
+        with sharding.use(alias):
+            _write_shard_hits(alias, {key: hits[key] for key in keys})
+
+
+def _write_shard_hits(alias, hits):
+    from . import dashboard
+
+    with transaction.atomic(using=alias):
+        # Links deleted since the hit was counted are skipped
+        existing = set(
+            Url.objects.filter(pk__in={url_id for url_id, _ in hits}).values_list('pk', flat=True)
+        )
+        for (url_id, day), count in sorted(hits.items()):
+            if url_id not in existing:
+                continue
+            counter = BotHit.objects.filter(url_id=url_id, day=day)
+            if counter.update(count=F('count') + count):
+                continue
+            try:
+                with transaction.atomic(using=alias):
+                    BotHit.objects.create(url_id=url_id, day=day, count=count)
+            except IntegrityError:
+                # Created concurrently by another writer
+                counter.update(count=F('count') + count)
+        dashboard.invalidate_urls(existing)
+
+
+# ================================
+# Reading
+# ================================
+def bot_hits_by_url(url_ids):
+    """All-time bot hits for these links, ``{url_id: hits}``"""
+    return dict(
+        BotHit.objects.filter(url_id__in=url_ids)
+        .values('url_id')
+        .annotate(total=Sum('count'))
+        .values_list('url_id', 'total')
+    )
+
+
+def bot_hits(url_id, start=None, end=None):
+    """Bot hits on a link on days ``start <= day < end`` (dates, UTC; None = unbounded)"""
+    hits = BotHit.objects.filter(url_id=url_id)
+    if start is not None:
+        hits = hits.filter(day__gte=start)
+    if end is not None:
+        hits = hits.filter(day__lt=end)
+    return hits.aggregate(total=Sum('count'))['total'] or 0
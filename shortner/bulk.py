@@ -0,0 +1,299 @@
+"""
+Streaming bulk link creation.
+
+Input rows are read incrementally from the request (JSON array, NDJSON or
+CSV, either as the raw body or an uploaded ``file``), validated, given
+codes in bulk and inserted with ``bulk_create`` in chunks of
+``SHORTNER_BULK_CHUNK_SIZE``, each chunk in its own transaction. Results
+are written to a ``spool`` file as each chunk is stored, so neither the
+input nor the output is ever held in memory as a whole, and every insert
+happens inside the view (under its primary pinning and error handling)
+before the response is streamed back.
+"""
+import codecs
+import csv
+import io
+import json
+import logging
+import tempfile
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.validators import URLValidator
+from django.db import IntegrityError, transaction
+
+from . import bloom, cache, dashboard, sharding, snapshot
+from .codes import generate_codes
+from .models import Url
+
+logger = logging.getLogger(__name__)
+
+READ_SIZE = 64 * 1024
+# Output kept in memory up to this many bytes, then in a temporary file
+SPOOL_SIZE = 1024 * 1024
+
+validate_url = URLValidator()
+
+
+# ================================
+# Incremental input parsing
+# ================================
+def iter_text(stream, encoding='utf-8'):
+    """Decode a binary file-like object chunk by chunk"""
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    for chunk in iter(lambda: stream.read(READ_SIZE), b''):
+        yield decoder.decode(chunk)
+    tail = decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+
+
+def iter_lines(text_chunks):
+    buffer = ''
+    for chunk in text_chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split('\n')
+        yield from lines
+    if buffer:
+        yield buffer
+
+
+def iter_json_array(text_chunks):
+    """Yield the items of a top-level JSON array without loading it whole"""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    started = finished = False
+    for chunk in text_chunks:
+        buffer += chunk
+        pos = 0
+        while not finished:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos >= len(buffer):
+                break
+            if not started:
+                if buffer[pos] != '[':
+                    raise ValueError("Expected a JSON array")
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == ']':
+                finished = True
+                break
+            try:
+                item, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                break  # item continues in the next chunk
+            yield item
+        buffer = buffer[pos:]
+        if finished:
+            return
+    if not finished:
+        raise ValueError("Truncated JSON array")
+
+
+def iter_ndjson(text_chunks):
+    for line in iter_lines(text_chunks):
+        if line.strip():
+            yield json.loads(line)
+
+
+def iter_csv(text_chunks):
+    """Yield links from CSV; uses a ``link`` column if there is a header"""
+    column = 0
+    for index, row in enumerate(csv.reader(iter_lines(text_chunks))):
+        if not row:
+            continue
+        if index == 0:
+            header = [cell.strip().lower() for cell in row]
+            if 'link' in header:
+                column = header.index('link')
+                continue
+        yield row[column] if column < len(row) else ''
+
+
+def iter_links(request):
+    """Pick a parser from the upload or content type; yields raw link values"""
+    if request.content_type == 'multipart/form-data':
+        upload = request.FILES.get('file')
+        if upload is None:
+            raise ValueError("No file uploaded")
+        text = iter_text(upload)
+        name = upload.name.lower()
+        if name.endswith('.json'):
+            items = iter_json_array(text)
+        elif name.endswith(('.ndjson', '.jsonl')):
+            items = iter_ndjson(text)
+        else:
+            return iter_csv(text)
+    elif request.content_type == 'application/json':
+        items = iter_json_array(iter_text(request))
+    elif request.content_type in ('application/x-ndjson', 'application/jsonl'):
+        items = iter_ndjson(iter_text(request))
+    elif request.content_type == 'text/csv':
+        return iter_csv(iter_text(request))
+    else:
+        raise ValueError("Unsupported content type")
+    return (item.get('link', '') if isinstance(item, dict) else item for item in items)
+
+
+def clean_link(link):
+    """Return (link, error)"""
+    if not isinstance(link, str):
+        return link, "Link must be a string"
+    link = link.strip()
+    if len(link) > Url._meta.get_field('link').max_length:
+        return link, "Link is too long"
+    try:
+        validate_url(link)
+    except ValidationError:
+        return link, "Invalid URL"
+    return link, None
+
+
+# ================================
+# Chunked inserts
+# ================================
+def insert_chunk(user, links):
+    """Create Url rows for ``links``; returns their codes in order"""
+    for attempt in range(settings.SHORTNER_CODE_MAX_ATTEMPTS):
+        codes = generate_codes(len(links))
+        try:
+            rows = [Url(user=user, link=link, uuid=code) for link, code in zip(links, codes)]
+            if sharding.enabled():
+                _insert_on_shards(rows)
+            else:
+                with transaction.atomic():
+                    Url.objects.bulk_create(rows)
+                    snapshot.log_changes(codes)
+        except IntegrityError:
+            # Only a code collision is worth another attempt
+            if not codes_taken(codes):
+                raise
+            continue
+        # bulk_create sends no post_save: replace any negative cache entries
+        cache.publish(rows)
+        bloom.add(codes)
+        dashboard.invalidate([user.pk])
+        return codes
+    raise IntegrityError("Could not generate unique short codes")
+
+
+def codes_taken(codes):
+    """Whether any of ``codes`` repeats or is already stored"""
+    if len(set(codes)) < len(codes):
+        return True
+    return any(
+        Url.objects.using(alias).filter(uuid__in=shard_codes).exists()
+        for alias, shard_codes in sharding.group_codes(codes).items()
+    )
+
+
+def _insert_on_shards(rows):
+    """
+    Insert each row on the shard of its code, all shards' transactions
+    open until every insert succeeded (a duplicate code rolls back all)
+    """
+    by_shard = {}
+    for row in rows:
+        by_shard.setdefault(sharding.for_code(row.uuid), []).append(row)
+    with ExitStack() as stack:
+        for alias, shard_rows in by_shard.items():
+            stack.enter_context(transaction.atomic(using=alias))
+            for row, url_id in zip(shard_rows, sharding.new_ids(alias, len(shard_rows))):
+                row.pk = url_id
+            with sharding.use(alias):
+                Url.objects.bulk_create(shard_rows)
+                snapshot.log_changes([row.uuid for row in shard_rows])
+
+
+def bulk_create_links(user, links, base_url, chunk_size=None):
+    """
+    Yield one result dict per input link, then a summary dict
+    ``{'summary': {...}}`` with row counts and rows/sec
+    """
+    chunk_size = chunk_size or settings.SHORTNER_BULK_CHUNK_SIZE
+    start = time.perf_counter()
+    rows = created = errors = 0
+    pending = []  # (row, link, error) for the current chunk
+
+    def flush():
+        nonlocal created, errors
+        valid = [link for row, link, error in pending if error is None]
+        codes = iter(insert_chunk(user, valid) if valid else [])
+        for row, link, error in pending:
+            if error is None:
+                code = next(codes)
+                created += 1
+                yield {'row': row, 'link': link, 'code': code, 'short_url': f'{base_url}{code}/'}
+            else:
+                errors += 1
+                yield {'row': row, 'link': link, 'error': error}
+        pending.clear()
+
+    parse_error = None
+    try:
+        for link in links:
+            rows += 1
+            pending.append((rows, *clean_link(link)))
+            if len(pending) >= chunk_size:
+                yield from flush()
+    except (ValueError, csv.Error) as exc:
+        # Rows read so far are still stored; report where the input broke
+        parse_error = str(exc)
+    yield from flush()
+
+    seconds = time.perf_counter() - start
+    summary = {
+        'rows': rows,
+        'created': created,
+        'errors': errors,
+        'seconds': round(seconds, 3),
+        'rows_per_sec': round(rows / seconds, 1) if seconds else 0.0,
+    }
+    if parse_error:
+        summary['error'] = parse_error
+    logger.info("Bulk created %(created)d links from %(rows)d rows (%(rows_per_sec)s rows/s)", summary)
+    yield {'summary': summary}
+
+
+# ================================
+# Output encoding
+# ================================
+def as_ndjson(results):
+    for result in results:
+        yield json.dumps(result) + '\n'
+
+
+def as_csv(results):
+    """CSV rows; the summary becomes a trailing ``#`` comment line"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(['row', 'link', 'short_url', 'error'])
+    for result in results:
+        if 'summary' in result:
+            summary = result['summary']
+            buffer.write(
+                f"# rows={summary['rows']} created={summary['created']} "
+                f"errors={summary['errors']} rows_per_sec={summary['rows_per_sec']}"
+                f"{' error=' + summary['error'] if 'error' in summary else ''}\n"
+            )
+        else:
+            writer.writerow([
+                result['row'], result['link'],
+                result.get('short_url', ''), result.get('error', ''),
+            ])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def spool(chunks):
+    """Write encoded output to a rewound temporary file (in memory up to ``SPOOL_SIZE``)"""
+    output = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    for chunk in chunks:
+        output.write(chunk.encode('utf-8'))
+    output.seek(0)
+    return output
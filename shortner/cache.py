@@ -0,0 +1,272 @@
+"""
+Short code resolution cache.
+
+Redirects resolve a short code through two tiers before touching the
+database:
+
+1. a per-worker LRU (``LRUCache``) with a short TTL, and
+2. the shared Django cache backend named by ``SHORTNER_CACHE_ALIAS``.
+
+Entries only hold ``ENTRY_FIELDS`` (id, target, active flag and the
+link's redirect settings). Unknown codes are cached as negative entries
+so random paths stop reaching the database.
+
+Invalidation deletes the shared entry and the entry in the current
+worker's LRU; other workers pick the change up once their local entry
+expires (``SHORTNER_LOCAL_CACHE_TTL`` seconds).
+"""
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import bloom, metrics, sharding
+
+# Sentinel stored for codes that do not exist
+NOT_FOUND = False
+
+# Url fields kept per code, in this order
+ENTRY_FIELDS = ('pk', 'link', 'is_active', 'redirect_type', 'cache_max_age')
+
+_MISSING = object()
+_SAFE_KEY = re.compile(r'^[A-Za-z0-9_-]+$')
+
+
+# ================================
+# Bounded LRU with optional TTL
+# ================================
+class LRUCache:
+    """
+    Thread-safe, bounded LRU mapping with an optional per-entry TTL
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is not _MISSING:
+                value, expires = item
+                if expires is None or expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        if self.maxsize <= 0:
+            return
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+
+_local = None
+_local_lock = threading.Lock()
+
+
+def local_cache():
+    """Return this worker's LRU, creating it from settings on first use"""
+    global _local
+    if _local is None:
+        with _local_lock:
+            if _local is None:
+                _local = LRUCache(
+                    maxsize=settings.SHORTNER_LOCAL_CACHE_SIZE,
+                    ttl=settings.SHORTNER_LOCAL_CACHE_TTL,
+                )
+    return _local
+
+
+def shared_cache():
+    return caches[settings.SHORTNER_CACHE_ALIAS]
+
+
+def cache_key(code):
+    """Shared cache key for a short code (hashed if not key-safe)"""
+    if not _SAFE_KEY.match(code):
+        code = hashlib.md5(code.encode('utf-8')).hexdigest()
+    # v2: entries grew the redirect settings
+    return f'shortner:url:v2:{code}'
+
+
+# ================================
+# Resolution
+# ================================
+def _max_code_length():
+    from .models import Url
+    return Url._meta.get_field('uuid').max_length
+
+
+def _ttls(entry):
+    """(shared, local) TTLs for a cache entry"""
+    if entry is NOT_FOUND:
+        shared_ttl = settings.SHORTNER_NEGATIVE_CACHE_TTL
+        return shared_ttl, min(settings.SHORTNER_LOCAL_CACHE_TTL, shared_ttl)
+    return settings.SHORTNER_SHARED_CACHE_TTL, settings.SHORTNER_LOCAL_CACHE_TTL
+
+
+def resolve(code):
+    """
+    Resolve a short code to a tuple of ``ENTRY_FIELDS``,
+    or ``None`` if the code does not exist
+    """
+    from .models import Url
+
+    if len(code) > _max_code_length():
+        return None
+
+    local = local_cache()
+    entry = local.get(code, _MISSING)
+    if entry is not _MISSING:
+        metrics.incr('cache_local')
+        return entry or None
+
+    entry = shared_cache().get(cache_key(code))
+    if entry is None:
+        if not bloom.might_exist(code):
+            metrics.incr('cache_bloom')
+            return None
+        metrics.incr('cache_miss')
+        row = (
+            Url.objects.using(sharding.for_code(code)).filter(uuid=code)
+            .values_list(*ENTRY_FIELDS)
+            .first()
+        )
+        entry = tuple(row) if row else NOT_FOUND
+        shared_ttl, local_ttl = _ttls(entry)
+        shared_cache().set(cache_key(code), entry, shared_ttl)
+        local.set(code, entry, local_ttl)
+    else:
+        metrics.incr('cache_shared')
+        local.set(code, entry, settings.SHORTNER_LOCAL_CACHE_TTL)
+    return entry or None
+
+
+async def aresolve(code):
+    """Async variant of ``resolve`` using the async cache and ORM APIs"""
+    from .models import Url
+
+    if len(code) > _max_code_length():
+        return None
+
+    local = local_cache()
+    entry = local.get(code, _MISSING)
+    if entry is not _MISSING:
+        metrics.incr('cache_local')
+        return entry or None
+
+    entry = await shared_cache().aget(cache_key(code))
+    if entry is None:
+        if not await bloom.amight_exist(code):
+            metrics.incr('cache_bloom')
+            return None
+        metrics.incr('cache_miss')
+        row = await (
+            Url.objects.using(sharding.for_code(code)).filter(uuid=code)
+            .values_list(*ENTRY_FIELDS)
+            .afirst()
+        )
+        entry = tuple(row) if row else NOT_FOUND
+        shared_ttl, local_ttl = _ttls(entry)
+        await shared_cache().aset(cache_key(code), entry, shared_ttl)
+        local.set(code, entry, local_ttl)
+    else:
+        metrics.incr('cache_shared')
+        local.set(code, entry, settings.SHORTNER_LOCAL_CACHE_TTL)
+    return entry or None
+
+
+def invalidate(code):
+    """
+    Drop a code from both tiers, now and again once the current
+    transaction commits (so a concurrent miss cannot re-cache stale data)
+    """
+    if not code:
+        return
+
+    def _drop():
+        local_cache().delete(code)
+        shared_cache().delete(cache_key(code))
+
+    _drop()
+    sharding.on_commit(_drop)
+
+
+def invalidate_many(codes):
+    """``invalidate`` for many codes with one shared-cache round trip"""
+    codes = [code for code in codes if code]
+    if not codes:
+        return
+
+    def _drop():
+        local = local_cache()
+        for code in codes:
+            local.delete(code)
+        shared_cache().delete_many([cache_key(code) for code in codes])
+
+    _drop()
+    sharding.on_commit(_drop)
+
+
+def entry_for(url):
+    return tuple(getattr(url, field) for field in ENTRY_FIELDS)
+
+
+def publish(urls):
+    """
+    Cache newly created links as positive entries once the transaction
+    commits, so workers whose Bloom filter has not seen them yet still
+    resolve them (and stale negative entries are dropped right away)
+    """
+    urls = [url for url in urls if url.uuid]
+    if not urls:
+        return
+    entries = {url.uuid: entry_for(url) for url in urls if url.pk is not None}
+
+    def _drop():
+        local = local_cache()
+        for url in urls:
+            local.delete(url.uuid)
+        shared_cache().delete_many([cache_key(url.uuid) for url in urls])
+
+    def _set():
+        local = local_cache()
+        for code, entry in entries.items():
+            local.set(code, entry, settings.SHORTNER_LOCAL_CACHE_TTL)
+        shared_cache().set_many(
+            {cache_key(code): entry for code, entry in entries.items()},
+            settings.SHORTNER_SHARED_CACHE_TTL,
+        )
+
+    _drop()
+    sharding.on_commit(_set)
@@ -0,0 +1,275 @@
+"""
+Batched click logging.
+
+Redirects hand click details to ``record_click``, which pushes them onto
+a bounded in-process queue and returns immediately. A background thread
+drains the queue and writes each batch with one ``bulk_create`` for the
+``UrlClick`` rows and one click counter increment per ``Url`` (see
+``shortner.counters``).
+
+Batches are flushed when ``SHORTNER_CLICK_BATCH_SIZE`` clicks are waiting
+or ``SHORTNER_CLICK_FLUSH_INTERVAL`` seconds have passed, and once more
+when the worker shuts down. When the queue is full the
+``SHORTNER_CLICK_DROP_POLICY`` decides what happens:
+
+* ``drop_newest`` - discard the incoming click
+* ``drop_oldest`` - discard the oldest queued click
+* ``sync`` - write the click inline (backpressure onto the request)
+
+Set ``SHORTNER_CLICK_ASYNC = False`` to write every click inline.
+
+Hits from bots and link-preview crawlers are counted separately instead
+(see ``shortner.bots``); the writer thread flushes those counts too.
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+from collections import Counter
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+DROP_NEWEST = 'drop_newest'
+DROP_OLDEST = 'drop_oldest'
+SYNC = 'sync'
+
+
+# ================================
+# Writing a batch
+# ================================
+def write_clicks(batch):
+    """
+    Persist a list of click dicts (``UrlClick`` field values)
+    and bump the click counter once per url
+    """
+    from . import bots, counters, sharding, useragents
+
+    if settings.SHORTNER_UA_PARSING != useragents.REQUEST:
+        # The request path only matched the bot patterns
+        batch = bots.divert(batch)
+    if not batch:
+        return 0
+
+    if settings.SHORTNER_UA_PARSING == useragents.WRITER:
+        for click in batch:
+            useragents.fill_click(click)
+
+    written = 0
+    # One transaction per database shard holding the links
+    for alias, clicks in sharding.group_by_url(batch).items():
+        with sharding.use(alias):
+            written += _write_shard_clicks(alias, clicks)
+    counters.maybe_fold()
+    return written
+
+
+def _write_shard_clicks(alias, batch):
+    from .models import Url, UrlClick
+    from . import counters, dashboard, visitors
+
+    counts = Counter(click['url_id'] for click in batch)
+    with transaction.atomic(using=alias):
+        # Links deleted since the click was queued are skipped
+        existing = set(
+            Url.objects.filter(pk__in=counts).values_list('pk', flat=True)
+        )
+        rows = [UrlClick(**click) for click in batch if click['url_id'] in existing]
+        UrlClick.objects.bulk_create(rows, batch_size=settings.SHORTNER_CLICK_BATCH_SIZE)
+        for url_id, count in counts.items():
+            if url_id in existing:
+                counters.increment(url_id, count)
+        if settings.SHORTNER_UNIQUE_VISITORS:
+            visitors.add_clicks([click for click in batch if click['url_id'] in existing])
+        if settings.SHORTNER_CLICK_COUNTER_SHARDS <= 1:
+            # Sharded counts reach click_count (and the dashboards) when folded
+            dashboard.invalidate_urls(existing)
+    return len(rows)
+
+
+# ================================
+# Background writer
+# ================================
+class ClickWriter:
+    """
+    Bounded queue of pending clicks flushed by a daemon thread
+    """
+
+    def __init__(self, batch_size=500, flush_interval=1.0, max_queue=10000,
+                 drop_policy=DROP_NEWEST):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.drop_policy = drop_policy
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self.written = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(
+                    target=self._run, name='shortner-click-writer', daemon=True
+                )
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def offer(self, click):
+        """
+        Queue a click without blocking or touching the database.
+        Returns False if the queue is full and the policy is ``sync``,
+        leaving the caller to write it.
+        """
+        self.start()
+        try:
+            self.queue.put_nowait(click)
+            return True
+        except queue.Full:
+            pass
+
+        if self.drop_policy == SYNC:
+            return False
+
+        if self.drop_policy == DROP_OLDEST:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                pass
+            try:
+                self.queue.put_nowait(click)
+                self.dropped += 1
+                return True
+            except queue.Full:
+                pass
+
+        self.dropped += 1
+        return True
+
+    def put(self, click):
+        """Queue a click, writing it inline if the ``sync`` policy requires it"""
+        if not self.offer(click):
+            self._write([click])
+
+    def _drain(self, timeout):
+        """Collect up to ``batch_size`` clicks, waiting at most ``timeout`` seconds"""
+        batch = []
+        deadline = time.monotonic() + timeout
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    batch.append(self.queue.get_nowait())
+                else:
+                    batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        try:
+            self.written += write_clicks(batch)
+        except Exception:
+            logger.exception("Failed to write %d clicks", len(batch))
+
+    def _fold(self):
+        from . import counters
+
+        try:
+            counters.maybe_fold()
+        except Exception:
+            logger.exception("Failed to fold click counters")
+
+    def _flush_bot_hits(self):
+        from . import bots
+
+        try:
+            bots.flush()
+        except Exception:
+            logger.exception("Failed to write bot hits")
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._drain(self.flush_interval)
+            # Only on this thread: put() and flush() run on the caller's,
+            # possibly inside its transaction
+            close_old_connections()
+            if batch:
+                self._write(batch)
+            else:
+                # Idle: fold what the last batches left on the counter shards
+                self._fold()
+            self._flush_bot_hits()
+        close_old_connections()
+
+    def flush(self):
+        """Synchronously write everything currently queued"""
+        while True:
+            batch = self._drain(0)
+            if not batch:
+                break
+            self._write(batch)
+        self._flush_bot_hits()
+
+    def stop(self, timeout=5.0):
+        """Stop the background thread and flush what is left"""
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            thread.join(timeout)
+        self.flush()
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = ClickWriter(
+                    batch_size=settings.SHORTNER_CLICK_BATCH_SIZE,
+                    flush_interval=settings.SHORTNER_CLICK_FLUSH_INTERVAL,
+                    max_queue=settings.SHORTNER_CLICK_QUEUE_SIZE,
+                    drop_policy=settings.SHORTNER_CLICK_DROP_POLICY,
+                )
+    return _writer
+
+
+def record_click(**click):
+    """Record one click (``UrlClick`` field values, using ``url_id``)"""
+    from . import bots
+
+    if bots.is_bot_click(click):
+        bots.record_hit(click['url_id'], click.get('created_at'))
+        return
+    if not settings.SHORTNER_CLICK_ASYNC:
+        write_clicks([click])
+    else:
+        get_writer().put(click)
+
+
+async def arecord_click(**click):
+    """Async variant of ``record_click``; never blocks the event loop on the database"""
+    from . import bots
+
+    if bots.is_bot_click(click):
+        if settings.SHORTNER_CLICK_ASYNC:
+            bots.record_hit(click['url_id'], click.get('created_at'))
+        else:
+            await sync_to_async(bots.record_hit)(click['url_id'], click.get('created_at'))
+        return
+    if not settings.SHORTNER_CLICK_ASYNC:
+        await sync_to_async(write_clicks)([click])
+        return
+    writer = get_writer()
+    if not writer.offer(click):
+        await sync_to_async(writer._write)([click])
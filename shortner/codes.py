@@ -0,0 +1,187 @@
+"""
+Short code generation strategies.
+
+``SHORTNER_CODE_GENERATOR`` names the class used by ``generate_code``:
+
+* ``SequenceCodeGenerator`` - fixed-width base62 of a monotonic ID. Codes
+  sort in creation order, so inserts append to the end of the ``uuid``
+  index instead of scattering across it. Codes are guessable.
+* ``HashidsCodeGenerator`` - hashids encoding of the same monotonic ID,
+  salted with ``SHORTNER_CODE_SALT``. Collision-free and non-sequential.
+* ``RandomCodeGenerator`` - random base62; relies on retry-on-collision.
+
+The monotonic strategies take IDs from blocks of ``SHORTNER_CODE_BLOCK_SIZE``
+reserved per worker from the ``CodeSequence`` table, so the database is
+only touched once per block.
+
+Codes are at least ``SHORTNER_CODE_LENGTH`` characters. ``Url.save`` retries
+with a fresh code whenever one is already taken (random codes, or legacy
+codes that happen to match a sequence value).
+"""
+import secrets
+import string
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils.module_loading import import_string
+from hashids import Hashids
+
+# Digits, upper, lower: ASCII order, so fixed-width codes sort numerically
+BASE62 = string.digits + string.ascii_uppercase + string.ascii_lowercase
+
+
+def base62_encode(number, width=0):
+    if number < 0:
+        raise ValueError("Cannot encode negative numbers")
+    chars = []
+    while True:
+        number, rem = divmod(number, 62)
+        chars.append(BASE62[rem])
+        if not number:
+            break
+    return ''.join(reversed(chars)).rjust(width, BASE62[0])
+
+
+def base62_decode(code):
+    number = 0
+    for char in code:
+        number = number * 62 + BASE62.index(char)
+    return number
+
+
+def max_code_length():
+    from .models import Url
+    return Url._meta.get_field('uuid').max_length
+
+
+# ================================
+# Per-worker ID blocks
+# ================================
+def allocate_block(name, size):
+    """Reserve ``size`` consecutive IDs from the named sequence"""
+    from .models import CodeSequence
+
+    with transaction.atomic():
+        sequence, _ = CodeSequence.objects.select_for_update().get_or_create(name=name)
+        start = sequence.next_value
+        sequence.next_value = start + size
+        sequence.save(update_fields=['next_value'])
+    return start, start + size
+
+
+class BlockAllocator:
+    """
+    Hands out IDs from blocks reserved in the database. With ``max_idle``
+    the rest of a block not used for that many seconds is abandoned.
+    """
+
+    def __init__(self, name, block_size, max_idle=None):
+        self.name = name
+        self.block_size = block_size
+        self.max_idle = max_idle
+        self._next = 0
+        self._end = 0
+        self._used_at = 0.0
+        self._lock = threading.Lock()
+
+    def take(self, count=1):
+        """Return ``count`` IDs (not necessarily contiguous across blocks)"""
+        ids = []
+        with self._lock:
+            now = time.monotonic()
+            if self.max_idle is not None and now - self._used_at > self.max_idle:
+                self._next = self._end
+            self._used_at = now
+            while len(ids) < count:
+                if self._next >= self._end:
+                    size = max(self.block_size, count - len(ids))
+                    self._next, self._end = allocate_block(self.name, size)
+                step = min(count - len(ids), self._end - self._next)
+                ids.extend(range(self._next, self._next + step))
+                self._next += step
+        return ids
+
+
+# ================================
+# Strategies
+# ================================
+class CodeGenerator:
+    """Base strategy: subclasses implement ``generate_many``"""
+
+    def __init__(self, length=None):
+        self.length = length or settings.SHORTNER_CODE_LENGTH
+        if self.length > max_code_length():
+            raise ImproperlyConfigured(
+                f"SHORTNER_CODE_LENGTH must be at most {max_code_length()}"
+            )
+
+    def generate(self):
+        return self.generate_many(1)[0]
+
+    def generate_many(self, count):
+        raise NotImplementedError
+
+
+class RandomCodeGenerator(CodeGenerator):
+    def generate_many(self, count):
+        return [
+            ''.join(secrets.choice(BASE62) for _ in range(self.length))
+            for _ in range(count)
+        ]
+
+
+class SequenceCodeGenerator(CodeGenerator):
+    sequence_name = 'codes'
+
+    def __init__(self, length=None):
+        super().__init__(length)
+        self.allocator = BlockAllocator(self.sequence_name, settings.SHORTNER_CODE_BLOCK_SIZE)
+
+    def encode(self, number):
+        code = base62_encode(number, self.length)
+        if len(code) > max_code_length():
+            raise OverflowError("Short code sequence exhausted")
+        return code
+
+    def generate_many(self, count):
+        return [self.encode(number) for number in self.allocator.take(count)]
+
+
+class HashidsCodeGenerator(SequenceCodeGenerator):
+    def __init__(self, length=None):
+        super().__init__(length)
+        self.hashids = Hashids(
+            salt=settings.SHORTNER_CODE_SALT,
+            min_length=self.length,
+            alphabet=BASE62,
+        )
+
+    def encode(self, number):
+        code = self.hashids.encode(number)
+        if len(code) > max_code_length():
+            raise OverflowError("Short code sequence exhausted")
+        return code
+
+
+_generator = None
+_generator_lock = threading.Lock()
+
+
+def get_generator():
+    global _generator
+    if _generator is None:
+        with _generator_lock:
+            if _generator is None:
+                _generator = import_string(settings.SHORTNER_CODE_GENERATOR)()
+    return _generator
+
+
+def generate_code():
+    return get_generator().generate()
+
+
+def generate_codes(count):
+    return get_generator().generate_many(count)
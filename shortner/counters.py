@@ -0,0 +1,115 @@
+"""
+Sharded click counters.
+
+Incrementing ``Url.click_count`` directly makes every click on a link wait
+for the same row lock, so one viral link serializes all workers writing
+its clicks. With ``SHORTNER_CLICK_COUNTER_SHARDS`` above 1, increments go
+to one of N ``ClickCounterShard`` rows per url, picked at random, and
+``fold`` periodically moves the pending shard counts into
+``Url.click_count`` with one UPDATE per url.
+
+``Url.click_count`` stays the materialized total read by the dashboard
+and the admin. ``write_clicks`` and the idle click writer fold whenever
+``SHORTNER_CLICK_COUNTER_FOLD_INTERVAL`` seconds have passed, and
+``manage.py fold_click_counters`` folds on demand; ``live_click_count``
+adds the pending shards for an exact figure.
+"""
+import random
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import IntegrityError, connections, transaction
+from django.db.models import F, Sum
+
+from . import dashboard, sharding
+from .models import ClickCounterShard, Url
+
+
+def increment(url_id, amount=1, shards=None):
+    """Add ``amount`` clicks to a url, on a random shard when sharding is on"""
+    shards = settings.SHORTNER_CLICK_COUNTER_SHARDS if shards is None else shards
+    if shards <= 1:
+        Url.objects.filter(pk=url_id).update(click_count=F('click_count') + amount)
+        return
+
+    shard = random.randrange(shards)
+    counter = ClickCounterShard.objects.filter(url_id=url_id, shard=shard)
+    if counter.update(count=F('count') + amount):
+        return
+    try:
+        with transaction.atomic(using=sharding.current()):
+            ClickCounterShard.objects.create(url_id=url_id, shard=shard, count=amount)
+    except IntegrityError:
+        # Created concurrently by another writer
+        counter.update(count=F('count') + amount)
+
+
+def fold(batch_size=1000):
+    """
+    Move pending shard counts into ``Url.click_count`` on every database
+    shard. Returns the number of clicks moved.
+    """
+    moved = 0
+    for alias in sharding.each_shard():
+        moved += _fold_shard(alias, batch_size)
+    return moved
+
+
+def _fold_shard(alias, batch_size):
+    locking = connections[alias].features.has_select_for_update_skip_locked
+    moved = 0
+    while True:
+        with transaction.atomic(using=alias):
+            pending = ClickCounterShard.objects.filter(count__gt=0).order_by('url_id', 'shard')
+            if locking:
+                # Shards being incremented (or folded elsewhere) are left for the next run
+                pending = pending.select_for_update(skip_locked=True)
+            rows = list(pending.values_list('id', 'url_id', 'count')[:batch_size])
+            if not rows:
+                break
+
+            totals = Counter()
+            for shard_id, url_id, count in rows:
+                totals[url_id] += count
+            if locking:
+                ClickCounterShard.objects.filter(pk__in=[row[0] for row in rows]).update(count=0)
+            else:
+                # Without row locks, subtract what was read so concurrent increments survive
+                for shard_id, url_id, count in rows:
+                    ClickCounterShard.objects.filter(pk=shard_id).update(count=F('count') - count)
+            for url_id, total in totals.items():
+                Url.objects.filter(pk=url_id).update(click_count=F('click_count') + total)
+            dashboard.invalidate_urls(totals)
+
+        moved += sum(totals.values())
+        if len(rows) < batch_size:
+            break
+    return moved
+
+
+_last_fold = 0.0
+_fold_lock = threading.Lock()
+
+
+def maybe_fold():
+    """``fold`` if this process has not folded for the fold interval (never blocks)"""
+    global _last_fold
+    if settings.SHORTNER_CLICK_COUNTER_SHARDS <= 1:
+        return 0
+    if time.monotonic() - _last_fold < settings.SHORTNER_CLICK_COUNTER_FOLD_INTERVAL:
+        return 0
+    if not _fold_lock.acquire(blocking=False):
+        return 0
+    try:
+        _last_fold = time.monotonic()
+        return fold()
+    finally:
+        _fold_lock.release()
+
+
+def live_click_count(url_obj):
+    """``click_count`` plus clicks not folded yet"""
+    pending = url_obj.counter_shards.aggregate(total=Sum('count'))['total'] or 0
+    return url_obj.click_count + pending
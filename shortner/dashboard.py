@@ -0,0 +1,134 @@
+"""
+Cached dashboard payloads.
+
+A dashboard page (rows, totals and the next cursor) is built once and
+kept in the shared cache (``SHORTNER_CACHE_ALIAS``) for
+``SHORTNER_DASHBOARD_CACHE_TTL`` seconds. Rows are stored ready to render
+or serialize: the absolute short URL and the creation time are formatted
+when the page is built, so a cache hit does no per-row work.
+
+Each user has a version number in the cache, and page keys include it.
+``invalidate`` replaces the version, which orphans every cached page of
+that user at once (they expire on their own). It is called when a link is
+created, edited or deleted and when clicks are added to ``click_count``.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.db.models import Count, Sum
+from django.db.models.functions import Coalesce
+
+from . import sharding
+from .cache import shared_cache
+from .models import Url, short_url_base
+from .pagination import keyset_page, merged_keyset_page
+from .visitors import visitors_by_url
+from .bots import bot_hits_by_url
+
+
+def _version_key(user_id):
+    return f'shortner:dashboard:{user_id}:version'
+
+
+def _page_key(user_id, version, cursor, base):
+    # The base is part of the key: without SHORTNER_SHORT_DOMAIN it follows the request host
+    digest = hashlib.md5(f'{cursor}|{base}'.encode('utf-8')).hexdigest()
+    return f'shortner:dashboard:{user_id}:{version}:{digest}'
+
+
+def build_page(user, cursor, base):
+    """
+    One keyset page of the user's links plus DB-computed totals.
+    Raises ValueError for a malformed cursor. With sharding, every shard
+    is queried and the pages and totals merged.
+    """
+    user_urls = sharding.per_shard(Url.objects.filter(user=user, deleted_at__isnull=True))
+    page_size = settings.SHORTNER_DASHBOARD_PAGE_SIZE
+    if len(user_urls) > 1:
+        urls, next_cursor = merged_keyset_page(user_urls, cursor, page_size)
+    else:
+        urls, next_cursor = keyset_page(user_urls[0], cursor, page_size)
+    totals = {'total_urls': 0, 'total_clicks': 0}
+    for queryset in user_urls:
+        shard_totals = queryset.aggregate(
+            total_urls=Count('id'),
+            total_clicks=Coalesce(Sum('click_count'), 0),
+        )
+        for name, value in shard_totals.items():
+            totals[name] += value
+    visitors, bot_hits = {}, {}
+    for alias, url_ids in sharding.group_ids(url.id for url in urls).items():
+        with sharding.use(alias):
+            if settings.SHORTNER_UNIQUE_VISITORS:
+                visitors.update(visitors_by_url(url_ids))
+            bot_hits.update(bot_hits_by_url(url_ids))
+    rows = [
+        {
+            'id': url.id,
+            'code': url.uuid,
+            'link': url.link,
+            'full_short_url': url.short_url(base=base),
+            'click_count': url.click_count,
+            'unique_visitors': visitors.get(url.id, 0),
+            'bot_hits': bot_hits.get(url.id, 0),
+            'is_active': url.is_active,
+            'redirect_type': url.redirect_type,
+            'cache_max_age': url.cache_max_age,
+            'created_at': url.created_at.strftime("%Y-%m-%d %H:%M:%S"),
+            'updated_at': url.updated_at.isoformat(),
+        }
+        for url in urls
+    ]
+    return {'results': rows, 'next_cursor': next_cursor, **totals}
+
+
+def get_page(request):
+    """The dashboard payload for the current user and ``?cursor=``, from the cache if possible"""
+    cursor = request.GET.get('cursor') or None
+    base = short_url_base(request)
+    ttl = settings.SHORTNER_DASHBOARD_CACHE_TTL
+    if ttl <= 0:
+        return build_page(request.user, cursor, base)
+
+    cache = shared_cache()
+    user_id = request.user.pk
+    version = cache.get(_version_key(user_id))
+    if version is None:
+        version = time.time_ns()
+        # Another request may have set one meanwhile; use whichever won
+        if not cache.add(_version_key(user_id), version, None):
+            version = cache.get(_version_key(user_id), version)
+
+    key = _page_key(user_id, version, cursor, base)
+    page = cache.get(key)
+    if page is None:
+        page = build_page(request.user, cursor, base)
+        cache.set(key, page, ttl)
+    return page
+
+
+def invalidate(user_ids):
+    """Drop the cached dashboard pages of these users, now and on commit"""
+    user_ids = {user_id for user_id in user_ids if user_id is not None}
+    if not user_ids or settings.SHORTNER_DASHBOARD_CACHE_TTL <= 0:
+        return
+
+    def _bump():
+        version = time.time_ns()
+        shared_cache().set_many({_version_key(user_id): version for user_id in user_ids}, None)
+
+    _bump()
+    sharding.on_commit(_bump)
+
+
+def invalidate_urls(url_ids):
+    """``invalidate`` for the owners of these links"""
+    url_ids = list(url_ids)
+    if not url_ids or settings.SHORTNER_DASHBOARD_CACHE_TTL <= 0:
+        return
+    user_ids = set()
+    for alias, shard_ids in sharding.group_ids(url_ids).items():
+        with sharding.use(alias):
+            user_ids.update(Url.objects.filter(pk__in=shard_ids).values_list('user_id', flat=True).distinct())
+    invalidate(user_ids)
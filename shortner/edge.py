@@ -0,0 +1,273 @@
+"""
+Edge (CDN) caching of redirects.
+
+Each link picks its redirect status (``Url.redirect_type``: 302, 301 or
+307) and how long the redirect may be cached (``Url.cache_max_age``; if
+unset, ``SHORTNER_PERMANENT_REDIRECT_MAX_AGE`` for 301 and
+``SHORTNER_REDIRECT_MAX_AGE`` otherwise). Cacheable redirects carry
+``Cache-Control: public, max-age=N`` for browsers, ``Surrogate-Control``
+for the CDN, and every redirect carries a ``Surrogate-Key`` naming the
+link.
+
+When a link is edited or deleted, its surrogate key is purged through
+``SHORTNER_PURGE_BACKEND`` once the transaction commits:
+
+* ``NullPurgeBackend`` does nothing (no CDN),
+* ``LocalPurgeBackend`` records the purged keys in memory (tests and
+  local development),
+* ``HTTPPurgeBackend`` POSTs the keys in a ``Surrogate-Key`` header to
+  ``SHORTNER_PURGE_URL`` (Fastly-style purge-by-key API) from a daemon
+  thread, so a slow CDN API never holds up a request.
+
+A redirect served from the CDN never reaches Django, so its click is not
+recorded here. With ``SHORTNER_EDGE_CLICKS = True``, cacheable redirects
+are not counted at the origin either; the edge reports every request
+for them instead, through the beacon endpoint (``click_beacon``) or its
+access logs (``manage.py ingest_edge_logs``). Redirects that are not
+cacheable are always counted at the origin, and reports for them are
+ignored, so no click is counted twice.
+"""
+import atexit
+import datetime
+import ipaddress
+import json
+import logging
+import queue
+import threading
+import urllib.request
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.module_loading import import_string
+
+from . import cache, sharding, useragents
+
+logger = logging.getLogger(__name__)
+
+# Longest cache lifetime a link may ask for (one year)
+MAX_CACHE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+# ================================
+# Response headers
+# ================================
+def surrogate_key(url_id):
+    return f'link-{url_id}'
+
+
+def max_age(redirect_type, cache_max_age):
+    """Seconds a redirect may be cached (0 = not cacheable)"""
+    if cache_max_age is not None:
+        return cache_max_age
+    if redirect_type == 301:
+        return settings.SHORTNER_PERMANENT_REDIRECT_MAX_AGE
+    return settings.SHORTNER_REDIRECT_MAX_AGE
+
+
+def counted_at_edge(redirect_type, cache_max_age):
+    """True if clicks on this redirect are reported by the edge, not recorded by the view"""
+    return settings.SHORTNER_EDGE_CLICKS and max_age(redirect_type, cache_max_age) > 0
+
+
+def apply_headers(response, url_id, redirect_type, cache_max_age):
+    """Set the status and caching headers of a redirect response"""
+    response.status_code = redirect_type
+    response['Surrogate-Key'] = surrogate_key(url_id)
+    seconds = max_age(redirect_type, cache_max_age)
+    if seconds > 0:
+        response['Cache-Control'] = f'public, max-age={seconds}'
+        # The CDN may keep it longer: edits purge it there
+        response['Surrogate-Control'] = f'max-age={max(seconds, settings.SHORTNER_SURROGATE_MAX_AGE)}'
+    else:
+        response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+# ================================
+# Purging
+# ================================
+class NullPurgeBackend:
+    def purge(self, keys):
+        pass
+
+
+class LocalPurgeBackend:
+    """Keeps purged keys in memory; for tests and local development"""
+
+    def __init__(self):
+        self.purged = []
+        self._lock = threading.Lock()
+
+    def purge(self, keys):
+        with self._lock:
+            self.purged.extend(keys)
+
+    def clear(self):
+        with self._lock:
+            self.purged.clear()
+
+
+class HTTPPurgeBackend:
+    """
+    POST the keys as a ``Surrogate-Key`` header to ``SHORTNER_PURGE_URL``.
+    Purges are queued and sent by a daemon thread; keys queued while a
+    request is in flight go out together, up to ``MAX_KEYS`` per POST.
+    """
+    MAX_KEYS = 256
+
+    def __init__(self):
+        self.url = settings.SHORTNER_PURGE_URL
+        self.token = settings.SHORTNER_PURGE_TOKEN
+        self.timeout = settings.SHORTNER_PURGE_TIMEOUT
+        self.queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name='shortner-edge-purger', daemon=True
+                )
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def purge(self, keys):
+        self.start()
+        self.queue.put(list(keys))
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            keys = self.queue.get()
+            if keys is None:
+                break
+            # Everything queued meanwhile goes in the same requests
+            while True:
+                try:
+                    more = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if more is None:
+                    stopping = True
+                    break
+                keys += more
+            keys = list(dict.fromkeys(keys))
+            for start in range(0, len(keys), self.MAX_KEYS):
+                batch = keys[start:start + self.MAX_KEYS]
+                try:
+                    self.send(batch)
+                except Exception as exc:
+                    # The CDN copy expires on its own (Surrogate-Control)
+                    logger.warning("Failed to purge %s from the CDN (%s)", ' '.join(batch), exc)
+
+    def send(self, keys):
+        request = urllib.request.Request(self.url, method='POST', headers={'Surrogate-Key': ' '.join(keys)})
+        if self.token:
+            request.add_header('Authorization', f'Bearer {self.token}')
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+    def stop(self, timeout=5.0):
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            self.queue.put(None)
+            thread.join(timeout)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_purge_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = import_string(settings.SHORTNER_PURGE_BACKEND)()
+    return _backend
+
+
+def purge(url_ids):
+    """Purge these links from the CDN once the current transaction commits"""
+    keys = [surrogate_key(url_id) for url_id in url_ids if url_id is not None]
+    if not keys:
+        return
+
+    def _purge():
+        try:
+            get_purge_backend().purge(keys)
+        except Exception as exc:
+            # The CDN copy expires on its own (Surrogate-Control)
+            logger.warning("Failed to purge %s from the CDN (%s)", ' '.join(keys), exc)
+
+    sharding.on_commit(_purge)
+
+
+# ================================
+# Clicks reported by the edge
+# ================================
+def edge_click(code, ip_address, user_agent, created_at, every_redirect=False):
+    """
+    Click field values for a request the edge reports, or None if the
+    code is unknown, its clicks are recorded at the origin, or the client
+    address is not a valid IP. ``every_redirect`` counts any active link
+    (reports from redirect-only nodes, which record no clicks).
+    """
+    try:
+        ip_address = str(ipaddress.ip_address(ip_address))
+    except ValueError:
+        return None
+    entry = cache.resolve(code)
+    if entry is None:
+        return None
+    url_id, link, is_active, redirect_type, cache_max_age = entry
+    if not is_active or not (every_redirect or counted_at_edge(redirect_type, cache_max_age)):
+        return None
+
+    user_agent = user_agent or ''
+    if settings.SHORTNER_UA_PARSING == useragents.REQUEST:
+        platform, browser, device = useragents.parse_user_agent(user_agent)
+    else:
+        platform = browser = device = None
+    return {
+        'url_id': url_id,
+        'ip_address': ip_address,
+        'user_agent': user_agent,
+        'platform': platform,
+        'browser': browser,
+        'device': device,
+        'created_at': created_at,
+    }
+
+
+def parse_time(value):
+    """An ISO 8601 string or epoch seconds as an aware datetime (now if missing)"""
+    if value in (None, ''):
+        return timezone.now()
+    if isinstance(value, (int, float)):
+        return datetime.datetime.fromtimestamp(value, tz=datetime.timezone.utc)
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(f"Invalid time: {value!r}")
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, datetime.timezone.utc)
+    return parsed
+
+
+def parse_report(body):
+    """
+    Click reports from a beacon body: a JSON array or NDJSON of
+    ``{"code", "ip", "user_agent", "time"}`` objects. Raises ValueError.
+    """
+    text = body.decode('utf-8').strip()
+    if not text:
+        return []
+    if text.startswith('['):
+        reports = json.loads(text)
+    else:
+        reports = [json.loads(line) for line in text.splitlines() if line.strip()]
+    if not all(isinstance(report, dict) for report in reports):
+        raise ValueError("Each report must be a JSON object")
+    return reports
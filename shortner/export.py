@@ -0,0 +1,47 @@
+"""
+Constant-memory click exports.
+
+Rows are read with ``.values_list().iterator(chunk_size=...)`` (a
+server-side cursor on PostgreSQL) and encoded one at a time for a
+``StreamingHttpResponse``.
+"""
+import csv
+import io
+import json
+
+from django.conf import settings
+
+from .models import UrlClick
+
+CLICK_FIELDS = ('id', 'created_at', 'ip_address', 'browser', 'platform', 'device', 'user_agent')
+
+
+def iter_clicks(url_obj):
+    """Yield click dicts for a url, newest first"""
+    rows = (
+        UrlClick.objects.filter(url=url_obj)
+        .order_by('-created_at', '-id')
+        .values_list(*CLICK_FIELDS)
+        .iterator(chunk_size=settings.SHORTNER_EXPORT_CHUNK_SIZE)
+    )
+    for row in rows:
+        click = dict(zip(CLICK_FIELDS, row))
+        click['created_at'] = click['created_at'].isoformat()
+        yield click
+
+
+def as_csv(clicks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CLICK_FIELDS)
+    yield buffer.getvalue()
+    for click in clicks:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow([click[field] for field in CLICK_FIELDS])
+        yield buffer.getvalue()
+
+
+def as_ndjson(clicks):
+    for click in clicks:
+        yield json.dumps(click) + '\n'
@@ -0,0 +1,344 @@
+"""
+Benchmark harness behind ``manage.py loadtest``.
+
+Traffic is a sequence of request dicts, the same shape as one line of a
+JSONL request log::
+
+    {"method": "GET", "path": "/aB3xYz/"}
+    {"method": "GET", "path": "/dashboard/", "user": "bench-3"}
+    {"method": "POST", "path": "/create/", "user": "bench-3", "data": {"link": "https://example.com/"}}
+
+``endpoint`` may be given explicitly; otherwise requests are grouped by
+the name of the URL pattern they resolve to. Traffic either comes from a
+recorded log (``read_log``) or is synthesized over a seeded dataset with
+Zipf-distributed link popularity (``zipf_traffic``), and is replayed
+in-process through the Django test client (with query counts) or against
+a running WSGI/ASGI server (``replay_server``).
+
+Reports are ``{endpoint: stats}`` dicts that can be saved as a baseline
+and diffed against later runs with ``compare``. Query counts cover every
+database a request may touch (default, shards and replicas).
+"""
+import contextlib
+import itertools
+import json
+import random
+import time
+from collections import defaultdict
+from datetime import timedelta
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import Resolver404, resolve
+from django.utils import timezone
+
+from . import sharding
+from .bench import http_load, summarize
+from .bulk import insert_chunk
+from .models import Url, UrlClick
+
+DEFAULT_MIX = {'redirect': 90, 'dashboard': 5, 'create': 5}
+
+
+# ================================
+# Dataset
+# ================================
+def seed(users=10, urls_per_user=100, clicks_per_url=10, prefix='bench'):
+    """
+    Make sure ``users`` users named ``<prefix>-<n>`` exist with at least
+    ``urls_per_user`` links each, and give new links ``clicks_per_url``
+    clicks spread over the last 30 days, each link's on its shard. Returns
+    ``{username: [codes]}``.
+    """
+    dataset = {}
+    now = timezone.now()
+    for index in range(users):
+        user, _ = User.objects.get_or_create(username=f'{prefix}-{index}')
+        existing = []
+        for alias in sharding.each_shard():
+            existing += Url.objects.filter(user=user, deleted_at__isnull=True).values_list('id', 'uuid')
+        existing = [code for url_id, code in sorted(existing)[:urls_per_user]]
+        missing = urls_per_user - len(existing)
+        if missing > 0:
+            links = [f'https://example.com/{prefix}/{index}/{n}' for n in range(len(existing), urls_per_user)]
+            codes = insert_chunk(user, links)
+            if clicks_per_url:
+                for alias, shard_codes in sharding.group_codes(codes).items():
+                    with sharding.use(alias):
+                        _seed_clicks(Url.objects.filter(uuid__in=shard_codes), clicks_per_url, now)
+            existing += codes
+        # Sorted so a traffic seed replays the same links on every run
+        dataset[user.username] = sorted(existing)
+    return dataset
+
+
+def _seed_clicks(urls, clicks_per_url, now):
+    clicks = [
+        UrlClick(
+            url=url,
+            ip_address=f'10.0.{n % 256}.{(url.id + n) % 256}',
+            user_agent='shortner-bench/1.0',
+            created_at=now - timedelta(minutes=n * 30 * 24 * 60 // clicks_per_url),
+        )
+        for url in urls
+        for n in range(clicks_per_url)
+    ]
+    UrlClick.objects.bulk_create(clicks, batch_size=5000)
+    urls.update(click_count=clicks_per_url)
+
+
+# ================================
+# Traffic
+# ================================
+def read_log(path):
+    """Yield request dicts from a JSONL request log, skipping blank lines"""
+    with open(path) as handle:
+        for number, line in enumerate(handle, 1):
+            line = line.strip()
+            if not line:
+                continue
+            request = json.loads(line)
+            if 'path' not in request:
+                raise ValueError(f"{path}:{number}: request has no 'path'")
+            yield request
+
+
+def write_log(requests, path):
+    """Record traffic as a JSONL request log; returns the number of lines"""
+    count = 0
+    with open(path, 'w') as handle:
+        for request in requests:
+            handle.write(json.dumps(request) + '\n')
+            count += 1
+    return count
+
+
+def zipf_traffic(dataset, count, exponent=1.1, mix=None, seed=None):
+    """
+    Yield ``count`` synthetic requests over a ``seed()`` dataset: redirects
+    pick links with Zipf(``exponent``) popularity, the other endpoints pick
+    users uniformly. ``mix`` maps endpoint to relative weight.
+    """
+    rng = random.Random(seed)
+    mix = mix or DEFAULT_MIX
+    usernames = list(dataset)
+    codes = [code for username in usernames for code in dataset[username]]
+    if not usernames or not codes:
+        raise ValueError("The dataset has no links; seed it first")
+    rng.shuffle(codes)
+    popularity = list(itertools.accumulate(1 / rank ** exponent for rank in range(1, len(codes) + 1)))
+    endpoints = list(mix)
+    weights = list(itertools.accumulate(mix[endpoint] for endpoint in endpoints))
+
+    for n in range(count):
+        endpoint = rng.choices(endpoints, cum_weights=weights)[0]
+        if endpoint == 'redirect':
+            code = rng.choices(codes, cum_weights=popularity)[0]
+            yield {'method': 'GET', 'path': f'/{code}/', 'endpoint': endpoint}
+        elif endpoint == 'create':
+            yield {
+                'method': 'POST', 'path': '/create/', 'endpoint': endpoint,
+                'user': rng.choice(usernames),
+                'data': {'link': f'https://example.com/new/{seed}/{n}'},
+            }
+        else:
+            yield {
+                'method': 'GET', 'path': f'/{endpoint}/', 'endpoint': endpoint,
+                'user': rng.choice(usernames),
+            }
+
+
+def endpoint_of(request):
+    if request.get('endpoint'):
+        return request['endpoint']
+    try:
+        return resolve(request['path'].split('?')[0]).url_name or 'unknown'
+    except Resolver404:
+        return 'not_found'
+
+
+# ================================
+# Replay
+# ================================
+def query_databases():
+    """Aliases of every database a request may query"""
+    return list(dict.fromkeys([DEFAULT_DB_ALIAS, *sharding.all_shards(), *settings.SHORTNER_READ_REPLICAS]))
+
+
+@contextlib.contextmanager
+def capture_queries():
+    """Capture queries on every database; yields ``{alias: CaptureQueriesContext}``"""
+    with contextlib.ExitStack() as stack:
+        yield {
+            alias: stack.enter_context(CaptureQueriesContext(connections[alias]))
+            for alias in query_databases()
+        }
+
+
+def _report(samples, total_elapsed):
+    """Build ``{endpoint: stats}`` plus an ``all`` row from raw samples"""
+    report = {}
+    everything = {'latencies': [], 'queries': [], 'errors': 0}
+    for endpoint, sample in sorted(samples.items()):
+        # Serial replay: an endpoint's throughput is requests per second spent on it
+        stats = summarize(sample['latencies'], sum(sample['latencies']), sample['errors'])
+        if sample['queries']:
+            stats['queries_avg'] = round(sum(sample['queries']) / len(sample['queries']), 2)
+            stats['queries_max'] = max(sample['queries'])
+        report[endpoint] = stats
+        for key in ('latencies', 'queries'):
+            everything[key] += sample[key]
+        everything['errors'] += sample['errors']
+
+    stats = summarize(everything['latencies'], total_elapsed, everything['errors'])
+    if everything['queries']:
+        stats['queries_avg'] = round(sum(everything['queries']) / len(everything['queries']), 2)
+        stats['queries_max'] = max(everything['queries'])
+    report['all'] = stats
+    return report
+
+
+def replay_client(requests):
+    """Replay traffic serially through the Django test client, counting queries"""
+    clients = {}
+    samples = defaultdict(lambda: {'latencies': [], 'queries': [], 'errors': 0})
+
+    def client_for(username):
+        if username not in clients:
+            client = Client(HTTP_USER_AGENT='shortner-bench/1.0')
+            if username:
+                client.force_login(User.objects.get(username=username))
+            clients[username] = client
+        return clients[username]
+
+    start = time.perf_counter()
+    for request in requests:
+        client = client_for(request.get('user'))
+        method = request.get('method', 'GET').upper()
+        sample = samples[endpoint_of(request)]
+
+        with capture_queries() as queries:
+            began = time.perf_counter()
+            if method == 'GET':
+                response = client.get(request['path'], request.get('data'))
+            else:
+                response = client.generic(
+                    method, request['path'],
+                    _encode_body(request.get('data')),
+                    content_type=request.get('content_type', 'application/x-www-form-urlencoded'),
+                )
+            sample['latencies'].append(time.perf_counter() - began)
+        sample['queries'].append(sum(len(captured) for captured in queries.values()))
+        if response.status_code >= 500:
+            sample['errors'] += 1
+
+    return _report(samples, time.perf_counter() - start)
+
+
+def _encode_body(data):
+    if data is None:
+        return ''
+    if isinstance(data, str):
+        return data
+    return urlencode(data)
+
+
+def replay_server(base_url, requests, concurrency=50):
+    """
+    Replay the GET requests of some traffic against a running server, one
+    endpoint at a time. Logged-in requests reuse a session cookie per user.
+    Returns ``(report, skipped)``; non-GET requests are skipped because
+    they would need a CSRF round trip per request.
+    """
+    groups = defaultdict(lambda: defaultdict(list))
+    skipped = 0
+    for request in requests:
+        if request.get('method', 'GET').upper() != 'GET':
+            skipped += 1
+            continue
+        groups[endpoint_of(request)][request.get('user')].append(request['path'])
+
+    cookies = {}
+    report = {}
+    start = time.perf_counter()
+    for endpoint, by_user in sorted(groups.items()):
+        runs = []
+        for username, paths in by_user.items():
+            headers = {}
+            if username:
+                if username not in cookies:
+                    client = Client()
+                    client.force_login(User.objects.get(username=username))
+                    cookies[username] = client.cookies[settings.SESSION_COOKIE_NAME].value
+                headers['Cookie'] = f'{settings.SESSION_COOKIE_NAME}={cookies[username]}'
+            runs.append(http_load(base_url, paths, concurrency=concurrency, headers=headers))
+        report[endpoint] = _merge(runs)
+    report['all'] = _merge(list(report.values()))
+    report['all']['seconds'] = round(time.perf_counter() - start, 3)
+    return report, skipped
+
+
+def _merge(runs):
+    """Combine per-run stats: sums for counts, request-weighted percentiles"""
+    requests = sum(run['requests'] for run in runs)
+    seconds = sum(run['seconds'] for run in runs)
+    merged = {
+        'requests': requests,
+        'errors': sum(run['errors'] for run in runs),
+        'seconds': round(seconds, 3),
+        'rps': round(requests / seconds, 1) if seconds else 0.0,
+    }
+    for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+        merged[key] = round(
+            sum(run[key] * run['requests'] for run in runs) / requests, 2
+        ) if requests else 0.0
+    merged['max_ms'] = max((run['max_ms'] for run in runs), default=0.0)
+    return merged
+
+
+# ================================
+# Baselines
+# ================================
+# Metrics where a higher value is worse (``rps`` is the opposite)
+LATENCY_METRICS = ('p50_ms', 'p95_ms', 'p99_ms')
+
+
+def save_baseline(report, path):
+    with open(path, 'w') as handle:
+        json.dump(report, handle, indent=2, sort_keys=True)
+        handle.write('\n')
+
+
+def load_baseline(path):
+    with open(path) as handle:
+        return json.load(handle)
+
+
+def compare(report, baseline, tolerance=0.2):
+    """
+    Diff a report against a baseline. Returns ``[(endpoint, metric, old,
+    new, regressed)]`` for every metric both have; latency and throughput
+    regress beyond ``tolerance`` (a fraction), query counts on any increase.
+    """
+    rows = []
+    for endpoint, stats in report.items():
+        old_stats = baseline.get(endpoint)
+        if not old_stats:
+            continue
+        for metric in LATENCY_METRICS + ('rps', 'queries_avg'):
+            if metric not in stats or metric not in old_stats:
+                continue
+            old, new = old_stats[metric], stats[metric]
+            if metric == 'rps':
+                regressed = new < old * (1 - tolerance)
+            elif metric == 'queries_avg':
+                regressed = new > old
+            else:
+                regressed = new > old * (1 + tolerance)
+            rows.append((endpoint, metric, old, new, regressed))
+    return rows
+
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+
+from shortner import sharding
+from shortner.models import UrlClick
+from shortner.visitors import add_clicks
+
+
+class Command(BaseCommand):
+    help = (
+        "Fold existing clicks into the unique-visitor sketches. Safe to run "
+        "again: a click already counted does not change its sketches."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument('--url', type=int, help="Only this link id")
+
+    def handle(self, *args, **options):
+        aliases = sharding.all_shards()
+        if options['url']:
+            aliases = [alias for alias in [sharding.for_id(options['url'])] if alias]
+
+        folded = 0
+        for alias in aliases:
+            with sharding.use(alias):
+                folded += self._backfill(options)
+        self.stdout.write(f"Folded {folded} clicks into visitor sketches")
+
+    def _backfill(self, options):
+        clicks = UrlClick.objects.all()
+        if options['url']:
+            clicks = clicks.filter(url_id=options['url'])
+
+        folded = 0
+        last_id = 0
+        while True:
+            chunk = list(
+                clicks.filter(id__gt=last_id)
+                .order_by('id')
+                .values('id', 'url_id', 'ip_address', 'user_agent', 'created_at')[:options['chunk_size']]
+            )
+            if not chunk:
+                break
+            add_clicks(chunk)
+            folded += len(chunk)
+            last_id = chunk[-1]['id']
+        return folded
@@ -0,0 +1,90 @@
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.test import override_settings
+from django.utils import timezone
+
+from shortner import counters, sharding
+from shortner.clicks import write_clicks
+from shortner.models import Url
+
+
+class Command(BaseCommand):
+    help = (
+        "Concurrency test: many threads write clicks for one short code at "
+        "once, with and without sharded counters, and report clicks/sec and "
+        "whether every click was counted. Use PostgreSQL; SQLite serializes "
+        "all writers anyway."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=32)
+        parser.add_argument('--clicks', type=int, default=200, help="Clicks per thread")
+        parser.add_argument('--shards', type=int, nargs='+', default=[1, 16],
+                            help="Shard counts to compare (1 = update Url.click_count directly)")
+        parser.add_argument('--counter-only', action='store_true',
+                            help="Only increment the counter (no UrlClick insert)")
+
+    def handle(self, *args, **options):
+        user, _ = User.objects.get_or_create(username='bench')
+        alias = sharding.for_code('benchhot')
+        with sharding.use(alias):
+            url, _ = Url.objects.get_or_create(
+                user=user, uuid='benchhot', defaults={'link': 'https://example.com/'}
+            )
+        total = options['threads'] * options['clicks']
+
+        for shards in options['shards']:
+            counters.fold()
+            url.refresh_from_db()
+            before = url.click_count
+
+            with override_settings(SHORTNER_CLICK_COUNTER_SHARDS=shards,
+                                   SHORTNER_CLICK_COUNTER_FOLD_INTERVAL=3600):
+                elapsed, errors = self._hammer(url.pk, alias, options)
+                counters.fold()
+
+            url.refresh_from_db()
+            counted = url.click_count - before
+            self.stdout.write(
+                f"shards={shards}: {total} clicks from {options['threads']} threads in "
+                f"{elapsed:.2f}s, {total / elapsed:.0f} clicks/s, counted {counted}, errors {errors}"
+            )
+            if counted != total - errors:
+                raise CommandError(f"Lost clicks: expected {total - errors}, counted {counted}")
+
+    def _hammer(self, url_id, alias, options):
+        errors = []
+        barrier = threading.Barrier(options['threads'] + 1)
+
+        def worker():
+            barrier.wait()
+            try:
+                for _ in range(options['clicks']):
+                    try:
+                        if options['counter_only']:
+                            # Threads do not inherit the selected shard
+                            with sharding.use(alias):
+                                counters.increment(url_id)
+                        else:
+                            write_clicks([{
+                                'url_id': url_id, 'ip_address': '10.0.0.1',
+                                'user_agent': 'shortner-bench/1.0', 'platform': '',
+                                'browser': '', 'device': '', 'created_at': timezone.now(),
+                            }])
+                    except Exception:
+                        errors.append(1)
+            finally:
+                close_old_connections()
+
+        threads = [threading.Thread(target=worker) for _ in range(options['threads'])]
+        for thread in threads:
+            thread.start()
+        barrier.wait()
+        started = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - started, len(errors)
@@ -0,0 +1,106 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from shortner import sharding
+from shortner.models import Url
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test a short code generator: create COUNT links in chunks and "
+        "report the collision rate and insert throughput."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=1000000)
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument('--generator', default='shortner.codes.HashidsCodeGenerator')
+        parser.add_argument('--length', type=int, default=None)
+        parser.add_argument('--no-insert', action='store_true',
+                            help="Only generate codes (collisions checked in memory)")
+        parser.add_argument('--cleanup', action='store_true',
+                            help="Delete the links created by this run afterwards")
+
+    def handle(self, *args, **options):
+        generator = import_string(options['generator'])(length=options['length'])
+        count = options['count']
+        chunk_size = options['chunk_size']
+        insert = not options['no_insert']
+        user, _ = User.objects.get_or_create(username='bench')
+
+        seen = set()
+        collisions = 0
+        created = 0
+        gen_seconds = 0.0
+        insert_seconds = 0.0
+        empty_rounds = 0
+
+        while created < count:
+            size = min(chunk_size, count - created)
+
+            start = time.perf_counter()
+            codes = generator.generate_many(size)
+            gen_seconds += time.perf_counter() - start
+
+            # Collisions within this run, then against rows already stored
+            fresh = []
+            for code in codes:
+                if code in seen:
+                    collisions += 1
+                else:
+                    seen.add(code)
+                    fresh.append(code)
+            if insert:
+                taken = self._taken(fresh)
+                collisions += len(taken)
+                fresh = [code for code in fresh if code not in taken]
+
+                start = time.perf_counter()
+                self._insert(user, fresh)
+                insert_seconds += time.perf_counter() - start
+
+            created += len(fresh)
+            empty_rounds = 0 if fresh else empty_rounds + 1
+            if empty_rounds >= 10:
+                self.stderr.write("Code space exhausted for this length")
+                break
+
+        attempts = created + collisions
+        self.stdout.write(f"generator: {options['generator']} (length {generator.length})")
+        self.stdout.write(
+            f"codes: {created} unique, {collisions} collisions "
+            f"({collisions / attempts * 100 if attempts else 0:.4f}%)"
+        )
+        self.stdout.write(f"generation: {created / gen_seconds if gen_seconds else 0:,.0f} codes/s")
+        if insert:
+            self.stdout.write(
+                f"insert: {created / insert_seconds if insert_seconds else 0:,.0f} rows/s"
+            )
+
+        if options['cleanup'] and insert:
+            for alias, codes in sharding.group_codes(seen).items():
+                with sharding.use(alias):
+                    for i in range(0, len(codes), chunk_size):
+                        Url.objects.filter(user=user, uuid__in=codes[i:i + chunk_size]).delete()
+
+    def _taken(self, codes):
+        """Codes already stored, looked up on each code's shard"""
+        return {
+            code
+            for alias, shard_codes in sharding.group_codes(codes).items()
+            for code in Url.objects.using(alias).filter(uuid__in=shard_codes).values_list('uuid', flat=True)
+        }
+
+    def _insert(self, user, codes):
+        """Store one link per code on the code's shard"""
+        for alias, shard_codes in sharding.group_codes(codes).items():
+            rows = [Url(user=user, link='https://example.com/', uuid=code) for code in shard_codes]
+            if sharding.enabled():
+                for row, url_id in zip(rows, sharding.new_ids(alias, len(rows))):
+                    row.pk = url_id
+            with sharding.use(alias), transaction.atomic(using=alias):
+                Url.objects.bulk_create(rows)
@@ -0,0 +1,110 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+from django.template import Engine, engines
+from django.test import Client, override_settings
+
+from shortner import bulk, sharding
+from shortner.bench import format_summary, summarize
+from shortner.cache import shared_cache
+from shortner.loadtest import capture_queries
+from shortner.models import Url
+
+MODES = (
+    # label, dashboard page cache TTL, fragment cache TTL, shell
+    ('uncached', 0, 0, False),
+    ('page cache', 300, 0, False),
+    ('page + fragments', 300, 3600, False),
+    ('shell + json', 300, 3600, True),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Time dashboard loads for a user with many links: uncached, with "
+        "the cached page payload, with cached card fragments, and as a "
+        "shell filled from the JSON listing. Also compares template "
+        "lookup with and without the cached loader."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--links', type=int, default=10000, help="Links owned by the bench user")
+        parser.add_argument('--page-size', type=int, default=settings.SHORTNER_DASHBOARD_PAGE_SIZE)
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--username', default='bench-dashboard')
+
+    def handle(self, *args, **options):
+        user = self._seed(options['username'], options['links'])
+        self.stdout.write(f"{options['username']}: {self._count(user)} links, page size {options['page_size']}")
+
+        for label, page_ttl, fragment_ttl, shell in MODES:
+            caches['template_fragments'].clear()
+            shared_cache().clear()
+            with override_settings(
+                SHORTNER_DASHBOARD_PAGE_SIZE=options['page_size'],
+                SHORTNER_DASHBOARD_CACHE_TTL=page_ttl,
+                SHORTNER_FRAGMENT_CACHE_TTL=fragment_ttl,
+                SHORTNER_DASHBOARD_SHELL=shell,
+            ):
+                client = Client()
+                client.force_login(user)
+                paths = ['/dashboard/', '/dashboard/json/'] if shell else ['/dashboard/']
+
+                began = time.perf_counter()
+                self._load(client, paths)
+                first = time.perf_counter() - began
+
+                latencies = []
+                with capture_queries() as queries:
+                    started = time.perf_counter()
+                    for _ in range(options['requests']):
+                        began = time.perf_counter()
+                        self._load(client, paths)
+                        latencies.append(time.perf_counter() - began)
+                    elapsed = time.perf_counter() - started
+            stats = summarize(latencies, elapsed)
+            count = sum(len(captured) for captured in queries.values())
+            self.stdout.write(
+                f"{format_summary(label, stats)}, first load {first * 1000:.1f}ms, "
+                f"{count / options['requests']:.1f} queries/load"
+            )
+
+        self._bench_loaders(options['requests'])
+
+    def _load(self, client, paths):
+        for path in paths:
+            response = client.get(path)
+            if response.status_code != 200:
+                raise RuntimeError(f"{path} returned {response.status_code}")
+
+    def _count(self, user):
+        """The user's links on every shard"""
+        return sum(Url.objects.filter(user=user).count() for alias in sharding.each_shard())
+
+    def _seed(self, username, links):
+        user, _ = User.objects.get_or_create(username=username)
+        missing = links - self._count(user)
+        for start in range(0, max(0, missing), settings.SHORTNER_BULK_CHUNK_SIZE):
+            count = min(settings.SHORTNER_BULK_CHUNK_SIZE, missing - start)
+            bulk.insert_chunk(user, [f'https://example.com/{username}/{start + i}' for i in range(count)])
+        return user
+
+    def _bench_loaders(self, requests):
+        """Template lookup (parse + compile) per request, with and without the cached loader"""
+        configured = engines['django'].engine
+        loaders = ['django.template.loaders.filesystem.Loader', 'django.template.loaders.app_directories.Loader']
+        candidates = {
+            'uncached loader': loaders,
+            'cached loader': [('django.template.loaders.cached.Loader', loaders)],
+        }
+        for label, engine_loaders in candidates.items():
+            engine = Engine(dirs=configured.dirs, loaders=engine_loaders, libraries=configured.libraries)
+            started = time.perf_counter()
+            for _ in range(requests):
+                for name in ('shortner/home.html', 'shortner/url_card.html', 'layouts/base.html'):
+                    engine.get_template(name)
+            per_request = (time.perf_counter() - started) / requests * 1e6
+            self.stdout.write(f"{label}: {per_request:.1f}us to load the dashboard templates")
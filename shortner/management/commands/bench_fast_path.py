@@ -0,0 +1,64 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+
+from shortner import cache, sharding
+from shortner.bench import format_summary, summarize
+from shortner.loadtest import capture_queries
+from shortner.models import Url
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure per-redirect overhead of the middleware stack: the same "
+        "short link is requested through the full stack and through "
+        "RedirectFastPathMiddleware, in-process."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=5000)
+        parser.add_argument('--warmup', type=int, default=200)
+        parser.add_argument('--logged-in', action='store_true',
+                            help="Send a session cookie, as a signed-in user clicking a link would")
+
+    def handle(self, *args, **options):
+        user, _ = User.objects.get_or_create(username='bench')
+        with sharding.use(sharding.for_code('bench')):
+            url, _ = Url.objects.get_or_create(
+                user=user, uuid='bench', defaults={'link': 'https://example.com/'}
+            )
+        path = f'/{url.uuid}/'
+        cache.resolve(url.uuid)
+
+        results = {}
+        for label, enabled in (('full stack', False), ('fast path', True)):
+            # A new Client builds its own handler, so the setting takes effect
+            with override_settings(SHORTNER_REDIRECT_FAST_PATH=enabled, SHORTNER_CLICK_ASYNC=True):
+                client = Client(HTTP_USER_AGENT='shortner-bench/1.0')
+                if options['logged_in']:
+                    client.force_login(user)
+                for _ in range(options['warmup']):
+                    client.get(path)
+                latencies = []
+                with capture_queries() as queries:
+                    started = time.perf_counter()
+                    for _ in range(options['requests']):
+                        began = time.perf_counter()
+                        response = client.get(path)
+                        latencies.append(time.perf_counter() - began)
+                    elapsed = time.perf_counter() - started
+                if response.status_code != 302:
+                    self.stderr.write(f"{label}: unexpected status {response.status_code}")
+            stats = summarize(latencies, elapsed)
+            stats['queries'] = sum(len(captured) for captured in queries.values()) / options['requests']
+            results[label] = stats
+            self.stdout.write(f"{format_summary(label, stats)}, {stats['queries']:.2f} queries/redirect")
+
+        full, fast = results['full stack'], results['fast path']
+        saved = (full['seconds'] - fast['seconds']) / options['requests'] * 1e6
+        self.stdout.write(
+            f"Fast path saves {saved:.1f}us per redirect "
+            f"({(1 - fast['seconds'] / full['seconds']) * 100:.0f}% of in-process time)"
+        )
@@ -0,0 +1,45 @@
+import json
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from shortner import sharding
+from shortner.bench import format_summary, http_load
+from shortner.models import Url
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test the redirect endpoint of a running server and report "
+        "requests/sec and latency percentiles. Run it once against "
+        "`gunicorn config.wsgi` and once against `uvicorn config.asgi:application` "
+        "to compare deployments."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000',
+                            help="Base URL of the server under test")
+        parser.add_argument('--code', help="Existing short code to hit (one is created if omitted)")
+        parser.add_argument('--requests', type=int, default=10000)
+        parser.add_argument('--concurrency', type=int, default=100)
+        parser.add_argument('--label', default='redirect')
+        parser.add_argument('--json', action='store_true', help="Print stats as JSON")
+
+    def handle(self, *args, **options):
+        code = options['code'] or self._bench_code()
+        paths = (f'/{code}/' for _ in range(options['requests']))
+
+        stats = http_load(options['url'], paths, concurrency=options['concurrency'])
+
+        if options['json']:
+            self.stdout.write(json.dumps({'label': options['label'], **stats}))
+        else:
+            self.stdout.write(format_summary(options['label'], stats))
+
+    def _bench_code(self):
+        user, _ = User.objects.get_or_create(username='bench')
+        with sharding.use(sharding.for_code('bench')):
+            url, _ = Url.objects.get_or_create(
+                user=user, uuid='bench', defaults={'link': 'https://example.com/'}
+            )
+        return url.uuid
@@ -0,0 +1,61 @@
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from shortner import snapshot
+from shortner.codes import BASE62
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure redirect snapshot lookups: build a snapshot of --links random "
+        "codes in a temporary file and time hash and binary-search lookups."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--links', type=int, default=1_000_000)
+        parser.add_argument('--lookups', type=int, default=200_000)
+        parser.add_argument('--length', type=int, default=7)
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        codes = sorted({''.join(rng.choices(BASE62, k=options['length'])) for _ in range(options['links'])},
+                       key=lambda code: code.encode('utf-8'))
+        rows = (
+            (code, number + 1, f'https://example.com/articles/{number}?utm_source=bench', 302, None)
+            for number, code in enumerate(codes)
+        )
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'redirects.snapshot')
+            started = time.perf_counter()
+            snapshot.write_snapshot(path, rows, snapshot_id=1)
+            built = time.perf_counter() - started
+            size = os.path.getsize(path)
+            self.stdout.write(
+                f"{len(codes):,} links: {size / 2 ** 20:.1f} MiB ({size / max(1, len(codes)):.0f} B/link), "
+                f"written in {built:.2f}s"
+            )
+
+            started = time.perf_counter()
+            opened = snapshot.Snapshot(path)
+            self.stdout.write(f"Opened in {(time.perf_counter() - started) * 1000:.2f} ms")
+
+            present = rng.choices(codes, k=options['lookups'])
+            missing = [''.join(rng.choices(BASE62, k=options['length'])) + '_' for _ in range(options['lookups'])]
+            for name, lookup in (('hash', opened.get), ('binary', opened.search)):
+                for label, sample in (('existing', present), ('missing', missing)):
+                    self.stdout.write(f"{name:>6} {label:>8}: {self._time(lookup, sample):.2f} us/lookup")
+
+    def _time(self, lookup, sample):
+        runs = []
+        for _ in range(3):
+            started = time.perf_counter()
+            for code in sample:
+                lookup(code)
+            runs.append((time.perf_counter() - started) / len(sample) * 1e6)
+        return statistics.median(runs)
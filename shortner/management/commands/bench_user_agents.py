@@ -0,0 +1,57 @@
+import random
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+
+from shortner.cache import LRUCache
+from shortner.useragents import parse_uncached
+
+CORPUS = Path(__file__).resolve().parents[2] / 'data' / 'user_agents.txt'
+
+
+def load_corpus(path=CORPUS):
+    lines = Path(path).read_text().splitlines()
+    return [line for line in lines if line and not line.startswith('#')]
+
+
+class Command(BaseCommand):
+    help = (
+        "Microbenchmark per-click CPU time of user agent parsing, uncached "
+        "vs memoized, over a Zipf-weighted sample of a recorded UA corpus."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clicks', type=int, default=20000)
+        parser.add_argument('--corpus', default=str(CORPUS))
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        corpus = load_corpus(options['corpus'])
+        rng = random.Random(options['seed'])
+        # Traffic is dominated by a few UA strings: weight rank r by 1/r
+        weights = [1 / rank for rank in range(1, len(corpus) + 1)]
+        sample = rng.choices(corpus, weights=weights, k=options['clicks'])
+
+        start = time.process_time()
+        for ua_string in sample:
+            parse_uncached(ua_string)
+        uncached = time.process_time() - start
+
+        cache = LRUCache(maxsize=4096)
+        start = time.process_time()
+        for ua_string in sample:
+            result = cache.get(ua_string)
+            if result is None:
+                cache.set(ua_string, parse_uncached(ua_string))
+        cached = time.process_time() - start
+
+        clicks = len(sample)
+        self.stdout.write(f"{clicks} clicks over {len(corpus)} distinct user agents")
+        self.stdout.write(f"uncached: {uncached / clicks * 1e6:.1f} us CPU/click")
+        self.stdout.write(
+            f"memoized: {cached / clicks * 1e6:.1f} us CPU/click "
+            f"(hits {cache.hits}, misses {cache.misses})"
+        )
+        if cached:
+            self.stdout.write(f"speedup: {uncached / cached:.1f}x")
@@ -0,0 +1,60 @@
+import random
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from shortner import sharding
+from shortner.bloom import get_code_filter, optimal_size
+from shortner.codes import BASE62
+from shortner.models import Url
+
+
+class Command(BaseCommand):
+    help = (
+        "Report the memory use and false-positive rate of the short code Bloom "
+        "filter: projected for --capacity codes, and measured on the current table."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--capacity', type=int, default=50_000_000,
+                            help="Project memory for this many codes")
+        parser.add_argument('--error-rate', type=float, default=settings.SHORTNER_BLOOM_ERROR_RATE)
+        parser.add_argument('--probe', type=int, default=100_000,
+                            help="Random unknown codes used to measure the false-positive rate")
+
+    def handle(self, *args, **options):
+        bits, hashes = optimal_size(options['capacity'], options['error_rate'])
+        self.stdout.write(
+            f"Projected: {options['capacity']:,} codes at {options['error_rate']:.4%} "
+            f"-> {bits / 8 / 2 ** 20:.1f} MiB, {hashes} hashes"
+        )
+
+        code_filter = get_code_filter()
+        started = time.perf_counter()
+        bloom = code_filter.rebuild()
+        elapsed = time.perf_counter() - started
+        stats = bloom.stats()
+        self.stdout.write(
+            f"Current: {stats['items']:,} codes, capacity {stats['capacity']:,}, "
+            f"{stats['memory_bytes'] / 2 ** 20:.2f} MiB, {stats['hashes']} hashes, "
+            f"built in {elapsed:.2f}s, expected false positives {stats['expected_error_rate']:.4%}"
+        )
+
+        if options['probe']:
+            self.stdout.write(f"Measured false positives: {self._measure(bloom, options['probe']):.4%}")
+
+    def _measure(self, bloom, probes):
+        """Share of random codes that do not exist but pass the filter"""
+        rng = random.Random(0)
+        length = Url._meta.get_field('uuid').max_length
+        candidates = list({''.join(rng.choices(BASE62, k=length)) for _ in range(probes)})
+        existing = set()
+        for start in range(0, len(candidates), 500):
+            chunk = candidates[start:start + 500]
+            for alias in sharding.all_shards():
+                codes = [code for code in chunk if sharding.for_code(code) == alias]
+                existing.update(Url.objects.using(alias).filter(uuid__in=codes).values_list('uuid', flat=True))
+        candidates = [code for code in candidates if code not in existing]
+        passed = sum(1 for code in candidates if code in bloom)
+        return passed / len(candidates) if candidates else 0.0
@@ -0,0 +1,51 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from shortner import partitions, sharding
+
+
+class Command(BaseCommand):
+    help = (
+        "Create upcoming monthly click partitions and expire months past the "
+        "retention window, archiving them to compressed CSV first. Run daily."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ahead', type=int, default=settings.SHORTNER_CLICK_PARTITIONS_AHEAD,
+                            help="Months of partitions to create in advance")
+        parser.add_argument('--retain-months', type=int, default=settings.SHORTNER_CLICK_RETENTION_MONTHS,
+                            help="Keep this many months of raw clicks (0 keeps everything)")
+        parser.add_argument('--archive-dir', default=settings.SHORTNER_CLICK_ARCHIVE_DIR,
+                            help="Archive expired months here before dropping them")
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        # Each database shard has its own partitioned click table
+        for alias in sharding.each_shard():
+            self._maintain(alias, options)
+
+    def _maintain(self, alias, options):
+        where = f" on {alias}" if sharding.enabled() else ""
+        if not options['dry_run']:
+            try:
+                created = partitions.ensure_partitions(options['ahead'])
+            except partitions.PartitionRepairError as exc:
+                # Retention and the other shards still run
+                self.stderr.write(f"{exc}{where}")
+                created = []
+            for name, moved in created:
+                repaired = f" (moved {moved} clicks from the default partition)" if moved else ""
+                self.stdout.write(f"Created partition {name}{where}{repaired}")
+
+        if options['retain_months'] <= 0:
+            return
+
+        expired = partitions.apply_retention(
+            options['retain_months'],
+            archive_dir=options['archive_dir'] or None,
+            dry_run=options['dry_run'],
+        )
+        for month, path, rows in expired:
+            verb = "Would drop" if options['dry_run'] else "Dropped"
+            archived = f" (archived {rows} rows to {path})" if path else ""
+            self.stdout.write(f"{verb} clicks for {month:%Y-%m}{where}{archived}")
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from shortner import partitions, sharding
+
+
+class Command(BaseCommand):
+    help = (
+        "Move clicks recorded before migration 0008 into the partitioned click "
+        "table in batches. Safe to stop and re-run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000,
+                            help="Click ids per transaction")
+
+    def handle(self, *args, **options):
+        for alias in sharding.each_shard():
+            where = f" on {alias}" if sharding.enabled() else ""
+            copied = dropped = 0
+            while batch := partitions.copy_legacy_batch(options['batch_size']):
+                copied += batch[0]
+                dropped += batch[1]
+            orphans = f" (dropped {dropped} clicks of deleted links)" if dropped else ""
+            self.stdout.write(f"Copied {copied} legacy clicks{where}{orphans}")
@@ -0,0 +1,43 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from shortner import snapshot
+
+
+class Command(BaseCommand):
+    help = (
+        "Export every active link to a memory-mapped redirect snapshot for "
+        "redirect-only nodes (SHORTNER_REDIRECT_ONLY), or with --delta append "
+        "the links changed since then to its delta log."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=settings.SHORTNER_SNAPSHOT_PATH)
+        parser.add_argument('--delta', action='store_true',
+                            help="Append changes since the last export (needs SHORTNER_SNAPSHOT_CHANGELOG)")
+        parser.add_argument('--chunk-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        started = time.perf_counter()
+        if options['delta']:
+            if not settings.SHORTNER_SNAPSHOT_CHANGELOG:
+                raise CommandError("SHORTNER_SNAPSHOT_CHANGELOG is off: no changes are recorded")
+            try:
+                changed = snapshot.export_delta(path)
+            except FileNotFoundError:
+                raise CommandError(f"No snapshot at {path}: export one first")
+            self.stdout.write(
+                f"Appended {changed} changed links to {snapshot.delta_path(path)} "
+                f"in {time.perf_counter() - started:.2f}s"
+            )
+            return
+
+        exported = snapshot.export_snapshot(path, chunk_size=options['chunk_size'])
+        self.stdout.write(
+            f"Exported {len(exported)} links to {path} ({os.path.getsize(path) / 2 ** 20:.1f} MiB) "
+            f"in {time.perf_counter() - started:.2f}s"
+        )
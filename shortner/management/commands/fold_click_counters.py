@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from shortner.counters import fold
+
+
+class Command(BaseCommand):
+    help = "Move pending sharded click counts into Url.click_count."
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Folded {fold()} clicks")
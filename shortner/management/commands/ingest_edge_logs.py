@@ -0,0 +1,93 @@
+import datetime
+import json
+import re
+import sys
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shortner import bots, edge
+from shortner.clicks import write_clicks
+
+# Combined log format: ip ident user [time] "METHOD path proto" status bytes "referer" "agent"
+COMBINED = re.compile(
+    r'^(?P<ip>\S+) \S+ \S+ \[(?P<time>[^\]]+)\] "(?P<method>\S+) (?P<path>\S+)[^"]*" '
+    r'(?P<status>\d{3}) \S+(?: "[^"]*" "(?P<user_agent>[^"]*)")?'
+)
+SHORT_PATH = re.compile(r'^/(?P<code>[^/?#]+)/?(?:[?#].*)?$')
+REDIRECT_STATUSES = {'301', '302', '307'}
+
+
+class Command(BaseCommand):
+    help = (
+        "Record clicks on CDN-cached redirects from edge access logs "
+        "(combined log format or JSON lines; SHORTNER_EDGE_CLICKS = True). "
+        "Only links whose redirects are cacheable are counted, unless "
+        "--all-redirects (logs of redirect-only snapshot nodes)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='*', help="Log files (default: stdin)")
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--all-redirects', action='store_true',
+                            help="Count every redirect (SHORTNER_REDIRECT_ONLY nodes record no clicks)")
+
+    def handle(self, *args, **options):
+        recorded = skipped = 0
+        batch = []
+        bot_hits = Counter()
+        for line in self._lines(options['files']):
+            click = self._click(line, options['all_redirects'])
+            if click is None:
+                skipped += 1
+                continue
+            if bots.is_bot_click(click):
+                bot_hits[(click['url_id'], click['created_at'].astimezone(datetime.timezone.utc).date())] += 1
+                continue
+            batch.append(click)
+            if len(batch) >= options['batch_size']:
+                recorded += write_clicks(batch)
+                batch = []
+        recorded += write_clicks(batch)
+        if bot_hits:
+            bots.write_hits(bot_hits)
+        self.stdout.write(
+            f"Recorded {recorded} clicks and {sum(bot_hits.values())} bot hits ({skipped} lines skipped)"
+        )
+
+    def _lines(self, files):
+        if not files:
+            yield from sys.stdin
+            return
+        for name in files:
+            try:
+                with open(name, encoding='utf-8', errors='replace') as log:
+                    yield from log
+            except OSError as exc:
+                raise CommandError(f"Cannot read {name}: {exc}")
+
+    def _click(self, line, every_redirect=False):
+        line = line.strip()
+        if not line:
+            return None
+        try:
+            if line.startswith('{'):
+                entry = json.loads(line)
+                created_at = edge.parse_time(entry.get('time'))
+            else:
+                match = COMBINED.match(line)
+                if match is None:
+                    return None
+                entry = match.groupdict()
+                created_at = datetime.datetime.strptime(entry['time'], '%d/%b/%Y:%H:%M:%S %z')
+        except ValueError:
+            return None
+
+        if str(entry.get('method', 'GET')).upper() != 'GET':
+            return None
+        if str(entry.get('status', '')) not in REDIRECT_STATUSES:
+            return None
+        path = SHORT_PATH.match(str(entry.get('path', '')))
+        if path is None:
+            return None
+        return edge.edge_click(path['code'], entry.get('ip'), entry.get('user_agent'), created_at, every_redirect)
@@ -0,0 +1,112 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shortner import loadtest
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a benchmark dataset, replay a JSONL request log or synthetic "
+        "Zipf traffic, and report throughput, p50/p95/p99 latency and query "
+        "counts per endpoint, diffed against a stored baseline."
+    )
+
+    def add_arguments(self, parser):
+        dataset = parser.add_argument_group('dataset')
+        dataset.add_argument('--users', type=int, default=10)
+        dataset.add_argument('--urls', type=int, default=100, help="Links per user")
+        dataset.add_argument('--clicks', type=int, default=10, help="Clicks per new link")
+        dataset.add_argument('--prefix', default='bench', help="Username prefix of seeded users")
+
+        traffic = parser.add_argument_group('traffic')
+        traffic.add_argument('--log', help="Replay this JSONL request log instead of synthetic traffic")
+        traffic.add_argument('--requests', type=int, default=2000)
+        traffic.add_argument('--zipf', type=float, default=1.1, help="Zipf exponent of link popularity")
+        traffic.add_argument('--mix', default='redirect=90,dashboard=5,create=5',
+                             help="Relative endpoint weights for synthetic traffic")
+        traffic.add_argument('--random-seed', type=int, default=0)
+        traffic.add_argument('--record', help="Write the generated traffic to this JSONL file")
+
+        target = parser.add_argument_group('target')
+        target.add_argument('--url', help="Replay GET requests against this running server "
+                                          "instead of the in-process test client")
+        target.add_argument('--concurrency', type=int, default=50)
+
+        baseline = parser.add_argument_group('baseline')
+        baseline.add_argument('--baseline', default='bench_baseline.json')
+        baseline.add_argument('--save-baseline', action='store_true',
+                              help="Store this run as the new baseline")
+        baseline.add_argument('--tolerance', type=float, default=0.2,
+                              help="Allowed latency/throughput drift before flagging a regression")
+        baseline.add_argument('--fail-on-regression', action='store_true')
+
+        parser.add_argument('--json', action='store_true', help="Print the report as JSON")
+
+    def handle(self, *args, **options):
+        if options['log']:
+            requests = list(loadtest.read_log(options['log']))
+        else:
+            dataset = loadtest.seed(
+                options['users'], options['urls'], options['clicks'], prefix=options['prefix']
+            )
+            requests = list(loadtest.zipf_traffic(
+                dataset, options['requests'], exponent=options['zipf'],
+                mix=self._parse_mix(options['mix']), seed=options['random_seed'],
+            ))
+        if options['record']:
+            loadtest.write_log(requests, options['record'])
+            self.stderr.write(f"Recorded {len(requests)} requests to {options['record']}")
+
+        if options['url']:
+            report, skipped = loadtest.replay_server(options['url'], requests, options['concurrency'])
+            if skipped:
+                self.stderr.write(f"Skipped {skipped} non-GET requests (server replay is GET-only)")
+        else:
+            report = loadtest.replay_client(requests)
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2, sort_keys=True))
+        else:
+            self._print_report(report)
+
+        regressions = []
+        if os.path.exists(options['baseline']) and not options['save_baseline']:
+            rows = loadtest.compare(report, loadtest.load_baseline(options['baseline']), options['tolerance'])
+            self._print_diff(rows)
+            regressions = [row for row in rows if row[4]]
+        if options['save_baseline']:
+            loadtest.save_baseline(report, options['baseline'])
+            self.stderr.write(f"Saved baseline to {options['baseline']}")
+
+        if regressions and options['fail_on_regression']:
+            raise CommandError(f"{len(regressions)} metric(s) regressed against {options['baseline']}")
+
+    def _parse_mix(self, value):
+        mix = {}
+        for part in value.split(','):
+            endpoint, _, weight = part.partition('=')
+            try:
+                mix[endpoint.strip()] = float(weight)
+            except ValueError:
+                raise CommandError(f"Bad --mix entry {part!r}; expected endpoint=weight")
+        return mix
+
+    def _print_report(self, report):
+        header = f"{'endpoint':<18}{'requests':>9}{'req/s':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}{'errors':>8}"
+        self.stdout.write(header)
+        for endpoint, stats in report.items():
+            self.stdout.write(
+                f"{endpoint:<18}{stats['requests']:>9}{stats['rps']:>10}{stats['p50_ms']:>9}"
+                f"{stats['p95_ms']:>9}{stats['p99_ms']:>9}{stats.get('queries_avg', '-'):>9}{stats['errors']:>8}"
+            )
+
+    def _print_diff(self, rows):
+        if not rows:
+            return
+        self.stdout.write("\nAgainst baseline:")
+        for endpoint, metric, old, new, regressed in rows:
+            change = f"{(new - old) / old:+.0%}" if old else "n/a"
+            flag = "  REGRESSION" if regressed else ""
+            self.stdout.write(f"  {endpoint:<18}{metric:<12}{old:>10} -> {new:<10} {change}{flag}")
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+
+from shortner import sharding
+from shortner.models import UrlClick
+from shortner.useragents import cache_stats, parse_user_agent
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill in platform/browser/device for clicks stored with only the raw "
+        "user agent (SHORTNER_UA_PARSING = writer/offline)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        updated = 0
+        for alias in sharding.each_shard():
+            updated += self._parse(options['chunk_size'])
+
+        stats = cache_stats()
+        self.stdout.write(
+            f"Parsed {updated} clicks "
+            f"({stats['misses']} distinct parses, {stats['hits']} cache hits)"
+        )
+
+    def _parse(self, chunk_size):
+        updated = 0
+        last_id = 0
+
+        while True:
+            chunk = list(
+                UrlClick.objects.filter(platform__isnull=True, id__gt=last_id)
+                .order_by('id')
+                .only('id', 'user_agent')[:chunk_size]
+            )
+            if not chunk:
+                break
+
+            for click in chunk:
+                click.platform, click.browser, click.device = parse_user_agent(click.user_agent)
+            UrlClick.objects.bulk_update(chunk, ['platform', 'browser', 'device'])
+
+            updated += len(chunk)
+            last_id = chunk[-1].id
+        return updated
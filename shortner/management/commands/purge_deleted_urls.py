@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from shortner import sharding
+from shortner.models import Url
+from shortner.purge import purge_url
+
+
+class Command(BaseCommand):
+    help = "Purge links marked deleted whose background purge did not finish (e.g. after a restart)."
+
+    def handle(self, *args, **options):
+        url_ids = [
+            url_id
+            for deleted in sharding.per_shard(Url.objects.filter(deleted_at__isnull=False))
+            for url_id in deleted.values_list('id', flat=True)
+        ]
+        for url_id in url_ids:
+            clicks = purge_url(url_id)
+            self.stdout.write(f"Purged url {url_id} ({clicks} clicks)")
@@ -0,0 +1,34 @@
+from datetime import datetime, time, timezone
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shortner.rollups import reset_rollups, update_rollups
+
+
+class Command(BaseCommand):
+    help = (
+        "Incrementally maintain hourly/daily click rollups. Run it from cron "
+        "(e.g. every minute); each run only recomputes buckets touched by new clicks."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100000,
+                            help="Clicks scanned per checkpoint step")
+        parser.add_argument('--since', help="Also recompute buckets with clicks since this date (YYYY-MM-DD)")
+        parser.add_argument('--rebuild', action='store_true',
+                            help="Drop all rollups and rebuild them from raw clicks")
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            try:
+                day = datetime.strptime(options['since'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError("--since must be YYYY-MM-DD")
+            since = datetime.combine(day, time.min, tzinfo=timezone.utc)
+
+        if options['rebuild']:
+            reset_rollups()
+
+        rebuilt = update_rollups(batch_size=options['batch_size'], since=since)
+        self.stdout.write(f"Recomputed {rebuilt} rollup buckets")
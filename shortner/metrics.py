@@ -0,0 +1,343 @@
+"""
+Request instrumentation.
+
+``InstrumentationMiddleware`` (``shortner.middleware``) starts a
+``RequestMetrics`` recorder for each sampled request and keeps it in a
+context variable, so code anywhere below it can attribute work to the
+request without passing anything around:
+
+* every SQL query (through a database execute wrapper) adds to ``db``
+  time and the query count,
+* ``cache.resolve`` counts local/shared hits, Bloom filter rejects and misses,
+* ``timed('ua')`` / ``timed('click')`` measure UA parsing and click queueing.
+
+When no recorder is active (metrics off, or the request was not sampled)
+each hook is a single context variable lookup.
+
+Finished requests are aggregated into Prometheus counters and histograms
+held in this process and rendered by ``render()`` in the text exposition
+format. Each worker process keeps its own registry.
+"""
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextvars import ContextVar
+
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+# ================================
+# Per-request recorder
+# ================================
+class RequestMetrics:
+    __slots__ = ('timings', 'counts')
+
+    def __init__(self):
+        self.timings = defaultdict(float)
+        self.counts = defaultdict(int)
+
+
+_current = ContextVar('shortner_request_metrics', default=None)
+
+
+def start():
+    """Start recording for the current context; returns ``(recorder, token)``"""
+    recorder = RequestMetrics()
+    return recorder, _current.set(recorder)
+
+
+def stop(token):
+    _current.reset(token)
+
+
+def incr(name, amount=1):
+    recorder = _current.get()
+    if recorder is not None:
+        recorder.counts[name] += amount
+
+
+class timed:
+    """Context manager adding the elapsed time to ``name`` on the current request"""
+    __slots__ = ('name', 'recorder', 'started')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.recorder = _current.get()
+        if self.recorder is not None:
+            self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.recorder is not None:
+            self.recorder.timings[self.name] += time.perf_counter() - self.started
+        return False
+
+
+def _db_wrapper(execute, sql, params, many, context):
+    recorder = _current.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        recorder.timings['db'] += time.perf_counter() - started
+        recorder.counts['queries'] += 1
+
+
+def _install_wrapper(connection, **kwargs):
+    if _db_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_db_wrapper)
+
+
+# Connection pools of the databases connected to so far, by alias
+_pools = {}
+
+
+def _track_pool(connection, **kwargs):
+    # Only PostgreSQL connections have a pool; once connected it exists,
+    # so reading it does not open one for a database nobody uses
+    pool = getattr(connection, 'pool', None)
+    if pool is not None:
+        _pools[connection.alias] = pool
+
+
+def install_db_instrumentation():
+    """Time queries on every database connection, current and future, and track their pools"""
+    connection_created.connect(_install_wrapper, dispatch_uid='shortner-metrics-db')
+    connection_created.connect(_track_pool, dispatch_uid='shortner-metrics-pools')
+    for connection in connections.all(initialized_only=True):
+        _install_wrapper(connection)
+        _track_pool(connection)
+
+
+# ================================
+# Prometheus registry
+# ================================
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] += amount
+
+    def collect(self):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} counter'
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            yield f'{self.name}{_labels(self.labelnames, labels)} {value:g}'
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                series = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def collect(self):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} histogram'
+        with self._lock:
+            items = sorted((labels, (list(counts), total, count)) for labels, (counts, total, count) in self._values.items())
+        names = self.labelnames + ('le',)
+        for labels, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else f'{bound:g}'
+                yield f'{self.name}_bucket{_labels(names, labels + (le,))} {cumulative}'
+            yield f'{self.name}_sum{_labels(self.labelnames, labels)} {total:g}'
+            yield f'{self.name}_count{_labels(self.labelnames, labels)} {count}'
+
+
+class Callback:
+    """Single sample read from a callback at scrape time (skipped if it returns None)"""
+
+    def __init__(self, name, documentation, callback, kind='gauge'):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.kind = kind
+
+    def collect(self):
+        value = self.callback()
+        if value is None:
+            return
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} {self.kind}'
+        yield f'{self.name} {value:g}'
+
+
+class PoolStats:
+    """Connection pool statistics for each pooled database, read at scrape time"""
+
+    # (psycopg_pool stat, metric, type, help, scale)
+    STATS = (
+        ('pool_size', 'shortner_db_pool_connections', 'gauge', 'Connections held by the pool', 1),
+        ('pool_available', 'shortner_db_pool_idle_connections', 'gauge', 'Idle connections in the pool', 1),
+        ('requests_waiting', 'shortner_db_pool_waiting', 'gauge', 'Requests waiting for a connection', 1),
+        ('requests_num', 'shortner_db_pool_checkouts_total', 'counter', 'Connections handed out', 1),
+        ('requests_queued', 'shortner_db_pool_queued_total', 'counter', 'Checkouts that had to wait', 1),
+        ('requests_wait_ms', 'shortner_db_pool_wait_seconds_total', 'counter', 'Time spent waiting for a connection', 0.001),
+        ('requests_errors', 'shortner_db_pool_timeouts_total', 'counter', 'Checkouts that timed out', 1),
+        ('connections_num', 'shortner_db_pool_connects_total', 'counter', 'Connections opened', 1),
+        ('connections_ms', 'shortner_db_pool_connect_seconds_total', 'counter', 'Time spent opening connections', 0.001),
+        ('connections_lost', 'shortner_db_pool_lost_total', 'counter', 'Broken connections found on checkout', 1),
+    )
+
+    def pools(self):
+        for alias, pool in sorted(_pools.items()):
+            yield alias, pool.get_stats()
+
+    def collect(self):
+        pools = list(self.pools())
+        if not pools:
+            return
+        for stat, name, kind, documentation, scale in self.STATS:
+            yield f'# HELP {name} {documentation}'
+            yield f'# TYPE {name} {kind}'
+            for alias, stats in pools:
+                yield f'{name}{_labels(("database",), (alias,))} {stats.get(stat, 0) * scale:g}'
+
+
+REGISTRY = []
+
+
+def register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+
+def render():
+    """All registered metrics in the Prometheus text format"""
+    return '\n'.join(line for metric in REGISTRY for line in metric.collect()) + '\n'
+
+
+# ================================
+# Request metrics
+# ================================
+requests_total = register(Counter(
+    'shortner_requests_total', 'Sampled requests', ('view', 'method', 'status'),
+))
+request_seconds = register(Histogram(
+    'shortner_request_duration_seconds', 'Time spent in the middleware stack and view', ('view',),
+))
+db_seconds = register(Histogram(
+    'shortner_db_duration_seconds', 'Time spent in SQL queries per request', ('view',),
+))
+db_queries = register(Counter(
+    'shortner_db_queries_total', 'SQL queries issued', ('view',),
+))
+cache_lookups = register(Counter(
+    'shortner_redirect_cache_total', 'Short code lookups by outcome (local, shared, bloom reject, miss)', ('view', 'result'),
+))
+ua_seconds = register(Histogram(
+    'shortner_ua_parse_duration_seconds', 'Time spent parsing user agents per request', ('view',),
+))
+click_seconds = register(Histogram(
+    'shortner_click_record_duration_seconds', 'Time spent handing a click to the click log', ('view',),
+))
+
+CACHE_RESULTS = ('local', 'shared', 'bloom', 'miss')
+
+
+def observe_request(view, method, status, seconds, recorder):
+    requests_total.inc(view, method, status)
+    request_seconds.observe(seconds, view)
+    db_seconds.observe(recorder.timings.get('db', 0.0), view)
+    queries = recorder.counts.get('queries', 0)
+    if queries:
+        db_queries.inc(view, amount=queries)
+    for result in CACHE_RESULTS:
+        hits = recorder.counts.get(f'cache_{result}', 0)
+        if hits:
+            cache_lookups.inc(view, result, amount=hits)
+    if 'ua' in recorder.timings:
+        ua_seconds.observe(recorder.timings['ua'], view)
+    if 'click' in recorder.timings:
+        click_seconds.observe(recorder.timings['click'], view)
+
+
+def server_timing(recorder, total):
+    """``Server-Timing`` header value for a finished request"""
+    parts = [f'total;dur={total * 1000:.2f}']
+    parts.append(
+        f'db;dur={recorder.timings.get("db", 0.0) * 1000:.2f};desc="{recorder.counts.get("queries", 0)} queries"'
+    )
+    for name in ('ua', 'click'):
+        if name in recorder.timings:
+            parts.append(f'{name};dur={recorder.timings[name] * 1000:.2f}')
+    lookups = [result for result in CACHE_RESULTS if recorder.counts.get(f'cache_{result}')]
+    if lookups:
+        parts.append(f'cache;desc="{",".join(lookups)}"')
+    return ', '.join(parts)
+
+
+# ================================
+# Process gauges
+# ================================
+def _writer_stat(attribute):
+    def read():
+        from . import clicks
+        writer = clicks._writer
+        if writer is None:
+            return None
+        if attribute == 'queued':
+            return writer.queue.qsize()
+        return getattr(writer, attribute)
+    return read
+
+
+def _local_cache_stat(attribute):
+    def read():
+        from . import cache
+        local = cache._local
+        if local is None:
+            return None
+        return len(local) if attribute == 'size' else getattr(local, attribute)
+    return read
+
+
+register(PoolStats())
+register(Callback('shortner_click_queue_depth', 'Clicks waiting for the batch writer', _writer_stat('queued')))
+register(Callback('shortner_clicks_written_total', 'Clicks written by the batch writer', _writer_stat('written'), 'counter'))
+register(Callback('shortner_clicks_dropped_total', 'Clicks dropped because the queue was full', _writer_stat('dropped'), 'counter'))
+register(Callback('shortner_local_cache_entries', 'Entries in the per-worker redirect cache', _local_cache_stat('size')))
+register(Callback('shortner_local_cache_hits_total', 'Per-worker redirect cache hits', _local_cache_stat('hits'), 'counter'))
+register(Callback('shortner_local_cache_misses_total', 'Per-worker redirect cache misses', _local_cache_stat('misses'), 'counter'))
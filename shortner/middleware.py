@@ -0,0 +1,137 @@
+import random
+import re
+import time
+
+from asgiref.sync import async_to_sync, iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.urls import Resolver404, resolve
+
+from . import metrics
+
+
+class InstrumentationMiddleware:
+    """
+    Record per-view timing (total, DB, UA parsing, click queueing), query
+    counts and redirect cache outcomes for a sample of requests.
+
+    Put it first in ``MIDDLEWARE`` so the time spent in the rest of the
+    stack is included. Removed from the stack entirely unless
+    ``SHORTNER_METRICS`` is on; requests outside the sample only cost one
+    ``random()`` call.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.SHORTNER_METRICS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = settings.SHORTNER_METRICS_SAMPLE_RATE
+        self.server_timing = settings.SHORTNER_SERVER_TIMING
+        metrics.install_db_instrumentation()
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self._sampled():
+            return self.get_response(request)
+
+        recorder, token = metrics.start()
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.stop(token)
+        self._finish(request, response, recorder, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        if not self._sampled():
+            return await self.get_response(request)
+
+        recorder, token = metrics.start()
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.stop(token)
+        self._finish(request, response, recorder, time.perf_counter() - started)
+        return response
+
+    def _sampled(self):
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def _finish(self, request, response, recorder, elapsed):
+        match = getattr(request, 'resolver_match', None)
+        view = (match.url_name if match else None) or 'unmatched'
+        metrics.observe_request(view, request.method, response.status_code, elapsed, recorder)
+        if self.server_timing:
+            response['Server-Timing'] = metrics.server_timing(recorder, elapsed)
+
+
+# Single path segment with a trailing slash: the only shape of a short link
+_SHORT_PATH = re.compile(r'^/[^/]+/$')
+
+
+class RedirectFastPathMiddleware:
+    """
+    Serve short-link redirects before the session, CSRF, auth, messages
+    and static-file middleware run; the redirect view needs none of them.
+
+    Place it right after ``SecurityMiddleware`` (so redirects keep the
+    security headers and HTTPS redirect). Only paths that resolve to the
+    ``redirect`` URL pattern are handled here; everything else continues
+    down the full stack. Disabled by ``SHORTNER_REDIRECT_FAST_PATH = False``.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.SHORTNER_REDIRECT_FAST_PATH:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def _match(self, request):
+        if not _SHORT_PATH.match(request.path_info):
+            return None
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return None
+        if match.url_name != 'redirect' or match.namespace:
+            return None
+        request.resolver_match = match
+        return match
+
+    @staticmethod
+    def _finish(response):
+        # CommonMiddleware is skipped; without a length the server falls
+        # back to chunked encoding for every redirect
+        if not response.streaming and not response.has_header('Content-Length'):
+            response.headers['Content-Length'] = str(len(response.content))
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        match = self._match(request)
+        if match is None:
+            return self.get_response(request)
+        view = match.func
+        if iscoroutinefunction(view):
+            view = async_to_sync(view)
+        return self._finish(view(request, *match.args, **match.kwargs))
+
+    async def __acall__(self, request):
+        match = self._match(request)
+        if match is None:
+            return await self.get_response(request)
+        view = match.func
+        if not iscoroutinefunction(view):
+            view = sync_to_async(view)
+        return self._finish(await view(request, *match.args, **match.kwargs))
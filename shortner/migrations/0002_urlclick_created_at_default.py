@@ -0,0 +1,19 @@
+# Generated by Django 6.0.2 on 2026-10-18 17:52
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortner', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='urlclick',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 6.0.2 on 2026-10-18 17:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortner', '0002_urlclick_created_at_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CodeSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('next_value', models.BigIntegerField(default=1)),
+            ],
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 6.0.2 on 2026-10-18 17:59
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortner', '0003_codesequence'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='url',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='url_user_created_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 6.0.2 on 2026-10-18 17:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortner', '0004_url_user_created_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='urlclick',
+            index=models.Index(fields=['url', '-created_at', '-id'], name='click_url_created_idx'),
+        ),
+    ]
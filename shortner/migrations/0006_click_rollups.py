@@ -0,0 +1,39 @@
+# Generated by Django 6.0.2 on 2026-10-18 18:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortner', '0005_click_url_created_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('last_click_id', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ClickRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('bucket', models.DateTimeField()),
+                ('platform', models.CharField(blank=True, default='', max_length=100)),
+                ('browser', models.CharField(blank=True, default='', max_length=100)),
+                ('device', models.CharField(blank=True, default='', max_length=100)),
+                ('clicks', models.PositiveIntegerField(default=0)),
+                ('unique_ips', models.PositiveIntegerField(default=0)),
+                ('url', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='shortner.url')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('url', 'period', 'bucket', 'platform', 'browser', 'device'), name='click_rollup_unique')],
+            },
+        ),
+    ]
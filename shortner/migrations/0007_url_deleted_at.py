@@ -0,0 +1,18 @@
+# Generated by Django 6.0.2 on 2026-10-18 18:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortner', '0006_click_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='url',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,179 @@
+# Generated by Django 6.0.2 on 2026-10-18 18:05
+
+from datetime import datetime, timezone
+
+from django.db import migrations
+
+TABLE = 'shortner_urlclick'
+LEGACY = f'{TABLE}_legacy'
+SEQUENCE = f'{TABLE}_id_seq_partitioned'
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def _indexes(cursor, table):
+    cursor.execute(
+        "SELECT indexname, indexdef FROM pg_indexes "
+        "WHERE tablename = %s AND indexname NOT LIKE %s",
+        [table, '%_pkey'],
+    )
+    return cursor.fetchall()
+
+
+def _constraints(cursor, table, kind):
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = %s::regclass AND contype = %s",
+        [table, kind],
+    )
+    return cursor.fetchall()
+
+
+def _exists(cursor, table):
+    cursor.execute("SELECT to_regclass(%s)", [table])
+    return cursor.fetchone()[0] is not None
+
+
+def partition_clicks(apps, schema_editor):
+    """
+    Replace shortner_urlclick with a table range-partitioned by created_at
+    (PostgreSQL only; other backends keep the plain table).
+
+    Partitioned tables need the partition key in the primary key, so the
+    constraint becomes (id, created_at); ids come from a new sequence that
+    starts past the old table's largest id. Indexes and foreign keys are
+    recreated on the new table under their original names.
+
+    Only catalog changes happen here, so the click table is locked briefly
+    whatever its size. Existing clicks stay in shortner_urlclick_legacy
+    (without its foreign keys, so links can still be deleted) until
+    ``manage.py copy_legacy_clicks`` moves them over in batches; an empty
+    legacy table is dropped right away.
+    """
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        indexes = _indexes(cursor, TABLE)
+        foreign_keys = _constraints(cursor, TABLE, 'f')
+        ((primary_key, _),) = _constraints(cursor, TABLE, 'p')
+
+        cursor.execute(f"ALTER TABLE {quote(TABLE)} RENAME TO {quote(LEGACY)}")
+        cursor.execute(
+            f"ALTER TABLE {quote(LEGACY)} RENAME CONSTRAINT {quote(primary_key)} "
+            f"TO {quote(primary_key + '_legacy')}"
+        )
+        for name, _ in indexes:
+            cursor.execute(f"ALTER INDEX {quote(name)} RENAME TO {quote(name + '_legacy')}")
+        for name, _ in foreign_keys:
+            cursor.execute(f"ALTER TABLE {quote(LEGACY)} DROP CONSTRAINT {quote(name)}")
+
+        cursor.execute(
+            f"CREATE TABLE {quote(TABLE)} (LIKE {quote(LEGACY)} INCLUDING DEFAULTS) "
+            f"PARTITION BY RANGE (created_at)"
+        )
+        cursor.execute(f"CREATE SEQUENCE {quote(SEQUENCE)} OWNED BY {quote(TABLE)}.id")
+        # max(id) is read from the primary key index, not a table scan
+        cursor.execute(
+            f"SELECT setval(%s, COALESCE((SELECT max(id) FROM {quote(LEGACY)}), 0) + 1, false)",
+            [SEQUENCE],
+        )
+        cursor.execute(
+            f"ALTER TABLE {quote(TABLE)} ALTER COLUMN id SET DEFAULT nextval('{SEQUENCE}')"
+        )
+        cursor.execute(f"ALTER TABLE {quote(TABLE)} ADD PRIMARY KEY (id, created_at)")
+
+        # The current month and the next few; copy_legacy_clicks adds older ones
+        now = datetime.now(timezone.utc)
+        month = datetime(now.year, now.month, 1, tzinfo=timezone.utc)
+        for offset in range(4):
+            start = add_months(month, offset)
+            cursor.execute(
+                f"CREATE TABLE {quote(f'{TABLE}_p{start:%Y_%m}')} PARTITION OF {quote(TABLE)} "
+                f"FOR VALUES FROM (%s) TO (%s)",
+                [start, add_months(start, 1)],
+            )
+        cursor.execute(f"CREATE TABLE {quote(TABLE + '_default')} PARTITION OF {quote(TABLE)} DEFAULT")
+
+        for name, definition in indexes:
+            cursor.execute(definition)
+        for name, definition in foreign_keys:
+            cursor.execute(f"ALTER TABLE {quote(TABLE)} ADD CONSTRAINT {quote(name)} {definition}")
+
+        cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {quote(LEGACY)})")
+        if not cursor.fetchone()[0]:
+            cursor.execute(f"DROP TABLE {quote(LEGACY)}")
+
+
+def unpartition_clicks(apps, schema_editor):
+    """
+    Put a plain shortner_urlclick back. Clicks written since the
+    migration (and any already copied out of the legacy table) are
+    copied into it in this transaction, so roll back soon after a deploy.
+    """
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        indexes = _indexes(cursor, TABLE)
+        foreign_keys = _constraints(cursor, TABLE, 'f')
+        had_legacy = _exists(cursor, LEGACY)
+        if not had_legacy:
+            cursor.execute(
+                f"CREATE TABLE {quote(LEGACY)} (LIKE {quote(TABLE)} INCLUDING DEFAULTS)"
+            )
+            cursor.execute(f"ALTER TABLE {quote(LEGACY)} ALTER COLUMN id DROP DEFAULT")
+            cursor.execute(
+                f"ALTER TABLE {quote(LEGACY)} ALTER COLUMN id ADD GENERATED BY DEFAULT AS IDENTITY"
+            )
+            cursor.execute(
+                f"ALTER TABLE {quote(LEGACY)} ADD CONSTRAINT {quote(TABLE + '_pkey_legacy')} PRIMARY KEY (id)"
+            )
+
+        cursor.execute(
+            f"INSERT INTO {quote(LEGACY)} SELECT * FROM {quote(TABLE)} "
+            f"ON CONFLICT (id) DO NOTHING"
+        )
+        cursor.execute(
+            f"SELECT setval(pg_get_serial_sequence(%s, 'id'), "
+            f"COALESCE((SELECT max(id) FROM {quote(LEGACY)}), 0) + 1, false)",
+            [LEGACY],
+        )
+        # Drops the partitions and the sequence with it
+        cursor.execute(f"DROP TABLE {quote(TABLE)}")
+
+        cursor.execute(f"ALTER TABLE {quote(LEGACY)} RENAME TO {quote(TABLE)}")
+        cursor.execute(
+            f"ALTER TABLE {quote(TABLE)} RENAME CONSTRAINT {quote(TABLE + '_pkey_legacy')} "
+            f"TO {quote(TABLE + '_pkey')}"
+        )
+        for name, definition in indexes:
+            if had_legacy:
+                cursor.execute(f"ALTER INDEX {quote(name + '_legacy')} RENAME TO {quote(name)}")
+            else:
+                cursor.execute(definition.replace(' ON ONLY ', ' ON '))
+        # Legacy rows had no foreign key while they waited to be copied
+        cursor.execute(
+            f"DELETE FROM {quote(TABLE)} c WHERE NOT EXISTS "
+            f"(SELECT 1 FROM shortner_url u WHERE u.id = c.url_id)"
+        )
+        for name, definition in foreign_keys:
+            cursor.execute(f"ALTER TABLE {quote(TABLE)} ADD CONSTRAINT {quote(name)} {definition}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortner', '0007_url_deleted_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_clicks, unpartition_clicks, elidable=False),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 6.0.2 on 2026-10-18 18:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortner', '0008_partition_urlclick'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClickCounterShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('count', models.BigIntegerField(default=0)),
+                ('url', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='counter_shards', to='shortner.url')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('url', 'shard'), name='click_counter_shard_unique')],
+            },
+        ),
+    ]
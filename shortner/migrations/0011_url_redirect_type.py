@@ -0,0 +1,23 @@
+# Generated by Django 6.0.2 on 2026-10-18 19:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortner', '0010_url_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='url',
+            name='cache_max_age',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='url',
+            name='redirect_type',
+            field=models.PositiveSmallIntegerField(choices=[(302, '302 Found'), (301, '301 Moved Permanently'), (307, '307 Temporary Redirect')], default=302),
+        ),
+    ]
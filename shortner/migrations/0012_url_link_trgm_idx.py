@@ -0,0 +1,48 @@
+# Generated by Django 6.0.2 on 2026-10-18 19:30
+
+from django.db import migrations
+
+INDEX = 'url_link_trgm_idx'
+
+
+def create_link_index(apps, schema_editor):
+    """
+    Trigram index for substring search on links (the admin's
+    ``link__icontains``, i.e. ``UPPER(link::text) LIKE UPPER('%term%')``).
+    PostgreSQL only; built concurrently so the table stays writable.
+    Skipped when the server does not ship pg_trgm (postgresql-contrib):
+    search still works, with a sequential scan.
+    """
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        if cursor.fetchone() is None:
+            return
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        cursor.execute(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {INDEX} ON shortner_url "
+            f"USING gin ((UPPER(link::text)) gin_trgm_ops)"
+        )
+
+
+def drop_link_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {INDEX}")
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('shortner', '0011_url_redirect_type'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_link_index, drop_link_index, elidable=False),
+    ]
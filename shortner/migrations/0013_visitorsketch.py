@@ -0,0 +1,28 @@
+# Generated by Django 6.0.2 on 2026-10-18 19:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortner', '0012_url_link_trgm_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VisitorSketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('day', 'Day'), ('month', 'Month'), ('all', 'All time')], max_length=5)),
+                ('bucket', models.DateField()),
+                ('sketch', models.BinaryField()),
+                ('visitors', models.PositiveIntegerField(default=0)),
+                ('url', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='visitor_sketches', to='shortner.url')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('url', 'period', 'bucket'), name='visitor_sketch_unique')],
+            },
+        ),
+    ]
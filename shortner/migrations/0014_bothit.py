@@ -0,0 +1,26 @@
+# Generated by Django 6.0.2 on 2026-10-18 19:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortner', '0013_visitorsketch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BotHit',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('count', models.BigIntegerField(default=0)),
+                ('url', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bot_hits', to='shortner.url')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('url', 'day'), name='bot_hit_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 6.0.2 on 2026-10-18 19:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortner', '0014_bothit'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LinkChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(max_length=10)),
+            ],
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 6.0.2 on 2026-10-18 19:35
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, migrations, models
+
+
+def _user_field(apps, db_constraint):
+    Url = apps.get_model('shortner', 'Url')
+    field = Url._meta.get_field('user')
+    name, path, args, kwargs = field.deconstruct()
+    kwargs.update(to=field.remote_field.model, db_constraint=db_constraint)
+    altered = models.ForeignKey(*args, **kwargs)
+    altered.set_attributes_from_name(name)
+    altered.model = Url
+    return Url, altered
+
+
+def drop_constraint_on_shards(apps, schema_editor):
+    """
+    Users live on default only, so a shard's links cannot reference them.
+    Read replicas are never migrated, so any other database is a shard.
+    """
+    if schema_editor.connection.alias == DEFAULT_DB_ALIAS:
+        return
+    Url, with_constraint = _user_field(apps, True)
+    schema_editor.alter_field(Url, with_constraint, _user_field(apps, False)[1])
+
+
+def add_constraint_on_shards(apps, schema_editor):
+    if schema_editor.connection.alias == DEFAULT_DB_ALIAS:
+        return
+    Url, with_constraint = _user_field(apps, True)
+    schema_editor.alter_field(Url, _user_field(apps, False)[1], with_constraint)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortner', '0015_linkchange'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        # The model has no constraint; default keeps its foreign key
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='url',
+                    name='user',
+                    field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='urls', to=settings.AUTH_USER_MODEL),
+                ),
+            ],
+            database_operations=[
+                migrations.RunPython(drop_constraint_on_shards, add_constraint_on_shards),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0.2 on 2026-10-18 21:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortner', '0016_url_user_no_db_constraint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rollupcheckpoint',
+            name='gaps',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -1,29 +1,111 @@
-from django.db import models
+import datetime
+
+from django.conf import settings
+from django.db import models, transaction, IntegrityError
 from django.contrib.auth.models import User
-import uuid
+from django.utils import timezone
+from . import sharding
+from .codes import generate_code
+
+
+def short_url_base(request=None):
+    """``scheme://host/`` short links are served from (``SHORTNER_SHORT_DOMAIN`` if set)"""
+    if settings.SHORTNER_SHORT_DOMAIN:
+        return settings.SHORTNER_SHORT_DOMAIN.rstrip('/') + '/'
+    if request is not None:
+        return request.build_absolute_uri('/')
+    return '/'
+
 
 class Url(models.Model):
+    PERMANENT = 301
+    FOUND = 302
+    TEMPORARY = 307
+    REDIRECT_TYPES = [
+        (FOUND, '302 Found'),
+        (PERMANENT, '301 Moved Permanently'),
+        (TEMPORARY, '307 Temporary Redirect'),
+    ]
+
     link = models.URLField(max_length=10000)
     uuid = models.CharField(max_length=10, unique=True, blank=True)
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='urls')
+    # Links on shard databases cannot reference users on default, so migration
+    # 0016 drops the constraint there; default keeps it
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='urls', db_constraint=False)
     click_count = models.PositiveIntegerField(default=0)
     is_active = models.BooleanField(default=True)
+    # Status of the redirect, and seconds browsers and CDNs may cache it
+    # (None = the default for the type; see shortner/edge.py)
+    redirect_type = models.PositiveSmallIntegerField(choices=REDIRECT_TYPES, default=FOUND)
+    cache_max_age = models.PositiveIntegerField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Bumped by save(); keys the cached dashboard card (with click_count,
+    # which is updated in place)
+    updated_at = models.DateTimeField(auto_now=True)
+    # Set by delete_url; the row is removed once its clicks are purged
+    deleted_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            # Dashboard keyset pagination: WHERE user_id = ? ORDER BY created_at DESC, id DESC
+            models.Index(fields=['user', '-created_at', '-id'], name='url_user_created_idx'),
+        ]
 
     def save(self, *args, **kwargs):
-        if not self.uuid:
-            self.uuid = str(uuid.uuid4())[:10]
-        super().save(*args, **kwargs)
+        if self.uuid:
+            return self._save_on_shard(*args, **kwargs)
+
+        # Generated code: retry with a fresh one if it is already taken
+        for attempt in range(settings.SHORTNER_CODE_MAX_ATTEMPTS):
+            self.uuid = generate_code()
+            alias = sharding.for_code(self.uuid)
+            try:
+                with transaction.atomic(using=alias):
+                    return self._save_on_shard(*args, **kwargs)
+            except IntegrityError:
+                if not Url.objects.using(alias).filter(uuid=self.uuid).exists():
+                    self.uuid = ''
+                    raise
+        self.uuid = ''
+        raise IntegrityError("Could not generate a unique short code")
+
+    def _save_on_shard(self, *args, **kwargs):
+        """Save to the shard of the code, giving a new link an id on that shard"""
+        if not sharding.enabled():
+            return super().save(*args, **kwargs)
+        alias = sharding.for_code(self.uuid)
+        new_id = self.pk is None
+        if new_id:
+            self.pk = sharding.new_ids(alias)[0]
+            kwargs['force_insert'] = True
+        elif sharding.for_id(self.pk) != alias:
+            raise ValueError("The short code of a stored link cannot move it to another shard")
+        kwargs['using'] = alias
+        try:
+            with sharding.use(alias):
+                return super().save(*args, **kwargs)
+        except BaseException:
+            if new_id:
+                self.pk = None
+            raise
 
     def __str__(self):
         return f"{self.uuid} -> {self.link}"
 
-    def short_url(self, request=None):
-        if request:
-            protocol = 'https' if request.is_secure() else 'http'
-            host = request.get_host()
-            return f"{protocol}://{host}/{self.uuid}"
-        return f"/{self.uuid}"
+    def short_url(self, request=None, base=None):
+        """Absolute short URL; pass ``base`` (``short_url_base``) when building many"""
+        if base is None:
+            base = short_url_base(request)
+        return f"{base}{self.uuid}/"
+
+
+# Counter rows backing the monotonic short code generators
+class CodeSequence(models.Model):
+    name = models.CharField(max_length=50, unique=True)
+    next_value = models.BigIntegerField(default=1)
+
+    def __str__(self):
+        return f"{self.name}: {self.next_value}"
 
 
 # ✅ NEW: UrlClick model to track click details
@@ -34,7 +116,123 @@ class UrlClick(models.Model):
     platform = models.CharField(max_length=100, blank=True, null=True)
     browser = models.CharField(max_length=100, blank=True, null=True)
     device = models.CharField(max_length=100, blank=True, null=True)
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Set when the click happens, not when the batch writer saves it
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        indexes = [
+            # Click log keyset pagination: WHERE url_id = ? ORDER BY created_at DESC, id DESC
+            models.Index(fields=['url', '-created_at', '-id'], name='click_url_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"Click on {self.url.uuid} at {self.created_at} from {self.ip_address}"
+
+# Pre-aggregated clicks per url per hour/day, maintained by `manage.py rollup_clicks`
+class ClickRollup(models.Model):
+    HOUR = 'hour'
+    DAY = 'day'
+    PERIOD_CHOICES = [(HOUR, 'Hour'), (DAY, 'Day')]
+
+    # Dimension value of the per-bucket total row
+    ALL = '*'
+
+    url = models.ForeignKey(Url, on_delete=models.CASCADE, related_name='rollups')
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES)
+    bucket = models.DateTimeField()
+    platform = models.CharField(max_length=100, blank=True, default='')
+    browser = models.CharField(max_length=100, blank=True, default='')
+    device = models.CharField(max_length=100, blank=True, default='')
+    clicks = models.PositiveIntegerField(default=0)
+    unique_ips = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['url', 'period', 'bucket', 'platform', 'browser', 'device'],
+                name='click_rollup_unique',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.url_id} {self.period} {self.bucket}: {self.clicks}"
+
+
+class RollupCheckpoint(models.Model):
+    name = models.CharField(max_length=50, unique=True)
+    last_click_id = models.BigIntegerField(default=0)
+    # [start, end) ranges of click ids below last_click_id not committed yet
+    gaps = models.JSONField(default=list, blank=True)
+
+    def __str__(self):
+        return f"{self.name}: {self.last_click_id}"
+
+
+# Pending clicks for a url spread over several rows, so concurrent clicks on
+# one link do not queue on a single row lock; folded into Url.click_count
+# by shortner.counters.fold
+class ClickCounterShard(models.Model):
+    url = models.ForeignKey(Url, on_delete=models.CASCADE, related_name='counter_shards')
+    shard = models.PositiveSmallIntegerField()
+    count = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['url', 'shard'], name='click_counter_shard_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.url_id}#{self.shard}: {self.count}"
+
+
+# HyperLogLog sketch of the distinct visitors (ip + user agent) of a url per
+# day, per month and over all time, maintained as clicks are written; see
+# shortner.visitors
+class VisitorSketch(models.Model):
+    DAY = 'day'
+    MONTH = 'month'
+    ALL = 'all'
+    PERIOD_CHOICES = [(DAY, 'Day'), (MONTH, 'Month'), (ALL, 'All time')]
+    ALL_BUCKET = datetime.date(1970, 1, 1)
+
+    url = models.ForeignKey(Url, on_delete=models.CASCADE, related_name='visitor_sketches')
+    period = models.CharField(max_length=5, choices=PERIOD_CHOICES)
+    # First day of the bucket; unused (ALL_BUCKET) for the all-time sketch
+    bucket = models.DateField()
+    sketch = models.BinaryField()
+    # Estimate as of the last update (all-time sketches only), so lists
+    # need not decode sketches
+    visitors = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['url', 'period', 'bucket'], name='visitor_sketch_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.url_id} {self.period} {self.bucket}: ~{self.visitors}"
+
+
+# Redirects served to bots and link-preview crawlers, counted per url per day
+# instead of stored as clicks; see shortner.bots
+class BotHit(models.Model):
+    url = models.ForeignKey(Url, on_delete=models.CASCADE, related_name='bot_hits')
+    day = models.DateField()
+    count = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['url', 'day'], name='bot_hit_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.url_id} {self.day}: {self.count} bot hits"
+
+
+# Codes created, edited or deleted, in order, so redirect snapshot deltas
+# can list them (SHORTNER_SNAPSHOT_CHANGELOG); see shortner.snapshot
+class LinkChange(models.Model):
+    code = models.CharField(max_length=10)
 
     def __str__(self):
-        return f"Click on {self.url.uuid} at {self.created_at} from {self.ip_address}"
\ No newline at end of file
+        return f"#{self.id}: {self.code}"
@@ -0,0 +1,104 @@
+"""
+Keyset (cursor) pagination over ``(timestamp, id)`` in descending order.
+
+Unlike OFFSET pagination, each page is a bounded index range scan no
+matter how deep the user pages. Cursors are opaque, URL-safe strings.
+
+``EstimatedCountPaginator`` is for admin changelists over large tables:
+it counts exactly only up to a limit and uses the planner's row estimate
+beyond it.
+"""
+import base64
+import heapq
+import itertools
+import json
+from datetime import datetime
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+
+def encode_cursor(timestamp, pk):
+    raw = f"{timestamp.isoformat()}|{pk}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return ``(timestamp, pk)``; raises ValueError for malformed cursors"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        timestamp, pk = raw.rsplit('|', 1)
+        return datetime.fromisoformat(timestamp), int(pk)
+    except (TypeError, UnicodeDecodeError, base64.binascii.Error) as exc:
+        raise ValueError("Invalid cursor") from exc
+
+
+def _keyset_rows(queryset, cursor, limit, field):
+    queryset = queryset.order_by(f'-{field}', '-id')
+    if cursor:
+        timestamp, pk = decode_cursor(cursor)
+        queryset = queryset.filter(
+            Q(**{f'{field}__lt': timestamp}) | Q(**{field: timestamp, 'id__lt': pk})
+        )
+    return list(queryset[:limit])
+
+
+def _page(items, page_size, field):
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        last = items[-1]
+        next_cursor = encode_cursor(getattr(last, field), last.pk)
+    return items, next_cursor
+
+
+def keyset_page(queryset, cursor=None, page_size=50, field='created_at'):
+    """
+    Return ``(items, next_cursor)`` for ``queryset`` ordered by
+    ``-field, -id``; ``next_cursor`` is None on the last page
+    """
+    return _page(_keyset_rows(queryset, cursor, page_size + 1, field), page_size, field)
+
+
+def merged_keyset_page(querysets, cursor=None, page_size=50, field='created_at'):
+    """
+    ``keyset_page`` over the union of several querysets (one per database
+    shard): each is read a page ahead from the cursor and the results are
+    merged. Ids must be unique across the querysets.
+    """
+    pages = [_keyset_rows(queryset, cursor, page_size + 1, field) for queryset in querysets]
+    merged = heapq.merge(*pages, key=lambda item: (getattr(item, field), item.pk), reverse=True)
+    return _page(list(itertools.islice(merged, page_size + 1)), page_size, field)
+
+
+# ================================
+# Estimated counts
+# ================================
+def estimated_count(queryset, exact_limit):
+    """
+    Row count of ``queryset``: exact below ``exact_limit`` rows, otherwise
+    the planner's estimate on PostgreSQL (never less than ``exact_limit``)
+    and an exact COUNT(*) elsewhere.
+    """
+    queryset = queryset.order_by()
+    # Counts at most exact_limit rows, however large the table
+    bounded = queryset[:exact_limit].count()
+    if bounded < exact_limit:
+        return bounded
+    if connections[queryset.db].vendor != 'postgresql':
+        return queryset.count()
+    plan = json.loads(queryset.explain(format='json'))
+    if isinstance(plan, list):
+        plan = plan[0]
+    return max(int(plan['Plan']['Plan Rows']), exact_limit)
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator whose count is ``estimated_count`` (``SHORTNER_ADMIN_EXACT_COUNT_LIMIT``)"""
+
+    @cached_property
+    def count(self):
+        return estimated_count(self.object_list, settings.SHORTNER_ADMIN_EXACT_COUNT_LIMIT)
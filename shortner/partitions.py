@@ -0,0 +1,311 @@
+"""
+Monthly click partitions, retention and archival.
+
+On PostgreSQL ``shortner_urlclick`` is range-partitioned by ``created_at``
+(migration 0008) with one partition per month named
+``shortner_urlclick_pYYYY_MM`` plus a default partition. Expiring a month
+detaches and drops its partition, which is instant regardless of size.
+Clicks for a month without a partition (a missed ``click_partitions``
+run) land in the default partition; ``ensure_partitions`` moves them into
+the month's partition when it creates it.
+Clicks recorded before the migration wait in ``shortner_urlclick_legacy``
+until ``copy_legacy_clicks`` moves them over in batches.
+
+Other backends (SQLite in tests/development) keep a plain table; the same
+functions treat each calendar month as a logical partition and expire it
+with chunked DELETEs.
+
+Archives are gzip-compressed CSV files, one per month (and database
+shard). Everything here works on the selected shard (``sharding.use``).
+"""
+import csv
+import gzip
+import os
+import re
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import DatabaseError, connections, transaction
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from . import sharding
+from .models import Url, UrlClick
+from .purge import delete_in_chunks
+
+TABLE = UrlClick._meta.db_table
+DEFAULT_PARTITION = f'{TABLE}_default'
+_PARTITION_NAME = re.compile(rf'^{TABLE}_p(\d{{4}})_(\d{{2}})$')
+
+
+class PartitionRepairError(RuntimeError):
+    """A month's clicks in the default partition could not be moved to their own"""
+
+
+# ================================
+# Months
+# ================================
+def month_start(value):
+    return datetime(value.year, value.month, 1, tzinfo=dt_timezone.utc)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=dt_timezone.utc)
+
+
+def partition_name(month):
+    return f'{TABLE}_p{month:%Y_%m}'
+
+
+def _connection():
+    return connections[sharding.current()]
+
+
+def is_partitioned():
+    connection = _connection()
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+            "WHERE c.relname = %s",
+            [TABLE],
+        )
+        return cursor.fetchone() is not None
+
+
+def partition_months():
+    """Months that currently hold (or may hold) clicks, oldest first"""
+    connection = _connection()
+    if is_partitioned():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT c.relname FROM pg_inherits i "
+                "JOIN pg_class c ON c.oid = i.inhrelid "
+                "JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = %s",
+                [TABLE],
+            )
+            months = set()
+            for (name,) in cursor.fetchall():
+                match = _PARTITION_NAME.match(name)
+                if match:
+                    months.add(datetime(int(match[1]), int(match[2]), 1, tzinfo=dt_timezone.utc))
+        # Rows that landed in the default partition
+        months.update(month_start(month) for month in _default_partition_months())
+        return sorted(months)
+    return sorted(_data_months(UrlClick.objects.all()))
+
+
+def _data_months(queryset):
+    return {
+        month_start(month)
+        for month in queryset.annotate(month=TruncMonth('created_at'))
+        .values_list('month', flat=True).distinct().order_by()
+    }
+
+
+def _default_partition_months():
+    connection = _connection()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT DISTINCT date_trunc('month', created_at AT TIME ZONE 'UTC') "
+            f"FROM {connection.ops.quote_name(DEFAULT_PARTITION)}"
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+# ================================
+# Maintenance
+# ================================
+def ensure_partitions(ahead=3):
+    """
+    Create partitions for the current month and ``ahead`` months after it.
+    Returns ``[(name, rows moved from the default partition)]``; raises
+    PartitionRepairError if a month's rows could not be moved.
+    """
+    if not is_partitioned():
+        return []
+    current = month_start(timezone.now())
+    created = (ensure_partition(add_months(current, offset)) for offset in range(ahead + 1))
+    return [result for result in created if result]
+
+
+def ensure_partition(month):
+    """
+    Create ``month``'s partition unless it exists. Returns ``(name, rows
+    moved from the default partition)``, or None if it was already there.
+    """
+    connection = _connection()
+    name = partition_name(month)
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s)", [name])
+        if cursor.fetchone()[0] is not None:
+            return None
+    try:
+        with transaction.atomic(using=connection.alias):
+            return name, _create_partition(connection, month)
+    except DatabaseError as exc:
+        raise PartitionRepairError(
+            f"Could not create {name}; move any {month:%Y-%m} clicks out of "
+            f"{DEFAULT_PARTITION} by hand ({exc})"
+        ) from exc
+
+
+def _create_partition(connection, month):
+    """
+    Create a month's partition. Rows of that month already in the default
+    partition would make CREATE ... PARTITION OF fail, so the default is
+    detached, the rows moved and the default attached again. Returns the
+    number of rows moved.
+    """
+    quote = connection.ops.quote_name
+    name = partition_name(month)
+    bounds = [month, add_months(month, 1)]
+    create = f"CREATE TABLE {quote(name)} PARTITION OF {quote(TABLE)} FOR VALUES FROM (%s) TO (%s)"
+    in_month = "WHERE created_at >= %s AND created_at < %s"
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT 1 FROM {quote(DEFAULT_PARTITION)} {in_month} LIMIT 1", bounds)
+        if cursor.fetchone() is None:
+            cursor.execute(create, bounds)
+            return 0
+
+        # Locks the click table until the transaction ends
+        columns = ', '.join(quote(field.column) for field in UrlClick._meta.concrete_fields)
+        cursor.execute(f"ALTER TABLE {quote(TABLE)} DETACH PARTITION {quote(DEFAULT_PARTITION)}")
+        cursor.execute(create, bounds)
+        cursor.execute(
+            f"INSERT INTO {quote(name)} ({columns}) "
+            f"SELECT {columns} FROM {quote(DEFAULT_PARTITION)} {in_month}",
+            bounds,
+        )
+        moved = cursor.rowcount
+        cursor.execute(f"DELETE FROM {quote(DEFAULT_PARTITION)} {in_month}", bounds)
+        cursor.execute(f"ALTER TABLE {quote(TABLE)} ATTACH PARTITION {quote(DEFAULT_PARTITION)} DEFAULT")
+    return moved
+
+
+def month_clicks(month):
+    return UrlClick.objects.filter(created_at__gte=month, created_at__lt=add_months(month, 1))
+
+
+def archive_month(month, directory):
+    """
+    Write a month of clicks to ``<directory>/<table>_YYYY_MM.csv.gz``
+    (``<table>_<shard>_YYYY_MM.csv.gz`` with sharding); returns
+    ``(path, rows)`` (no file for an empty month)
+    """
+    os.makedirs(directory, exist_ok=True)
+    shard = f'{sharding.current()}_' if sharding.enabled() else ''
+    path = os.path.join(directory, f'{TABLE}_{shard}{month:%Y_%m}.csv.gz')
+    fields = [field.attname for field in UrlClick._meta.concrete_fields]
+    rows = month_clicks(month).order_by().values_list(*fields).iterator(chunk_size=5000)
+
+    count = 0
+    with gzip.open(path, 'wt', newline='') as handle:
+        writer = csv.writer(handle)
+        writer.writerow(fields)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    if not count:
+        os.remove(path)
+        return None, 0
+    return path, count
+
+
+def drop_month(month):
+    """Remove a month of clicks: drop its partition if there is one"""
+    if is_partitioned():
+        name = partition_name(month)
+        connection = _connection()
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT to_regclass(%s)", [name])
+            if cursor.fetchone()[0] is not None:
+                cursor.execute(
+                    f"ALTER TABLE {connection.ops.quote_name(TABLE)} "
+                    f"DETACH PARTITION {connection.ops.quote_name(name)}"
+                )
+                cursor.execute(f"DROP TABLE {connection.ops.quote_name(name)}")
+    # Plain table, or leftovers in the default partition
+    delete_in_chunks(month_clicks(month))
+
+
+def apply_retention(retain_months, archive_dir=None, dry_run=False):
+    """
+    Archive (optionally) and drop every month older than the last
+    ``retain_months`` months. Returns ``[(month, archive_path, rows)]``.
+    """
+    cutoff = add_months(month_start(timezone.now()), -retain_months)
+    expired = []
+    for month in partition_months():
+        if month >= cutoff:
+            continue
+        path, rows = None, None
+        if not dry_run:
+            if archive_dir:
+                path, rows = archive_month(month, archive_dir)
+            drop_month(month)
+        expired.append((month, path, rows))
+    return expired
+
+
+# ================================
+# Legacy table
+# ================================
+LEGACY_TABLE = f'{TABLE}_legacy'
+
+
+def has_legacy_clicks():
+    """Whether migration 0008 left clicks in the legacy table to copy"""
+    connection = _connection()
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s)", [LEGACY_TABLE])
+        return cursor.fetchone()[0] is not None
+
+
+def copy_legacy_batch(batch_size=10000):
+    """
+    Move the legacy clicks with the lowest ``batch_size`` ids into the
+    partitioned table, creating the months' partitions first. Each batch
+    is one short transaction that deletes what it copies, so the copy can
+    stop and resume at any point. Clicks of links deleted in the meantime
+    are dropped. The legacy table is dropped once it is empty.
+
+    Returns ``(copied, dropped)``, or None when nothing is left.
+    """
+    if not has_legacy_clicks():
+        return None
+    connection = _connection()
+    quote = connection.ops.quote_name
+    legacy = quote(LEGACY_TABLE)
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT min(id) FROM {legacy}")
+        (low,) = cursor.fetchone()
+        if low is None:
+            cursor.execute(f"DROP TABLE {legacy}")
+            return None
+        bounds = [low, low + batch_size]
+        cursor.execute(
+            f"SELECT DISTINCT date_trunc('month', created_at AT TIME ZONE 'UTC') "
+            f"FROM {legacy} WHERE id >= %s AND id < %s",
+            bounds,
+        )
+        months = [month.replace(tzinfo=dt_timezone.utc) for (month,) in cursor.fetchall()]
+
+    for month in months:
+        ensure_partition(month)
+
+    columns = ', '.join(quote(field.column) for field in UrlClick._meta.concrete_fields)
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute(
+            f"WITH moved AS (DELETE FROM {legacy} WHERE id >= %s AND id < %s RETURNING {columns}), "
+            f"copied AS (INSERT INTO {quote(TABLE)} ({columns}) SELECT {columns} FROM moved "
+            f"WHERE EXISTS (SELECT 1 FROM {quote(Url._meta.db_table)} u WHERE u.id = moved.url_id) "
+            f"ON CONFLICT DO NOTHING RETURNING 1) "
+            f"SELECT (SELECT count(*) FROM copied), (SELECT count(*) FROM moved)",
+            bounds,
+        )
+        copied, moved = cursor.fetchone()
+    return copied, moved - copied
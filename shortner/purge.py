@@ -0,0 +1,124 @@
+"""
+Background purge of deleted links.
+
+``delete_url`` only marks a ``Url`` as deleted (``deleted_at``) and
+deactivates it, which is a single-row update. The clicks are then removed
+in small chunks by a background thread, and the ``Url`` row itself is
+deleted once nothing references it, so a link with millions of clicks
+never holds a long table lock.
+
+Links still marked deleted after a restart are picked up by
+``manage.py purge_deleted_urls``. Set ``SHORTNER_PURGE_ASYNC = False`` to
+purge inline.
+"""
+import atexit
+import logging
+import queue
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from . import sharding
+
+logger = logging.getLogger(__name__)
+
+
+def delete_in_chunks(queryset, chunk_size=None):
+    """Delete the rows of ``queryset`` a chunk of ids at a time"""
+    chunk_size = chunk_size or settings.SHORTNER_PURGE_CHUNK_SIZE
+    model = queryset.model
+    using = queryset.db
+    deleted = 0
+    while True:
+        ids = list(queryset.values_list('id', flat=True)[:chunk_size])
+        if not ids:
+            return deleted
+        with transaction.atomic(using=using):
+            model.objects.using(using).filter(id__in=ids).delete()
+        deleted += len(ids)
+
+
+def mark_deleted(url_obj):
+    """Hide and deactivate a link right away; the data is purged later"""
+    url_obj.is_active = False
+    url_obj.deleted_at = timezone.now()
+    url_obj.save(update_fields=['is_active', 'deleted_at'])
+
+
+def purge_url(url_id):
+    """Remove a deleted link's clicks in chunks, then the link itself"""
+    from .models import Url, UrlClick
+
+    alias = sharding.for_id(url_id)
+    if alias is None:
+        return 0
+    with sharding.use(alias):
+        clicks = delete_in_chunks(UrlClick.objects.filter(url_id=url_id))
+        Url.objects.filter(pk=url_id, deleted_at__isnull=False).delete()
+    return clicks
+
+
+# ================================
+# Background purger
+# ================================
+class Purger:
+    """Daemon thread purging deleted links one at a time"""
+
+    def __init__(self):
+        self.queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name='shortner-purger', daemon=True
+                )
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def schedule(self, url_id):
+        self.start()
+        self.queue.put(url_id)
+
+    def _run(self):
+        while True:
+            url_id = self.queue.get()
+            if url_id is None:
+                break
+            close_old_connections()
+            try:
+                purge_url(url_id)
+            except Exception:
+                logger.exception("Failed to purge url %s", url_id)
+        close_old_connections()
+
+    def stop(self, timeout=5.0):
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            self.queue.put(None)
+            thread.join(timeout)
+
+
+_purger = None
+_purger_lock = threading.Lock()
+
+
+def get_purger():
+    global _purger
+    if _purger is None:
+        with _purger_lock:
+            if _purger is None:
+                _purger = Purger()
+    return _purger
+
+
+def schedule_purge(url_id):
+    """Purge after the current transaction commits (inline if not async)"""
+    if settings.SHORTNER_PURGE_ASYNC:
+        sharding.on_commit(lambda: get_purger().schedule(url_id))
+    else:
+        purge_url(url_id)
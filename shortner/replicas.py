@@ -0,0 +1,180 @@
+"""
+Read-replica routing.
+
+Replicas come from ``DATABASE_REPLICA_URLS`` (see config/settings.py) as
+database aliases ``replica1``, ``replica2``, ... ``ReplicaRouter`` only
+sends a read there when all of these hold:
+
+* the code runs inside ``read_from_replica`` (the dashboard, click log,
+  analytics and export views) or ``ReplicaReadsAdmin`` (admin changelists),
+* the model belongs to this app (sessions and users stay on the primary),
+* no transaction is open on the primary,
+* the user has not written in the last ``SHORTNER_REPLICA_PIN_SECONDS``
+  (``pin_to_primary``: read-your-writes after create/edit/delete), and
+* the replica answered its last health check, run at most every
+  ``SHORTNER_REPLICA_CHECK_INTERVAL`` seconds, with a replication lag
+  below ``SHORTNER_REPLICA_MAX_LAG`` seconds.
+
+Otherwise the read goes to ``default``.
+"""
+import functools
+import logging
+import random
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+logger = logging.getLogger(__name__)
+
+PIN_SESSION_KEY = 'shortner_primary_until'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_replica_reads = ContextVar('shortner_replica_reads', default=False)
+
+
+# ================================
+# Health checks
+# ================================
+_PG_LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+_health = {}
+_health_lock = threading.Lock()
+
+
+def replication_lag(alias):
+    """Seconds the replica is behind (0 if unknown for the backend)"""
+    connection = connections[alias]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(_PG_LAG_SQL)
+            return float(cursor.fetchone()[0] or 0)
+        cursor.execute("SELECT 1")
+        return 0.0
+
+
+def is_healthy(alias):
+    """Cached: the replica is reachable and not lagging too far"""
+    now = time.monotonic()
+    checked = _health.get(alias)
+    if checked is not None and now - checked[0] < settings.SHORTNER_REPLICA_CHECK_INTERVAL:
+        return checked[1]
+
+    with _health_lock:
+        checked = _health.get(alias)
+        if checked is not None and now - checked[0] < settings.SHORTNER_REPLICA_CHECK_INTERVAL:
+            return checked[1]
+        try:
+            lag = replication_lag(alias)
+            healthy = lag <= settings.SHORTNER_REPLICA_MAX_LAG
+            if not healthy:
+                logger.warning("Replica %s is %.1fs behind; reading from primary", alias, lag)
+        except Exception as exc:
+            logger.warning("Replica %s is unavailable (%s); reading from primary", alias, exc)
+            connections[alias].close()
+            healthy = False
+        _health[alias] = (time.monotonic(), healthy)
+        return healthy
+
+
+def healthy_replicas():
+    return [alias for alias in settings.SHORTNER_READ_REPLICAS if is_healthy(alias)]
+
+
+# ================================
+# Routing
+# ================================
+class ReplicaRouter:
+    app_label = 'shortner'
+
+    def db_for_read(self, model, **hints):
+        if not _replica_reads.get() or model._meta.app_label != self.app_label:
+            return None
+        if not settings.SHORTNER_READ_REPLICAS or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        replicas = healthy_replicas()
+        return random.choice(replicas) if replicas else None
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.SHORTNER_READ_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.SHORTNER_READ_REPLICAS:
+            return False
+        return None
+
+
+# ================================
+# Opting in
+# ================================
+def pin_to_primary(request):
+    """Read this user's data from the primary for the next few seconds"""
+    request.session[PIN_SESSION_KEY] = time.time() + settings.SHORTNER_REPLICA_PIN_SECONDS
+
+
+def is_pinned(request):
+    session = getattr(request, 'session', None)
+    return session is not None and session.get(PIN_SESSION_KEY, 0) > time.time()
+
+
+def _iterate_with_replica_reads(content):
+    # Set per chunk: under ASGI each chunk may be produced in a different context
+    iterator = iter(content)
+    while True:
+        token = _replica_reads.set(True)
+        try:
+            chunk = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            _replica_reads.reset(token)
+        yield chunk
+
+
+def read_from_replica(view):
+    """Let a read-only view's queries (and its streamed body) use a replica"""
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in SAFE_METHODS or not settings.SHORTNER_READ_REPLICAS or is_pinned(request):
+            return view(request, *args, **kwargs)
+        token = _replica_reads.set(True)
+        try:
+            response = view(request, *args, **kwargs)
+        finally:
+            _replica_reads.reset(token)
+        if response.streaming:
+            response.streaming_content = _iterate_with_replica_reads(response.streaming_content)
+        return response
+    return wrapper
+
+
+def writes_to_primary(view):
+    """Pin the user to the primary after a state-changing request"""
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        if request.method not in SAFE_METHODS and settings.SHORTNER_READ_REPLICAS:
+            pin_to_primary(request)
+        return response
+    return wrapper
+
+
+class ReplicaReadsAdmin:
+    """ModelAdmin mixin: changelists (the heavy listing queries) read from a replica"""
+
+    def changelist_view(self, request, extra_context=None):
+        return read_from_replica(super().changelist_view)(request, extra_context)
@@ -0,0 +1,247 @@
+"""
+Hash-sharded link storage.
+
+With ``DATABASE_SHARD_URLS`` set (see config/settings.py), links and the
+rows kept per link (clicks, rollups and their checkpoint, click counter
+shards, visitor sketches, bot hits) live on the databases ``shard0``,
+``shard1``, ...; users, sessions, code sequences and the snapshot change
+log stay on ``default``.
+
+* A link's shard is derived from its short code (CRC-32 of the code
+  modulo the number of shards), so a redirect queries exactly one shard
+  and codes stay unique across all of them.
+* Its id embeds the shard: ids come from one global sequence (blocks
+  reserved in ``CodeSequence``, like the code generators) shifted left by
+  ``SHARD_BITS``, with the shard number in the low bits. Views and click
+  batches addressed by link id go straight to the right shard too.
+* ``ShardRouter`` sends queries on sharded models to the shard selected
+  with ``use()``, or to the one a model instance was loaded from.
+  Selecting none is an error (``NoShardSelected``) rather than a silent
+  read of a single shard.
+* Per-user listings (the dashboard) query every shard and merge.
+
+Every database gets the full schema; only routing decides where rows
+live. The shard of a code depends on the number of shards, so existing
+rows must be moved before shards are added.
+"""
+import contextlib
+import functools
+import zlib
+from collections import defaultdict
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.http import Http404
+
+# Low bits of a link id holding its shard number (up to 1024 shards)
+SHARD_BITS = 10
+SHARD_MASK = (1 << SHARD_BITS) - 1
+
+# Models whose rows live on the shard of their link
+SHARDED_MODELS = frozenset({
+    'url', 'urlclick', 'clickrollup', 'rollupcheckpoint',
+    'clickcountershard', 'visitorsketch', 'bothit',
+})
+
+_current = ContextVar('shortner_shard', default=None)
+_allocator = None
+
+
+class NoShardSelected(LookupError):
+    """A sharded model was queried without a shard"""
+
+
+def enabled():
+    return bool(settings.SHORTNER_DATABASE_SHARDS)
+
+
+def all_shards():
+    """Every database holding links (just ``default`` when not sharding)"""
+    return list(settings.SHORTNER_DATABASE_SHARDS) or [DEFAULT_DB_ALIAS]
+
+
+def is_sharded(model):
+    """Whether rows of a model (class or instance) live on the shards"""
+    return model._meta.app_label == 'shortner' and model._meta.model_name in SHARDED_MODELS
+
+
+# ================================
+# Placement
+# ================================
+def for_code(code):
+    """Database holding the link with this short code"""
+    shards = settings.SHORTNER_DATABASE_SHARDS
+    if not shards:
+        return DEFAULT_DB_ALIAS
+    return shards[zlib.crc32(code.encode('utf-8')) % len(shards)]
+
+
+def for_id(url_id):
+    """Database holding the link with this id, or None if no shard can hold it"""
+    shards = settings.SHORTNER_DATABASE_SHARDS
+    if not shards:
+        return DEFAULT_DB_ALIAS
+    try:
+        index = int(url_id) & SHARD_MASK
+    except (TypeError, ValueError):
+        return None
+    return shards[index] if index < len(shards) else None
+
+
+def new_ids(alias, count=1):
+    """Fresh link ids on a shard"""
+    global _allocator
+    from .bloom import GAP_TIMEOUT
+    from .codes import BlockAllocator
+
+    if _allocator is None:
+        # Per-worker blocks, so inserts do not queue on one sequence row.
+        # The Bloom filter refresh finds ids committed out of order as long
+        # as their block is in use; an idle block is given up well before
+        # the refresh gives up on its missing ids
+        _allocator = BlockAllocator('url_ids', settings.SHORTNER_LINK_ID_BLOCK_SIZE, max_idle=GAP_TIMEOUT / 2)
+    index = settings.SHORTNER_DATABASE_SHARDS.index(alias)
+    return [(number << SHARD_BITS) | index for number in _allocator.take(count)]
+
+
+def per_shard(queryset):
+    """``queryset`` on every shard (just ``queryset`` when not sharding)"""
+    if not enabled():
+        return [queryset]
+    return [queryset.using(alias) for alias in settings.SHORTNER_DATABASE_SHARDS]
+
+
+def group_ids(url_ids):
+    """``{alias: [url_id, ...]}``; ids no shard can hold are left out"""
+    groups = defaultdict(list)
+    for url_id in url_ids:
+        alias = for_id(url_id)
+        if alias is not None:
+            groups[alias].append(url_id)
+    return groups
+
+
+def group_codes(codes):
+    """``{alias: [code, ...]}`` by the shard of each short code"""
+    groups = defaultdict(list)
+    for code in codes:
+        groups[for_code(code)].append(code)
+    return groups
+
+
+def group_by_url(items, key=lambda item: item['url_id']):
+    """``{alias: [item, ...]}`` by the link id of each item"""
+    groups = defaultdict(list)
+    for item in items:
+        alias = for_id(key(item))
+        if alias is not None:
+            groups[alias].append(item)
+    return groups
+
+
+# ================================
+# Selecting a shard
+# ================================
+def current():
+    """The selected shard (``default`` when not sharding); raises NoShardSelected"""
+    alias = _current.get()
+    if alias is not None:
+        return alias
+    if not enabled():
+        return DEFAULT_DB_ALIAS
+    raise NoShardSelected("No shard selected: wrap the query in sharding.use(alias)")
+
+
+@contextlib.contextmanager
+def use(alias):
+    """Route queries on sharded models to ``alias`` inside the block"""
+    token = _current.set(alias)
+    try:
+        yield alias
+    finally:
+        _current.reset(token)
+
+
+def each_shard():
+    """Yield every shard alias with that shard selected"""
+    for alias in all_shards():
+        with use(alias):
+            yield alias
+
+
+def on_commit(func):
+    """``transaction.on_commit`` on the selected shard (``default`` if none)"""
+    transaction.on_commit(func, using=_current.get() or DEFAULT_DB_ALIAS)
+
+
+def _iterate_on_shard(alias, content):
+    # Set per chunk: under ASGI each chunk may be produced in a different context
+    iterator = iter(content)
+    while True:
+        with use(alias):
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+        yield chunk
+
+
+def on_url_shard(view):
+    """Run a view addressed by link id (``id``) with that link's shard selected"""
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not enabled():
+            return view(request, *args, **kwargs)
+        alias = for_id(kwargs.get('id'))
+        if alias is None:
+            raise Http404("Short URL not found")
+        with use(alias):
+            response = view(request, *args, **kwargs)
+        if response.streaming:
+            response.streaming_content = _iterate_on_shard(alias, response.streaming_content)
+        return response
+    return wrapper
+
+
+# ================================
+# Routing
+# ================================
+class ShardRouter:
+    """
+    Sharded models go to the selected shard (or their instance's); other
+    models of an instance loaded from a shard (its user) go to ``default``.
+    Put it before ``ReplicaRouter``.
+    """
+
+    def _db(self, model, hints, write=False):
+        if not enabled():
+            return None
+        instance = hints.get('instance')
+        on_shard = instance is not None and instance._state.db in settings.SHORTNER_DATABASE_SHARDS
+        if not is_sharded(model):
+            return DEFAULT_DB_ALIAS if on_shard else None
+        if on_shard and is_sharded(instance):
+            return instance._state.db
+        if write and instance is not None and not is_sharded(instance):
+            # A new link given its user: Url.save places it by its code
+            return _current.get()
+        return current()
+
+    def db_for_read(self, model, **hints):
+        return self._db(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._db(model, hints, write=True)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if not enabled():
+            return None
+        # A link on a shard and its user on default
+        sharded = [is_sharded(obj) for obj in (obj1, obj2)]
+        if sharded[0] != sharded[1]:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return None
@@ -0,0 +1,41 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import bloom, cache, dashboard, edge, sharding, snapshot
+from .models import Url
+
+
+# ================================
+# Keep the redirect cache, snapshot deltas and dashboards in sync with Url rows
+# ================================
+@receiver(post_save, sender=Url)
+def invalidate_url_on_save(sender, instance, created=False, using=None, **kwargs):
+    # Run the on-commit hooks when the link's shard commits
+    with sharding.use(using):
+        if created:
+            cache.publish([instance])
+            bloom.add([instance.uuid])
+        else:
+            cache.invalidate(instance.uuid)
+            edge.purge([instance.pk])
+        snapshot.log_changes([instance.uuid])
+        dashboard.invalidate([instance.user_id])
+
+
+@receiver(post_delete, sender=Url)
+def invalidate_url_on_delete(sender, instance, using=None, **kwargs):
+    with sharding.use(using):
+        cache.invalidate(instance.uuid)
+        edge.purge([instance.pk])
+        snapshot.log_changes([instance.uuid])
+        dashboard.invalidate([instance.user_id])
+
+
+@receiver(pre_delete, sender=User)
+def delete_user_links(sender, instance, **kwargs):
+    # The cascade only reaches the user's database; links on shards are deleted here
+    if not sharding.enabled():
+        return
+    for alias in sharding.each_shard():
+        Url.objects.filter(user_id=instance.pk).delete()
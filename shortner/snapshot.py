@@ -0,0 +1,546 @@
+"""
+Memory-mapped redirect snapshots for redirect-only nodes.
+
+``manage.py export_redirect_snapshot`` writes every active link to one
+read-only file, so redirect nodes can serve short links with no database
+connection (``SHORTNER_REDIRECT_ONLY = True``). The file is
+memory-mapped, so workers on a host share one copy in the page cache and
+start serving without loading it.
+
+Layout (little-endian)::
+
+    header   magic, version, flags, count, slots, snapshot id, watermark
+    slots    u64 per slot: file offset of a record (0 = empty), open
+             addressing on a multiplicative hash of the code's CRC-32,
+             linear probing, at most half full
+    offsets  u64 per record: file offset of the record, in code byte order
+    records  u8 code length, code, u64 id, u16 redirect type,
+             i32 max-age (-1 = default), u32 link length, link
+
+``Snapshot.get`` looks a code up through the hash slots (one or two probes);
+``Snapshot.search`` binary searches the sorted offsets instead.
+
+Links created or edited after the export are listed in a delta log next to
+the snapshot (``<snapshot>.delta``). ``export_redirect_snapshot --delta``
+appends the codes in ``LinkChange`` (written on every save and delete
+when ``SHORTNER_SNAPSHOT_CHANGELOG`` is on) since the last watermark, as
+JSON lines: the current entry or a tombstone. A new snapshot starts a new,
+empty delta log.
+
+Both files are replaced atomically (write, then rename). Every
+``SHORTNER_SNAPSHOT_CHECK_INTERVAL`` seconds a node stats them: a new
+snapshot is mapped and swapped in whole, and lines appended to the delta
+log are applied on top of it. Requests in flight keep the old mapping
+until they finish.
+"""
+import heapq
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from array import array
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import F, Q
+from django.db.models.functions import Collate
+
+from . import sharding
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'SHRTSNAP'
+VERSION = 1
+HEADER = struct.Struct('<8sIIQQQQ')
+RECORD = struct.Struct('<QHiI')
+SLOT = struct.Struct('<Q')
+OFFSET = struct.Struct('<Q')
+
+# Change ids below a watermark that were not committed when it was taken
+# (transactions commit out of id order) are looked for again until they
+# are this many ids behind
+CHANGE_SLACK = 200
+
+
+class SnapshotUnavailable(Exception):
+    """No snapshot could be loaded"""
+
+
+def hash_code(code):
+    """64-bit hash of an encoded short code (its top bits pick the slot)"""
+    # CRC-32 is fast but clusters in its low bits; the multiply spreads it
+    return (zlib.crc32(code) * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+
+
+def delta_path(path):
+    return f'{path}.delta'
+
+
+def _little_endian(values):
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values.tobytes()
+
+
+def _replace(path, write):
+    """Write a file next to ``path`` through ``write(file)``, then rename it over ``path``"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temporary = tempfile.mkstemp(prefix='.snapshot-', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as output:
+            write(output)
+            output.flush()
+            os.fsync(output.fileno())
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+# ================================
+# Snapshot file
+# ================================
+def write_snapshot(path, rows, snapshot_id, watermark=0):
+    """
+    Write ``(code, id, link, redirect_type, cache_max_age)`` rows, sorted by
+    code bytes, to ``path``. Returns the number of records.
+    """
+    offsets = array('Q')
+    hashes = array('Q')
+    previous = None
+    with tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(path))) as records:
+        position = 0
+        for code, url_id, link, redirect_type, cache_max_age in rows:
+            code = code.encode('utf-8')
+            if previous is not None and code <= previous:
+                raise ValueError(f"Codes are not in byte order: {previous!r} before {code!r}")
+            if len(code) > 255:
+                raise ValueError(f"Code too long: {code!r}")
+            previous = code
+            link = link.encode('utf-8')
+            record = b''.join((
+                bytes([len(code)]),
+                code,
+                RECORD.pack(url_id, redirect_type, -1 if cache_max_age is None else cache_max_age, len(link)),
+                link,
+            ))
+            records.write(record)
+            offsets.append(position)
+            hashes.append(hash_code(code))
+            position += len(record)
+
+        count = len(offsets)
+        slot_count = 1
+        while slot_count < count * 2:
+            slot_count <<= 1
+        records_at = HEADER.size + slot_count * SLOT.size + count * OFFSET.size
+        for number in range(count):
+            offsets[number] += records_at
+
+        mask = slot_count - 1
+        shift = 64 - mask.bit_length()
+        slots = array('Q', [0]) * slot_count
+        for offset, hashed in zip(offsets, hashes):
+            slot = hashed >> shift
+            while slots[slot]:
+                slot = (slot + 1) & mask
+            slots[slot] = offset
+        del hashes
+
+        def write(output):
+            output.write(HEADER.pack(MAGIC, VERSION, 0, count, slot_count, snapshot_id, watermark))
+            output.write(_little_endian(slots))
+            output.write(_little_endian(offsets))
+            records.seek(0)
+            while chunk := records.read(1 << 20):
+                output.write(chunk)
+
+        _replace(path, write)
+    return count
+
+
+class Snapshot:
+    """A read-only, memory-mapped snapshot file"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as source:
+            self.stat = os.fstat(source.fileno())
+            self._map = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < HEADER.size:
+            raise ValueError(f"{path} is not a redirect snapshot")
+        magic, version, flags, count, slots, snapshot_id, watermark = HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} redirect snapshot")
+        self.count = count
+        self.slots = slots
+        self.id = snapshot_id
+        self.watermark = watermark
+        self._mask = slots - 1
+        self._shift = 64 - self._mask.bit_length()
+        self._slots_at = HEADER.size
+        self._offsets_at = HEADER.size + slots * SLOT.size
+
+    def __len__(self):
+        return self.count
+
+    def _code_at(self, number):
+        """(record offset, code bytes) of the ``number``-th record"""
+        offset = OFFSET.unpack_from(self._map, self._offsets_at + number * OFFSET.size)[0]
+        length = self._map[offset]
+        return offset, self._map[offset + 1:offset + 1 + length]
+
+    def _entry(self, offset, code_length):
+        """The record at ``offset`` as a ``cache.ENTRY_FIELDS`` tuple"""
+        at = offset + 1 + code_length
+        url_id, redirect_type, cache_max_age, link_length = RECORD.unpack_from(self._map, at)
+        at += RECORD.size
+        link = self._map[at:at + link_length].decode('utf-8')
+        return url_id, link, True, redirect_type, None if cache_max_age < 0 else cache_max_age
+
+    def get(self, code):
+        """Entry for a code through the hash slots, or None"""
+        code = code.encode('utf-8', 'replace')
+        data = self._map
+        length = len(code)
+        slot = hash_code(code) >> self._shift
+        while True:
+            offset = SLOT.unpack_from(data, self._slots_at + slot * SLOT.size)[0]
+            if not offset:
+                return None
+            if data[offset] == length and data[offset + 1:offset + 1 + length] == code:
+                return self._entry(offset, length)
+            slot = (slot + 1) & self._mask
+
+    def search(self, code):
+        """Entry for a code by binary search over the sorted records, or None"""
+        code = code.encode('utf-8', 'replace')
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            offset, found = self._code_at(middle)
+            if found < code:
+                low = middle + 1
+            elif found > code:
+                high = middle
+            else:
+                return self._entry(offset, len(code))
+        return None
+
+    def codes(self):
+        """Every code, in byte order"""
+        for number in range(self.count):
+            yield self._code_at(number)[1].decode('utf-8')
+
+
+# ================================
+# Delta log
+# ================================
+def reset_delta(path, snapshot_id, watermark, gaps=()):
+    """Start an empty delta log for a new snapshot"""
+    header = json.dumps({'snapshot': snapshot_id, 'watermark': watermark, 'gaps': list(gaps)}) + '\n'
+    _replace(path, lambda output: output.write(header.encode('utf-8')))
+
+
+def delta_lines(data):
+    """Parsed JSON lines of a delta log chunk (complete lines only)"""
+    return [json.loads(line) for line in data.splitlines() if line.strip()]
+
+
+def apply_delta(lines, overlay):
+    """Apply delta log lines to ``{code: entry or None}``; returns the last watermark line"""
+    checkpoint = None
+    for line in lines:
+        if 'code' in line:
+            if line.get('deleted'):
+                overlay[line['code']] = None
+            else:
+                overlay[line['code']] = (
+                    line['id'], line['link'], True, line['redirect_type'], line['cache_max_age'],
+                )
+        if 'watermark' in line:
+            checkpoint = line
+    return checkpoint
+
+
+def read_delta(path):
+    """(snapshot id, last watermark line) of a delta log, or None if it has no header"""
+    try:
+        with open(path, 'rb') as source:
+            lines = delta_lines(source.read())
+    except FileNotFoundError:
+        return None
+    if not lines or 'snapshot' not in lines[0]:
+        return None
+    return lines[0]['snapshot'], apply_delta(lines, {})
+
+
+# ================================
+# Serving
+# ================================
+class SnapshotStore:
+    """A worker's current snapshot and delta overlay, reloaded when the files change"""
+
+    def __init__(self, path, check_interval, lookup='hash'):
+        self.path = path
+        self.delta_path = delta_path(path)
+        self.check_interval = check_interval
+        self.lookup = lookup
+        # (snapshot, {code: entry or None}), swapped as a whole
+        self.state = None
+        self.checked_at = 0.0
+        self.loaded_at = None
+        self._delta_file = None
+        self._delta_offset = 0
+        self._lock = threading.Lock()
+
+    def resolve(self, code):
+        """
+        Entry for a code (``cache.ENTRY_FIELDS``), or None if it does not
+        exist or is inactive. Raises SnapshotUnavailable without a snapshot.
+        """
+        if time.monotonic() - self.checked_at >= self.check_interval:
+            self.check()
+        state = self.state
+        if state is None:
+            raise SnapshotUnavailable(f"No redirect snapshot at {self.path}")
+        snapshot, overlay = state
+        if code in overlay:
+            return overlay[code]
+        if self.lookup == 'binary':
+            return snapshot.search(code)
+        return snapshot.get(code)
+
+    def check(self):
+        """Swap in a new snapshot and apply new delta lines; never raises"""
+        if not self._lock.acquire(blocking=self.state is None):
+            return
+        try:
+            self.checked_at = time.monotonic()
+            self._check()
+        except Exception:
+            logger.exception("Failed to reload the redirect snapshot %s", self.path)
+        finally:
+            self._lock.release()
+
+    def _check(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            if self.state is None:
+                logger.error("No redirect snapshot at %s", self.path)
+            return
+        state = self.state
+        if state is None or (stat.st_ino, stat.st_mtime_ns, stat.st_size) != (
+            state[0].stat.st_ino, state[0].stat.st_mtime_ns, state[0].stat.st_size,
+        ):
+            snapshot = Snapshot(self.path)
+            self._delta_file = None
+            self._delta_offset = 0
+            overlay = {}
+            self._read_delta(snapshot, overlay)
+            self.state = (snapshot, overlay)
+            self.loaded_at = time.time()
+            logger.info("Loaded redirect snapshot %s (%d links)", snapshot.id, len(snapshot))
+            return
+
+        snapshot, overlay = state
+        try:
+            stat = os.stat(self.delta_path)
+        except FileNotFoundError:
+            return
+        if (stat.st_ino, stat.st_dev) != self._delta_file or stat.st_size < self._delta_offset:
+            # A new delta log: rebuild the overlay from its start
+            self._delta_offset = 0
+            overlay = {}
+            if self._read_delta(snapshot, overlay):
+                self.state = (snapshot, overlay)
+        elif stat.st_size > self._delta_offset:
+            self._read_delta(snapshot, overlay)
+
+    def _read_delta(self, snapshot, overlay):
+        """Apply the delta log from the last offset; False if it belongs to another snapshot"""
+        try:
+            with open(self.delta_path, 'rb') as source:
+                stat = os.fstat(source.fileno())
+                source.seek(self._delta_offset)
+                data = source.read()
+        except FileNotFoundError:
+            return False
+        # Apply complete lines only; the rest is read on the next check
+        data = data[:data.rfind(b'\n') + 1]
+        lines = delta_lines(data)
+        if self._delta_offset == 0:
+            if not lines or lines[0].get('snapshot') != snapshot.id:
+                # Written for a snapshot this worker has not loaded (yet)
+                return False
+        self._delta_file = (stat.st_ino, stat.st_dev)
+        self._delta_offset += len(data)
+        apply_delta(lines, overlay)
+        return True
+
+    def stats(self):
+        state = self.state
+        if state is None:
+            return {'ready': False}
+        snapshot, overlay = state
+        return {
+            'ready': True,
+            'snapshot': snapshot.id,
+            'links': len(snapshot),
+            'delta_changes': len(overlay),
+            'loaded_at': self.loaded_at,
+        }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = SnapshotStore(
+                    path=settings.SHORTNER_SNAPSHOT_PATH,
+                    check_interval=settings.SHORTNER_SNAPSHOT_CHECK_INTERVAL,
+                    lookup=settings.SHORTNER_SNAPSHOT_LOOKUP,
+                )
+    return _store
+
+
+def resolve(code):
+    """Entry for a code from this worker's snapshot, or None"""
+    return get_store().resolve(code)
+
+
+# ================================
+# Export (origin side)
+# ================================
+def log_changes(codes):
+    """Record created, edited or deleted codes for the next delta"""
+    from .models import LinkChange
+
+    if not settings.SHORTNER_SNAPSHOT_CHANGELOG:
+        return
+    rows = [LinkChange(code=code) for code in codes if code]
+    if sharding.enabled():
+        # The log is on default: write it once the link's shard has committed,
+        # so a delta never reads the link before the change is visible
+        sharding.on_commit(lambda: LinkChange.objects.bulk_create(rows))
+    else:
+        LinkChange.objects.bulk_create(rows)
+
+
+def _by_code_bytes(alias):
+    """Order by uuid comparing bytes, whatever the column collation"""
+    vendor = connections[alias].vendor
+    if vendor == 'postgresql':
+        return Collate('uuid', 'C')
+    if vendor == 'mysql':
+        return Collate('uuid', 'utf8mb4_bin')
+    # SQLite compares text with memcmp
+    return F('uuid')
+
+
+def _latest_change():
+    from .models import LinkChange
+    return LinkChange.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+
+def _missing_changes(low, high, seen):
+    """Change ids in ``(low, high]`` not in ``seen``: not committed yet, or rolled back"""
+    return [change_id for change_id in range(max(0, low) + 1, high + 1) if change_id not in seen]
+
+
+def export_snapshot(path, chunk_size=10000):
+    """Write a snapshot of every active link and start its delta log; returns the snapshot"""
+    from .models import LinkChange, Url
+    from .purge import delete_in_chunks
+
+    # Changes after this id (and the gaps below it) are in the next delta
+    watermark = _latest_change()
+    present = set(
+        LinkChange.objects.filter(id__gt=watermark - CHANGE_SLACK, id__lte=watermark)
+        .values_list('id', flat=True)
+    )
+    gaps = _missing_changes(watermark - CHANGE_SLACK, watermark, present)
+    # One ordered stream per shard, merged in code order
+    streams = [
+        Url.objects.using(alias).filter(is_active=True, deleted_at__isnull=True)
+        .order_by(_by_code_bytes(alias))
+        .values_list('uuid', 'pk', 'link', 'redirect_type', 'cache_max_age')
+        .iterator(chunk_size=chunk_size)
+        for alias in sharding.all_shards()
+    ]
+    rows = heapq.merge(*streams, key=lambda row: row[0].encode('utf-8')) if len(streams) > 1 else streams[0]
+    snapshot_id = time.time_ns()
+    write_snapshot(path, rows, snapshot_id, watermark)
+    reset_delta(delta_path(path), snapshot_id, watermark, gaps)
+    delete_in_chunks(LinkChange.objects.filter(id__lte=watermark - CHANGE_SLACK))
+    return Snapshot(path)
+
+
+def export_delta(path, chunk_size=1000):
+    """
+    Append the current state of the codes changed since the last delta
+    (or the snapshot) to its delta log; returns the number of codes
+    """
+    from .models import LinkChange, Url
+
+    snapshot = Snapshot(path)
+    current = read_delta(delta_path(path))
+    if current is None or current[0] != snapshot.id:
+        # Gaps unknown: look through the whole slack window again
+        reset_delta(delta_path(path), snapshot.id, snapshot.watermark)
+        since = snapshot.watermark
+        gaps = _missing_changes(since - CHANGE_SLACK, since, set())
+    else:
+        since, gaps = current[1]['watermark'], current[1].get('gaps', [])
+
+    watermark = _latest_change()
+    changes = list(
+        LinkChange.objects.filter(Q(id__gt=since) | Q(id__in=gaps), id__lte=watermark)
+        .order_by('id').values_list('id', 'code')
+    )
+    seen = {change_id for change_id, _ in changes}
+    gaps = [change_id for change_id in gaps if change_id not in seen and change_id > watermark - CHANGE_SLACK]
+    gaps += _missing_changes(max(since, watermark - CHANGE_SLACK), watermark, seen)
+    changed = list(dict.fromkeys(code for _, code in changes))
+    lines = []
+    for start in range(0, len(changed), chunk_size):
+        codes = changed[start:start + chunk_size]
+        by_shard = {}
+        for code in codes:
+            by_shard.setdefault(sharding.for_code(code), []).append(code)
+        rows = {
+            row[0]: row
+            for alias, shard_codes in by_shard.items()
+            for row in Url.objects.using(alias).filter(uuid__in=shard_codes)
+            .values_list('uuid', 'pk', 'link', 'is_active', 'deleted_at', 'redirect_type', 'cache_max_age')
+        }
+        for code in codes:
+            row = rows.get(code)
+            if row is None or not row[3] or row[4] is not None:
+                lines.append({'code': code, 'deleted': True})
+            else:
+                lines.append({
+                    'code': code, 'id': row[1], 'link': row[2],
+                    'redirect_type': row[5], 'cache_max_age': row[6],
+                })
+    lines.append({'watermark': watermark, 'gaps': gaps})
+
+    # Nodes apply complete lines only, so a reader never sees half of one
+    data = ''.join(json.dumps(line) + '\n' for line in lines).encode('utf-8')
+    with open(delta_path(path), 'ab') as output:
+        output.write(data)
+        output.flush()
+        os.fsync(output.fileno())
+    return len(changed)
@@ -1,13 +1,27 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
+# Under ASGI the redirect is served by the native async view
+redirect_view = views.aredirect_short_url if settings.SHORTNER_ASYNC_REDIRECT else views.redirect_short_url
+
 urlpatterns = [
     path('', views.index, name='index'),  # ✅ Home / index page
     path('dashboard/', views.dashboard, name='dashboard'),
+    path('dashboard/json/', views.dashboard_json, name='dashboard_json'),
     path('create/', views.create, name='create'),
-    path('<str:uuid>/', views.redirect_short_url, name='redirect'),
+    path('create/bulk/', views.create_bulk, name='create_bulk'),
+    path('internal/metrics/', views.metrics_view, name='metrics'),
+    path('internal/clicks/', views.click_beacon, name='click_beacon'),
+    path('<str:uuid>/', redirect_view, name='redirect'),
     path('edit/<int:id>/', views.edit_url, name='edit_url'),
     path('delete/<int:id>/', views.delete_url, name='delete_url'),
     path('clicks/url/<int:id>/', views.clicks_url, name='clicks_url'),          # New Clicks page
+    path('clicks/url/<int:id>/analytics/', views.clicks_analytics, name='clicks_analytics'),
+    path('clicks/url/<int:id>/export/', views.export_clicks, name='export_clicks'),
     path('click/delete/<int:id>/', views.delete_click, name='delete_click'),  # AJAX delete
-]
\ No newline at end of file
+]
+
+# Redirect-only nodes serve short links from the snapshot and nothing else
+if settings.SHORTNER_REDIRECT_ONLY:
+    urlpatterns = [path('<str:uuid>/', redirect_view, name='redirect')]
@@ -0,0 +1,124 @@
+"""
+Memoized user-agent parsing.
+
+``user_agents.parse`` runs ua-parser's regex cascade, which is the most
+CPU-expensive part of recording a click. Real traffic only carries a
+small set of distinct UA strings, so results are kept in a bounded LRU
+keyed by the raw string.
+
+``SHORTNER_UA_PARSING`` controls where parsing happens:
+
+* ``request`` - parse (through the cache) while handling the redirect
+* ``writer`` - store the raw string only; the batch writer parses on flush
+* ``offline`` - store the raw string only; ``manage.py parse_user_agents``
+  fills in platform/browser/device later
+
+``is_bot`` classifies a UA string as a bot or link-preview crawler (see
+shortner/bots.py), memoized the same way. ``matches_bot_patterns`` is the
+regex-only part of it, used on the request path when parsing is deferred.
+"""
+import re
+import threading
+
+from django.conf import settings
+from user_agents import parse
+
+from .cache import LRUCache
+
+REQUEST = 'request'
+WRITER = 'writer'
+OFFLINE = 'offline'
+
+_MISSING = object()
+_cache = None
+_bot_cache = None
+_bot_matcher = None
+_cache_lock = threading.Lock()
+
+
+def ua_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = LRUCache(maxsize=settings.SHORTNER_UA_CACHE_SIZE)
+    return _cache
+
+
+def bot_cache():
+    global _bot_cache
+    if _bot_cache is None:
+        with _cache_lock:
+            if _bot_cache is None:
+                _bot_cache = LRUCache(maxsize=settings.SHORTNER_UA_CACHE_SIZE)
+    return _bot_cache
+
+
+def bot_matcher():
+    """``SHORTNER_BOT_PATTERNS`` compiled into one case-insensitive regex (None if empty)"""
+    global _bot_matcher
+    if _bot_matcher is None:
+        patterns = settings.SHORTNER_BOT_PATTERNS
+        _bot_matcher = re.compile('|'.join(f'(?:{p})' for p in patterns), re.IGNORECASE) if patterns else False
+    return _bot_matcher or None
+
+
+def _fields(ua):
+    return (
+        getattr(ua.os, 'family', '') or '',
+        getattr(ua.browser, 'family', '') or '',
+        getattr(ua.device, 'family', '') or '',
+    )
+
+
+def parse_uncached(ua_string):
+    """Parse a UA string into the ``(platform, browser, device)`` stored on UrlClick"""
+    return _fields(parse(ua_string or ''))
+
+
+def parse_user_agent(ua_string):
+    """Cached ``parse_uncached``"""
+    ua_string = ua_string or ''
+    cache = ua_cache()
+    result = cache.get(ua_string, _MISSING)
+    if result is _MISSING:
+        result = parse_uncached(ua_string)
+        cache.set(ua_string, result)
+    return result
+
+
+def matches_bot_patterns(ua_string):
+    """True if the UA matches ``SHORTNER_BOT_PATTERNS`` (no parsing)"""
+    matcher = bot_matcher()
+    return matcher is not None and matcher.search(ua_string or '') is not None
+
+
+def is_bot(ua_string):
+    """True if the UA matches a bot pattern or ``user_agents`` flags it as a bot"""
+    ua_string = ua_string or ''
+    cache = bot_cache()
+    result = cache.get(ua_string, _MISSING)
+    if result is _MISSING:
+        if matches_bot_patterns(ua_string):
+            result = True
+        else:
+            ua = parse(ua_string)
+            result = ua.is_bot
+            # The parse is done; save parse_user_agent the work
+            ua_cache().set(ua_string, _fields(ua))
+        cache.set(ua_string, result)
+    return result
+
+
+def cache_stats():
+    cache = ua_cache()
+    return {'size': len(cache), 'hits': cache.hits, 'misses': cache.misses}
+
+
+def fill_click(click):
+    """Set platform/browser/device on a click dict if they have not been parsed"""
+    if click.get('platform') is None:
+        click['platform'], click['browser'], click['device'] = parse_user_agent(
+            click.get('user_agent')
+        )
+    return click
@@ -1,35 +1,80 @@
-import uuid
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.http import JsonResponse, Http404, HttpResponse, StreamingHttpResponse, FileResponse
 from django.contrib.auth.decorators import login_required
-from user_agents import parse
-from .models import Url, UrlClick
-from django.db.models import F
-import random
-import string
+from .models import Url, UrlClick, ClickRollup, short_url_base
+from . import cache
+from .clicks import record_click, arecord_click
+from . import useragents
+from . import bulk
+from . import export
+from . import rollups
+from . import purge
+from . import metrics
+from . import edge
+from . import visitors
+from . import bots
+from . import snapshot
+from . import sharding
+from . import dashboard as dashboard_cache
+from django.utils import timezone
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from django.conf import settings
 from django.contrib import messages
+from .pagination import keyset_page
+from .replicas import read_from_replica, writes_to_primary
 
 # ================================
 # Dashboard View
 # ================================
+# Card rendered into the shell's <template>; the script fills in each row
+DASHBOARD_CARD_PLACEHOLDER = {
+    'id': 0, 'full_short_url': '#', 'link': '', 'click_count': 0, 'unique_visitors': 0, 'bot_hits': 0, 'created_at': '',
+    'redirect_type': Url.FOUND, 'cache_max_age': None,
+}
+
+
 @login_required
+@read_from_replica
 def dashboard(request):
-    user_urls = Url.objects.filter(user=request.user).order_by('-created_at')
-    total_urls = user_urls.count()
-    total_clicks = sum(url.click_count for url in user_urls)
+    if settings.SHORTNER_DASHBOARD_SHELL:
+        # The page itself needs no queries; cards come from dashboard_json
+        return render(request, 'shortner/home.html', {
+            'shell': True,
+            'cursor': request.GET.get('cursor'),
+            'card_placeholder': DASHBOARD_CARD_PLACEHOLDER,
+            'total_urls': '-',
+            'total_clicks': '-',
+        })
 
-    # Build absolute short URLs
-    for url in user_urls:
-        url.full_short_url = request.build_absolute_uri(f'/{url.uuid}/')  # <-- Make sure uuid exists!
+    try:
+        page = dashboard_cache.get_page(request)
+    except ValueError:
+        return redirect('dashboard')
 
     context = {
-        'user_urls': user_urls,
-        'total_urls': total_urls,
-        'total_clicks': total_clicks,
+        'user_urls': page['results'],
+        'next_cursor': page['next_cursor'],
+        'is_first_page': not request.GET.get('cursor'),
+        'total_urls': page['total_urls'],
+        'total_clicks': page['total_clicks'],
+        'fragment_ttl': settings.SHORTNER_FRAGMENT_CACHE_TTL,
     }
     return render(request, 'shortner/home.html', context)
 
 
+@login_required
+@read_from_replica
+def dashboard_json(request):
+    """JSON variant of the dashboard listing for incremental fetching"""
+    try:
+        page = dashboard_cache.get_page(request)
+    except ValueError:
+        return JsonResponse({"error": "Invalid cursor"}, status=400)
+
+    return JsonResponse(page)
+
+
 # ================================
 # Home / Landing Page
 # ================================
@@ -40,16 +85,6 @@ def index(request):
         return redirect('login')      # Redirect guests to login page
 
 
-# ================================
-# Create Short URL via AJAX
-# ================================
-# ================================
-# Helper Function: Generate UID
-# ================================
-def generate_uid(length=6):
-    """Generate a random alphanumeric UID for short URL"""
-    return ''.join(random.choices(string.ascii_letters + string.digits, k=length))
-
 # ================================
 # Helper Function: Get Client IP
 # ================================
@@ -65,6 +100,7 @@ def get_client_ip(request):
 # ================================
 
 @login_required
+@writes_to_primary
 def create(request):
     if request.method == 'POST':
         link = request.POST.get('link')
@@ -72,16 +108,17 @@ def create(request):
             messages.error(request, "No link provided.")
             return JsonResponse({"error": "No link provided"}, status=400)
 
-        # Generate unique 6-character UID
-        uid = str(uuid.uuid4())[:6]
+        try:
+            redirect_type, cache_max_age = parse_redirect_options(request.POST)
+        except ValueError as exc:
+            return JsonResponse({"error": str(exc)}, status=400)
 
-        # Create short URL object
-        url_obj = Url.objects.create(user=request.user, link=link, uuid=uid)
-
-        # Full short URL
-        short_url = request.build_absolute_uri(f'/{uid}')
-        url_obj.full_short_url = short_url
+        # Create short URL object (Url.save generates a unique code and picks its shard)
+        url_obj = Url(
+            user=request.user, link=link, redirect_type=redirect_type, cache_max_age=cache_max_age,
+        )
         url_obj.save()
+        short_url = url_obj.short_url(request)
 
         # Add session message (will show after reload)
         messages.success(request, "Short URL created successfully!")
@@ -91,27 +128,72 @@ def create(request):
             "id": url_obj.id,
             "link": url_obj.link,
             "click_count": url_obj.click_count,
+            "redirect_type": url_obj.redirect_type,
+            "cache_max_age": url_obj.cache_max_age,
             "created_at": url_obj.created_at.strftime("%Y-%m-%d %H:%M:%S"),
             "full_short_url": short_url,
         })
 
     return JsonResponse({"error": "Invalid request"}, status=400)
 
+# ================================
+# Bulk Create Short URLs
+# ================================
+@login_required
+@writes_to_primary
+def create_bulk(request):
+    """
+    Create many short URLs from a streamed JSON array, NDJSON or CSV body
+    (or an uploaded ``file``) and send back the input -> short URL mapping
+    as NDJSON (default) or CSV (``?format=csv``)
+    """
+    if request.method != 'POST':
+        return JsonResponse({"error": "Invalid request"}, status=400)
+
+    try:
+        links = bulk.iter_links(request)
+    except ValueError as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+
+    # Every row is stored here, inside the view; only the spooled results stream
+    results = bulk.bulk_create_links(request.user, links, short_url_base(request))
+    if request.GET.get('format') == 'csv':
+        return FileResponse(
+            bulk.spool(bulk.as_csv(results)), content_type='text/csv',
+            as_attachment=True, filename='short_urls.csv',
+        )
+    return FileResponse(bulk.spool(bulk.as_ndjson(results)), content_type='application/x-ndjson')
+
 # =====================
 # Edit URL
 # =====================
 @login_required
+@writes_to_primary
+@sharding.on_url_shard
 def edit_url(request, id):
-    url_obj = get_object_or_404(Url, id=id, user=request.user)
+    url_obj = get_object_or_404(Url, id=id, user=request.user, deleted_at__isnull=True)
 
     if request.method == 'POST':
         new_link = request.POST.get('link')
         if not new_link:
             return JsonResponse({"error": "URL cannot be empty!"}, status=400)
 
+        try:
+            redirect_type, cache_max_age = parse_redirect_options(request.POST, url_obj)
+        except ValueError as exc:
+            return JsonResponse({"error": str(exc)}, status=400)
+
         url_obj.link = new_link
+        url_obj.redirect_type = redirect_type
+        url_obj.cache_max_age = cache_max_age
+        # Saving purges the cached redirect from the CDN (signals -> edge.purge)
         url_obj.save()
-        return JsonResponse({"success": True, "link": new_link})
+        return JsonResponse({
+            "success": True,
+            "link": new_link,
+            "redirect_type": redirect_type,
+            "cache_max_age": cache_max_age,
+        })
 
     return JsonResponse({"error": "Invalid request"}, status=400)
 
@@ -119,15 +201,76 @@ def edit_url(request, id):
 # Delete URL
 # =====================
 @login_required
+@writes_to_primary
+@sharding.on_url_shard
 def delete_url(request, id):
-    url_obj = get_object_or_404(Url, id=id, user=request.user)
+    url_obj = get_object_or_404(Url, id=id, user=request.user, deleted_at__isnull=True)
 
     if request.method == 'POST':
-        url_obj.delete()
+        # Hide the link now; its clicks are purged in the background
+        purge.mark_deleted(url_obj)
+        purge.schedule_purge(url_obj.id)
         return JsonResponse({"success": True})
 
     return JsonResponse({"error": "Invalid request"}, status=400)
 
+# ================================
+# Helper Function: Redirect Options
+# ================================
+def parse_redirect_options(data, url_obj=None):
+    """
+    ``redirect_type`` and ``cache_max_age`` from submitted form data; fields
+    that were not sent keep the link's current values. Raises ValueError.
+    """
+    redirect_type = url_obj.redirect_type if url_obj else Url.FOUND
+    cache_max_age = url_obj.cache_max_age if url_obj else None
+
+    if 'redirect_type' in data:
+        try:
+            redirect_type = int(data['redirect_type'])
+        except (TypeError, ValueError):
+            redirect_type = None
+        if redirect_type not in dict(Url.REDIRECT_TYPES):
+            raise ValueError("Redirect type must be 301, 302 or 307!")
+
+    if 'cache_max_age' in data:
+        value = (data['cache_max_age'] or '').strip()
+        if not value:
+            cache_max_age = None
+        else:
+            try:
+                cache_max_age = int(value)
+            except ValueError:
+                cache_max_age = -1
+            if not 0 <= cache_max_age <= edge.MAX_CACHE_MAX_AGE:
+                raise ValueError("Cache max-age must be a whole number of seconds!")
+
+    return redirect_type, cache_max_age
+
+# ================================
+# Helper Function: Click Details
+# ================================
+def get_click_details(request, url_id):
+    """Collect the UrlClick field values for a redirect"""
+    ua_string = request.META.get('HTTP_USER_AGENT', '')
+
+    # Parsing can be deferred to the batch writer or an offline job
+    if settings.SHORTNER_UA_PARSING == useragents.REQUEST:
+        with metrics.timed('ua'):
+            platform, browser, device = useragents.parse_user_agent(ua_string)
+    else:
+        platform = browser = device = None
+
+    return {
+        'url_id': url_id,
+        'ip_address': get_client_ip(request),
+        'user_agent': ua_string or '',
+        'platform': platform,
+        'browser': browser,
+        'device': device,
+        'created_at': timezone.now(),
+    }
+
 # ================================
 # Redirect Short URL
 # ================================
@@ -136,53 +279,161 @@ def redirect_short_url(request, uuid):
     Redirect short URL to the original link
     and log click details
     """
-    # Get URL object
-    url_obj = get_object_or_404(Url, uuid=uuid, is_active=True)
+    if settings.SHORTNER_REDIRECT_ONLY:
+        return snapshot_redirect(uuid)
 
-    # Atomic click count increment
-    Url.objects.filter(pk=url_obj.pk).update(click_count=F('click_count') + 1)
+    # Resolve the code through the redirect cache
+    entry = cache.resolve(uuid)
+    if entry is None or not entry[2]:
+        raise Http404("Short URL not found")
+    url_id, link, is_active, redirect_type, cache_max_age = entry
 
-    # Parse user agent
-    ua_string = request.META.get('HTTP_USER_AGENT', '')
-    ua = parse(ua_string)
+    # Queue click details; the batch writer saves them and bumps click_count.
+    # Clicks on edge-cached redirects are reported by the CDN instead.
+    if not edge.counted_at_edge(redirect_type, cache_max_age):
+        click = get_click_details(request, url_id)
+        with metrics.timed('click'):
+            record_click(**click)
 
-    # Save click details safely
-    UrlClick.objects.create(
-        url=url_obj,
-        ip_address=get_client_ip(request),
-        user_agent=ua_string or '',
-        platform=getattr(ua.os, 'family', '') or '',
-        browser=getattr(ua.browser, 'family', '') or '',
-        device=getattr(ua.device, 'family', '') or '',
-    )
+    # Redirect to original URL with the link's status and cache headers
+    return edge.apply_headers(redirect(link), url_id, redirect_type, cache_max_age)
 
-    # Redirect to original URL
-    return redirect(url_obj.link)
+
+async def aredirect_short_url(request, uuid):
+    """
+    Async version of redirect_short_url, used when served under ASGI
+    (SHORTNER_ASYNC_REDIRECT) so redirects never leave the event loop
+    """
+    if settings.SHORTNER_REDIRECT_ONLY:
+        return snapshot_redirect(uuid)
+
+    entry = await cache.aresolve(uuid)
+    if entry is None or not entry[2]:
+        raise Http404("Short URL not found")
+    url_id, link, is_active, redirect_type, cache_max_age = entry
+
+    if not edge.counted_at_edge(redirect_type, cache_max_age):
+        click = get_click_details(request, url_id)
+        with metrics.timed('click'):
+            await arecord_click(**click)
+
+    return edge.apply_headers(redirect(link), url_id, redirect_type, cache_max_age)
+
+
+def snapshot_redirect(uuid):
+    """
+    Redirect from the memory-mapped snapshot (SHORTNER_REDIRECT_ONLY):
+    no database access, so no click is recorded here
+    """
+    try:
+        entry = snapshot.resolve(uuid)
+    except snapshot.SnapshotUnavailable:
+        return HttpResponse("Redirect snapshot unavailable", status=503, content_type='text/plain')
+    if entry is None:
+        raise Http404("Short URL not found")
+    url_id, link, is_active, redirect_type, cache_max_age = entry
+    return edge.apply_headers(redirect(link), url_id, redirect_type, cache_max_age)
 
 
 @login_required
 @login_required
+@read_from_replica
+@sharding.on_url_shard
 def clicks_url(request, id):  # <- 'id' comes from the URL pattern
     # Only show URLs belonging to the logged-in user
-    url_obj = get_object_or_404(Url, id=id, user=request.user)
-
-    # Get all clicks for this URL
-    clicks = UrlClick.objects.filter(url=url_obj).order_by('-created_at')
+    url_obj = get_object_or_404(Url, id=id, user=request.user, deleted_at__isnull=True)
+
+    # One keyset page of clicks for this URL
+    try:
+        clicks, next_cursor = keyset_page(
+            UrlClick.objects.filter(url=url_obj),
+            request.GET.get('cursor'),
+            settings.SHORTNER_CLICKS_PAGE_SIZE,
+        )
+    except ValueError:
+        return redirect('clicks_url', id=url_obj.id)
 
     context = {
         'url': url_obj,
+        'short_url': url_obj.short_url(request),
         'clicks': clicks,
+        'next_cursor': next_cursor,
+        'is_first_page': not request.GET.get('cursor'),
+        'fragment_ttl': settings.SHORTNER_FRAGMENT_CACHE_TTL,
     }
     return render(request, 'shortner/clicks.html', context)
 
 
 @login_required
+@read_from_replica
+@sharding.on_url_shard
+def clicks_analytics(request, id):
+    """
+    Click series and platform/browser/device breakdowns for a URL, read
+    only from the pre-aggregated rollups, plus estimated unique visitors
+    and bot hits. The range is the last ``days`` days (0 = all time) or the
+    UTC dates ``from``..``to`` (inclusive).
+    """
+    url_obj = get_object_or_404(Url, id=id, user=request.user, deleted_at__isnull=True)
+
+    period = request.GET.get('period', ClickRollup.DAY)
+    if period not in (ClickRollup.HOUR, ClickRollup.DAY):
+        return JsonResponse({"error": "Invalid period"}, status=400)
+    try:
+        days = int(request.GET.get('days', 30))
+        first_day = date.fromisoformat(request.GET['from']) if request.GET.get('from') else None
+        last_day = date.fromisoformat(request.GET['to']) if request.GET.get('to') else None
+    except ValueError:
+        return JsonResponse({"error": "Invalid range"}, status=400)
+
+    if first_day or last_day:
+        start = datetime.combine(first_day, time.min, dt_timezone.utc) if first_day else None
+        end = datetime.combine(last_day + timedelta(days=1), time.min, dt_timezone.utc) if last_day else None
+    else:
+        start = timezone.now() - timedelta(days=days) if days > 0 else None
+        end = None
+
+    analytics = rollups.url_analytics(url_obj, period=period, start=start, end=end)
+    first_day = start.astimezone(dt_timezone.utc).date() if start else None
+    end_day = end.date() if end else None
+    if settings.SHORTNER_UNIQUE_VISITORS:
+        analytics['unique_visitors'] = visitors.unique_visitors(url_obj.id, start=first_day, end=end_day)
+    analytics['bot_hits'] = bots.bot_hits(url_obj.id, start=first_day, end=end_day)
+    return JsonResponse(analytics)
+
+
+@login_required
+@read_from_replica
+@sharding.on_url_shard
+def export_clicks(request, id):
+    """
+    Stream every click of a URL as CSV (default) or NDJSON (?format=ndjson)
+    """
+    url_obj = get_object_or_404(Url, id=id, user=request.user, deleted_at__isnull=True)
+    clicks = export.iter_clicks(url_obj)
+
+    if request.GET.get('format') == 'ndjson':
+        response = StreamingHttpResponse(export.as_ndjson(clicks), content_type='application/x-ndjson')
+        extension = 'ndjson'
+    else:
+        response = StreamingHttpResponse(export.as_csv(clicks), content_type='text/csv')
+        extension = 'csv'
+    response['Content-Disposition'] = f'attachment; filename="clicks-{url_obj.uuid}.{extension}"'
+    return response
+
+
+@login_required
+@writes_to_primary
 def delete_click(request, id):
     """
-    Delete a single click record via AJAX
+    Delete a single click record via AJAX (``?url=`` is the link's id,
+    which locates its shard)
     """
     if request.method == 'POST':
-        click = get_object_or_404(UrlClick, id=id)
+        alias = sharding.for_id(request.GET.get('url')) if sharding.enabled() else None
+        if sharding.enabled() and alias is None:
+            raise Http404("Click not found")
+        click = get_object_or_404(UrlClick.objects.using(alias), id=id)
 
         # Optional: make sure this click belongs to a URL of the logged-in user
         if click.url.user != request.user:
@@ -193,3 +444,63 @@ def delete_click(request, id):
 
     # If not POST
     return JsonResponse({'success': False, 'error': 'Invalid request method'}, status=400)
+
+
+# ================================
+# Edge Click Beacon
+# ================================
+@csrf_exempt
+def click_beacon(request):
+    """
+    Clicks on redirects served from the CDN, reported by the edge (see
+    shortner/edge.py). Needs ``Authorization: Bearer <SHORTNER_EDGE_TOKEN>``.
+    Not pinned to the primary: the edge has no session to pin.
+    """
+    token = settings.SHORTNER_EDGE_TOKEN
+    if not settings.SHORTNER_EDGE_CLICKS or not token:
+        raise Http404
+    if request.META.get('HTTP_AUTHORIZATION', '') != f'Bearer {token}':
+        raise Http404
+    if request.method != 'POST':
+        return JsonResponse({"error": "Invalid request"}, status=400)
+
+    try:
+        reports = edge.parse_report(request.body)
+    except ValueError as exc:
+        return JsonResponse({"error": f"Invalid report: {exc}"}, status=400)
+
+    recorded = 0
+    for report in reports:
+        try:
+            click = edge.edge_click(
+                str(report.get('code', '')),
+                report.get('ip'),
+                report.get('user_agent'),
+                edge.parse_time(report.get('time')),
+            )
+        except (TypeError, ValueError):
+            click = None
+        if click is not None:
+            record_click(**click)
+            recorded += 1
+    return JsonResponse({"recorded": recorded, "ignored": len(reports) - recorded}, status=202)
+
+# ================================
+# Metrics (Prometheus)
+# ================================
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint. Needs ``Authorization: Bearer
+    <SHORTNER_METRICS_TOKEN>`` when a token is set, otherwise only answers
+    loopback clients.
+    """
+    if not settings.SHORTNER_METRICS:
+        raise Http404
+    token = settings.SHORTNER_METRICS_TOKEN
+    if token:
+        allowed = request.META.get('HTTP_AUTHORIZATION', '') == f'Bearer {token}'
+    else:
+        allowed = request.META.get('REMOTE_ADDR') in ('127.0.0.1', '::1')
+    if not allowed:
+        raise Http404
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
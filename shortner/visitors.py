@@ -0,0 +1,141 @@
+"""
+Unique visitors per link.
+
+A visitor is a distinct ``ip_address`` + ``user_agent`` pair. Each link
+has HyperLogLog sketches (``VisitorSketch``, see shortner/hll.py) per day,
+per month and over all time. ``add_clicks`` folds every batch written by
+``clicks.write_clicks`` into them, so no query ever scans the clicks.
+
+The all-time sketch stores its estimate, which the dashboard lists. For a
+date range, ``unique_visitors`` merges the whole months inside it and the
+days at its edges (at most ~60 day sketches). Estimates are within
+``hll.relative_error()`` (1.6%) of the true count about two times in
+three, and within three times that almost always. Deleting single clicks
+does not lower the estimates.
+
+Adding a click twice changes nothing, so ``manage.py backfill_visitors``
+can fold in clicks written before sketches existed at any time.
+"""
+from collections import defaultdict
+from datetime import timedelta, timezone as dt_timezone
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import sharding
+from .hll import DEFAULT_PRECISION, HyperLogLog, hash_value, relative_error
+from .models import VisitorSketch
+
+
+def visitor_key(click):
+    return f"{click['ip_address']}|{click.get('user_agent') or ''}"
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def next_month(day):
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+# ================================
+# Updating
+# ================================
+def add_clicks(clicks):
+    """Fold clicks (``UrlClick`` field values) into their links' sketches"""
+    probe = HyperLogLog(DEFAULT_PRECISION)
+    # (url_id, period, bucket) -> {register: rank} for this batch
+    updates = defaultdict(dict)
+    for click in clicks:
+        index, rank = probe.position(hash_value(visitor_key(click)))
+        day = (click.get('created_at') or timezone.now()).astimezone(dt_timezone.utc).date()
+        for period, bucket in (
+            (VisitorSketch.DAY, day),
+            (VisitorSketch.MONTH, month_start(day)),
+            (VisitorSketch.ALL, VisitorSketch.ALL_BUCKET),
+        ):
+            ranks = updates[(click['url_id'], period, bucket)]
+            if rank > ranks.get(index, 0):
+                ranks[index] = rank
+    if not updates:
+        return 0
+
+    empty = HyperLogLog(DEFAULT_PRECISION).to_bytes()
+    with transaction.atomic(using=sharding.current()):
+        # Create missing rows first, then lock them all (in id order, so
+        # concurrent writers cannot deadlock) and merge in this batch
+        VisitorSketch.objects.bulk_create(
+            [
+                VisitorSketch(url_id=url_id, period=period, bucket=bucket, sketch=empty)
+                for url_id, period, bucket in updates
+            ],
+            ignore_conflicts=True,
+        )
+        rows = (
+            VisitorSketch.objects.select_for_update()
+            .filter(
+                url_id__in={url_id for url_id, _, _ in updates},
+                bucket__in={bucket for _, _, bucket in updates},
+            )
+            .order_by('pk')
+        )
+        changed = 0
+        for row_id, url_id, period, bucket, data in rows.values_list('pk', 'url_id', 'period', 'bucket', 'sketch'):
+            ranks = updates.get((url_id, period, bucket))
+            if ranks is None:
+                continue
+            sketch = HyperLogLog.from_bytes(data)
+            # Returning visitors usually leave the sketch as it was
+            if sketch.update_registers(ranks):
+                fields = {'sketch': sketch.to_bytes()}
+                if period == VisitorSketch.ALL:
+                    fields['visitors'] = sketch.count()
+                VisitorSketch.objects.filter(pk=row_id).update(**fields)
+                changed += 1
+    return changed
+
+
+# ================================
+# Reading
+# ================================
+def visitors_by_url(url_ids):
+    """All-time estimates for these links, ``{url_id: visitors}``"""
+    return dict(
+        VisitorSketch.objects.filter(url_id__in=url_ids, period=VisitorSketch.ALL)
+        .values_list('url_id', 'visitors')
+    )
+
+
+def unique_visitors(url_id, start=None, end=None):
+    """
+    Estimated distinct visitors of a link on days ``start <= day < end``
+    (dates, UTC; None = unbounded), with the relative standard error
+    """
+    error = relative_error(DEFAULT_PRECISION)
+    sketches = VisitorSketch.objects.filter(url_id=url_id)
+    if start is None and end is None:
+        visitors = sketches.filter(period=VisitorSketch.ALL).values_list('visitors', flat=True).first()
+        return {'visitors': visitors or 0, 'error': error}
+
+    # Whole months in [first_month, last_month), days around them
+    first_month = None if start is None else (start if start.day == 1 else next_month(start))
+    last_month = None if end is None else month_start(end)
+    if first_month is not None and last_month is not None and first_month >= last_month:
+        condition = Q(period=VisitorSketch.DAY, bucket__gte=start, bucket__lt=end)
+    else:
+        condition = Q(period=VisitorSketch.MONTH)
+        edges = Q()
+        if first_month is not None:
+            condition &= Q(bucket__gte=first_month)
+            edges |= Q(period=VisitorSketch.DAY, bucket__gte=start, bucket__lt=first_month)
+        if last_month is not None:
+            condition &= Q(bucket__lt=last_month)
+            edges |= Q(period=VisitorSketch.DAY, bucket__gte=last_month, bucket__lt=end)
+        condition |= edges
+
+    merged = HyperLogLog(DEFAULT_PRECISION)
+    for data in sketches.filter(condition).values_list('sketch', flat=True):
+        merged.merge(HyperLogLog.from_bytes(data))
+    return {'visitors': merged.count(), 'error': error}
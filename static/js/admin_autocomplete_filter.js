@@ -0,0 +1,8 @@
+'use strict';
+// Changelist filters rendered as autocomplete selects (shortner.admin.AutocompleteFilter):
+// choosing or clearing a value reloads the changelist with the filter applied.
+django.jQuery(document).on('change', '.autocomplete-filter select', function() {
+    window.location.search = this.value
+        ? this.dataset.filterUrl.replace('__value__', encodeURIComponent(this.value))
+        : this.dataset.clearUrl;
+});